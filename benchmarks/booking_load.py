@@ -0,0 +1,366 @@
+"""Нагрузочный прогон API онлайн-записи webapp.
+
+Сколько одновременных пользователей выдерживают /api/booking/available_dates,
+/api/booking/slots и /api/booking/create, прежде чем задержки разваливаются.
+Запускать на отдельной (тестовой) базе:
+
+    # 1. наполнить базу: пользователи с анкетами, записи и расписание на 30 дней
+    python -m benchmarks.booking_load seed --users 2000 --bookings-per-day 6
+
+    # 2. поднять webapp (gunicorn/flask) и прогнать нагрузку
+    python -m benchmarks.booking_load run --url http://127.0.0.1:5000 \\
+        --concurrency 50 --duration 60 --out result.json
+
+    # 3. убрать сгенерированные данные
+    python -m benchmarks.booking_load cleanup
+
+Уведомления админам при создании записи уходят через outbox. Чтобы не
+слать их в Telegram, направьте webapp на фейковый сервер
+(TELEGRAM_API_URL, см. benchmarks/fake_bot_api.py) — тогда в прогон входит
+и работа диспетчера. Без BOT_TOKEN диспетчер не запускается и уведомления
+копятся в notification_outbox; после прогона их убирает cleanup.
+
+Результат — JSON: по каждому эндпоинту число запросов, ошибки, конфликты
+(409 на create — ожидаемая гонка за слот, не ошибка), p50/p95/p99/max
+задержки в мс и throughput; плюс конфигурация прогона и git-коммит,
+чтобы сравнивать прогоны между коммитами.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import aiohttp
+
+from telegram_bot import db
+from telegram_bot.env import local_timezone
+from telegram_webapp.services_text import BOOKING_SERVICES
+
+# Диапазон user_id сгенерированных пользователей (не пересекается с реальными Telegram id)
+SEED_USER_BASE = 9_000_000_000
+# updated_at сгенерированного расписания — по нему cleanup отличает его от настоящего
+SEED_AVAILABILITY_MARK = 0.0
+SEED_SPECIALIST = "loadtest"
+# username сгенерированных пользователей: <prefix><user_id>
+SEED_USERNAME_PREFIX = "loadtest_"
+STEP_MIN = 30
+WORK_HOURS = (10, 21)
+HORIZON_DAYS = 30
+
+ENDPOINTS = ("available_dates", "slots", "create")
+
+
+# --- seed / cleanup ---
+
+
+def _days(horizon: int) -> list[str]:
+    base = datetime.now(local_timezone).date()
+    return [(base + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(horizon + 1)]
+
+
+def _grid(date_str: str) -> list[float]:
+    day = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=local_timezone)
+    return [
+        day.replace(hour=m // 60, minute=m % 60).timestamp()
+        for m in range(WORK_HOURS[0] * 60, WORK_HOURS[1] * 60, STEP_MIN)
+    ]
+
+
+def seed(users: int, bookings_per_day: int, closed_share: float, custom_share: float, horizon: int) -> dict:
+    rnd = random.Random(42)
+    services = [s for s in BOOKING_SERVICES if s.get("id") is not None]
+    days = _days(horizon)
+    user_ids = [str(SEED_USER_BASE + i) for i in range(users)]
+    now = time.time()
+
+    bookings = []
+    for date_str in days:
+        busy_until = 0.0
+        for start_ts in sorted(rnd.sample(_grid(date_str), min(bookings_per_day, len(_grid(date_str))))):
+            service = rnd.choice(services)
+            end_ts = start_ts + int(service["duration_min"]) * 60
+            if start_ts < busy_until:
+                continue
+            busy_until = end_ts
+            bookings.append((
+                int(rnd.choice(user_ids)), start_ts, end_ts, json.dumps([service], ensure_ascii=False),
+                int(service["price"]), SEED_SPECIALIST, now,
+            ))
+
+    availability = []
+    for date_str in days:
+        for service in services:
+            roll = rnd.random()
+            if roll < closed_share:
+                slots = []
+            elif roll < closed_share + custom_share:
+                grid = [datetime.fromtimestamp(ts, local_timezone).strftime("%H:%M") for ts in _grid(date_str)]
+                slots = sorted(rnd.sample(grid, len(grid) // 2))
+            else:
+                continue
+            availability.append((int(service["id"]), date_str, json.dumps(slots), SEED_AVAILABILITY_MARK))
+
+    inserted = {}
+    with db.pool.connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.executemany(
+                    "INSERT INTO users (user_id, username, full_name, promocode) VALUES (%s, %s, %s, %s) "
+                    "ON CONFLICT (user_id) DO NOTHING",
+                    [(uid, f"{SEED_USERNAME_PREFIX}{uid}", f"Load {uid}", db.generate_promocode()) for uid in user_ids],
+                )
+                # rowcount после executemany — сумма по всем строкам, без пропущенных ON CONFLICT
+                inserted["users"] = cur.rowcount
+                cur.executemany(
+                    "INSERT INTO user_profile (user_id, full_name) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
+                    [(uid, f"Load {uid}") for uid in user_ids],
+                )
+                # ON CONFLICT DO NOTHING пропускает и пересечения (bookings_no_overlap)
+                cur.executemany(
+                    "INSERT INTO bookings (user_id, start_ts, end_ts, services, total_price, specialist, created_at) "
+                    "VALUES (%s, %s, %s, %s::jsonb, %s, %s, %s) ON CONFLICT DO NOTHING",
+                    bookings,
+                )
+                inserted["bookings"] = cur.rowcount
+                cur.executemany(
+                    "INSERT INTO booking_service_availability (service_id, date, slots, updated_at) "
+                    "VALUES (%s, %s, %s::jsonb, %s) ON CONFLICT (service_id, date) DO NOTHING",
+                    availability,
+                )
+                inserted["availability"] = cur.rowcount
+    return {**inserted, "days": len(days)}
+
+
+def cleanup(users: int) -> None:
+    lo, hi = SEED_USER_BASE, SEED_USER_BASE + users
+    with db.pool.connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bookings WHERE user_id >= %s AND user_id < %s", (lo, hi))
+                # Уведомления админам о записях прогона, так и не отправленные
+                cur.execute(
+                    "DELETE FROM notification_outbox WHERE status = 'pending' AND payload->>'text' LIKE %s",
+                    (f"%@{SEED_USERNAME_PREFIX}%",),
+                )
+                cur.execute(
+                    "DELETE FROM booking_service_availability WHERE updated_at = %s", (SEED_AVAILABILITY_MARK,)
+                )
+                cur.execute(
+                    "DELETE FROM user_profile WHERE user_id::text = ANY(%s)", ([str(i) for i in range(lo, hi)],)
+                )
+                cur.execute("DELETE FROM users WHERE user_id::text = ANY(%s)", ([str(i) for i in range(lo, hi)],))
+
+
+# --- load ---
+
+
+def _percentile(sorted_values: list[float], q: float) -> float | None:
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return round(sorted_values[k], 2)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.conflicts: dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.statuses: dict[str, dict[str, int]] = {name: {} for name in ENDPOINTS}
+
+    def add(self, endpoint: str, started: float, status: int, conflict: bool = False, error: bool = False) -> None:
+        self.latencies[endpoint].append((time.perf_counter() - started) * 1000)
+        key = str(status)
+        self.statuses[endpoint][key] = self.statuses[endpoint].get(key, 0) + 1
+        if conflict:
+            self.conflicts[endpoint] += 1
+        if error:
+            self.errors[endpoint] += 1
+
+    def report(self, elapsed: float) -> dict:
+        out = {}
+        total = errors = 0
+        for name in ENDPOINTS:
+            values = sorted(self.latencies[name])
+            total += len(values)
+            errors += self.errors[name]
+            out[name] = {
+                "requests": len(values),
+                "errors": self.errors[name],
+                "error_rate": round(self.errors[name] / len(values), 4) if values else 0.0,
+                "conflicts": self.conflicts[name],
+                "statuses": self.statuses[name],
+                "rps": round(len(values) / elapsed, 2) if elapsed else None,
+                "latency_ms": {
+                    "p50": _percentile(values, 50),
+                    "p95": _percentile(values, 95),
+                    "p99": _percentile(values, 99),
+                    "mean": round(sum(values) / len(values), 2) if values else None,
+                    "max": round(values[-1], 2) if values else None,
+                },
+            }
+        out["total"] = {
+            "requests": total,
+            "errors": errors,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "rps": round(total / elapsed, 2) if elapsed else None,
+        }
+        return out
+
+
+def _init_data(user_id: int) -> str:
+    return "user=" + quote(json.dumps({"id": user_id, "username": f"{SEED_USERNAME_PREFIX}{user_id}"}))
+
+
+async def _request(session, stats: Stats, endpoint: str, method: str, url: str, **kwargs) -> dict | None:
+    started = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as r:
+            try:
+                body = await r.json(content_type=None)
+            except ValueError:
+                # 500 от Flask приходит HTML-страницей
+                body = None
+            # 409 на create — слот заняли параллельно, это ожидаемо
+            conflict = endpoint == "create" and r.status == 409
+            error = r.status >= 400 and not conflict
+            stats.add(endpoint, started, r.status, conflict=conflict, error=error)
+            return body if r.status == 200 else None
+    except Exception:
+        stats.add(endpoint, started, 0, error=True)
+        return None
+
+
+async def _user_session(args, session, stats: Stats, service_ids: list[int], deadline: float, rnd: random.Random,
+                        counter: dict) -> None:
+    base = args.url.rstrip("/")
+    while time.monotonic() < deadline and (not args.requests or counter["sent"] < args.requests):
+        chosen = rnd.sample(service_ids, k=1 if len(service_ids) < 2 or rnd.random() < 0.8 else 2)
+        ids = ",".join(map(str, chosen))
+
+        counter["sent"] += 1
+        body = await _request(session, stats, "available_dates", "GET", f"{base}/api/booking/available_dates",
+                              params={"service_ids": ids})
+        dates = (body or {}).get("dates") or []
+        if not dates or rnd.random() > args.slots_share:
+            continue
+
+        counter["sent"] += 1
+        body = await _request(session, stats, "slots", "GET", f"{base}/api/booking/slots",
+                              params={"service_ids": ids, "date": rnd.choice(dates)})
+        slots = (body or {}).get("slots") or []
+        if not slots or rnd.random() > args.create_share:
+            continue
+
+        counter["sent"] += 1
+        user_id = SEED_USER_BASE + rnd.randrange(args.users)
+        await _request(session, stats, "create", "POST", f"{base}/api/booking/create", json={
+            "initData": _init_data(user_id),
+            "booking": {"service_ids": chosen, "start_ts": rnd.choice(slots)["start_ts"], "comment": "loadtest"},
+        })
+
+
+async def run_load(args) -> dict:
+    stats = Stats()
+    rnd = random.Random(args.seed)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        async with session.get(f"{args.url.rstrip('/')}/api/booking/services") as r:
+            services = (await r.json(content_type=None)).get("services") or []
+        service_ids = [int(s["id"]) for s in services]
+        if not service_ids:
+            raise SystemExit("no services returned by /api/booking/services")
+
+        counter = {"sent": 0}
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            _user_session(args, session, stats, service_ids, deadline, random.Random(rnd.random()), counter)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.monotonic() - started
+
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "config": {
+            "url": args.url,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "requests": args.requests,
+            "slots_share": args.slots_share,
+            "create_share": args.create_share,
+            "seed": args.seed,
+        },
+        "elapsed_sec": round(elapsed, 3),
+        "endpoints": stats.report(elapsed),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Booking API load test")
+    parser.add_argument("--dsn", default=None, help="Postgres DSN for seed/cleanup (default: POSTGRES_* env)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="insert load-test users, bookings and availability")
+    p_seed.add_argument("--users", type=int, default=1000)
+    p_seed.add_argument("--bookings-per-day", type=int, default=4)
+    p_seed.add_argument("--closed-share", type=float, default=0.05, help="share of (service, day) closed by admin")
+    p_seed.add_argument("--custom-share", type=float, default=0.2, help="share of (service, day) with custom slots")
+    p_seed.add_argument("--horizon", type=int, default=HORIZON_DAYS)
+
+    p_cleanup = sub.add_parser("cleanup", help="delete load-test data")
+    p_cleanup.add_argument("--users", type=int, default=1000)
+
+    p_run = sub.add_parser("run", help="drive the booking endpoints")
+    p_run.add_argument("--url", default="http://127.0.0.1:5000")
+    p_run.add_argument("--concurrency", type=int, default=20, help="simulated users in parallel")
+    p_run.add_argument("--duration", type=float, default=30.0, help="seconds")
+    p_run.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = by duration)")
+    p_run.add_argument("--users", type=int, default=1000, help="seeded users to book as")
+    p_run.add_argument("--slots-share", type=float, default=0.8, help="share of sessions that open slots")
+    p_run.add_argument("--create-share", type=float, default=0.2, help="share of slot views that book")
+    p_run.add_argument("--timeout", type=float, default=30.0)
+    p_run.add_argument("--seed", type=int, default=1)
+    p_run.add_argument("--out", default=None, help="write JSON report here (default: stdout)")
+
+    args = parser.parse_args()
+    if args.dsn:
+        from telegram_bot.db_pool import ConnectionPool
+
+        db.pool = ConnectionPool(args.dsn, max_size=2)
+
+    if args.command == "seed":
+        result = seed(args.users, args.bookings_per_day, args.closed_share, args.custom_share, args.horizon)
+    elif args.command == "cleanup":
+        cleanup(args.users)
+        result = {"ok": True}
+    else:
+        result = asyncio.run(run_load(args))
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if getattr(args, "out", None):
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Фейковый Telegram Bot API для нагрузочных и интеграционных прогонов.
+
+Отвечает на методы, которыми пользуются бот (aiogram) и webapp (outbox):
+getMe, sendMessage, sendPhoto, sendMediaGroup, editMessageText,
+deleteMessage(s), getUpdates, setWebhook/deleteWebhook и т.п. — настоящим
+пользователям ничего не уходит.
+
+    python -m benchmarks.fake_bot_api --port 8081 --latency 40 --rate-limit 30 --record traffic.jsonl
+
+Бот и webapp направляются на него переменной окружения:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081
+
+Возможности:
+- --latency/--jitter: задержка ответа (мс);
+- --rate-limit: общий лимит запросов в секунду, сверх него — 429 с retry_after;
+- --error-rate: доля случайных 429 (retry_after = --retry-after);
+- --blocked: chat_id, для которых отвечаем 403 «bot was blocked by the user»;
+- --record: каждый запрос пишется строкой JSON (время, метод, чат, статус);
+- GET /_stats — счётчики по методам, 429/403, rps и время первого/последнего
+  запроса; POST /_reset — обнулить;
+- POST /_updates — положить апдейты (JSON-список) в очередь getUpdates,
+  чтобы прогнать приём апдейтов ботом.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(
+            self,
+            latency_ms: float = 0.0,
+            jitter_ms: float = 0.0,
+            rate_limit: float = 0.0,
+            error_rate: float = 0.0,
+            retry_after: int = 1,
+            blocked: set[int] | None = None,
+            record_path: str | None = None,
+    ):
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.rate_limit = float(rate_limit)
+        self.error_rate = float(error_rate)
+        self.retry_after = int(retry_after)
+        self.blocked = set(blocked or ())
+        self._record = open(record_path, "a", encoding="utf-8") if record_path else None
+        self._updates: asyncio.Queue = asyncio.Queue()
+        self._update_id = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.calls: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.messages = 0
+        self.first_at: float | None = None
+        self.last_at: float | None = None
+        self._message_id = 0
+        # Окно текущей секунды для --rate-limit
+        self._window = 0
+        self._window_count = 0
+
+    # --- helpers ---
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            try:
+                return await request.json()
+            except ValueError:
+                return {}
+        form = await request.post()
+        params = {}
+        for key, value in form.items():
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _next_message(self, chat_id, **fields) -> dict:
+        self._message_id += 1
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            chat_id = 0
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            **fields,
+        }
+
+    @staticmethod
+    def _photo(file_id) -> list[dict]:
+        file_id = file_id if isinstance(file_id, str) else "fake-file-id"
+        return [{"file_id": file_id, "file_unique_id": file_id[-16:], "width": 800, "height": 600}]
+
+    def _limited(self) -> bool:
+        if self.rate_limit <= 0:
+            return False
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window, self._window_count = window, 0
+        self._window_count += 1
+        return self._window_count > self.rate_limit
+
+    def _log(self, method: str, chat_id, status: int, started: float) -> None:
+        self.calls[method] += 1
+        self.statuses[status] += 1
+        now = time.time()
+        self.first_at = self.first_at or now
+        self.last_at = now
+        if self._record:
+            self._record.write(json.dumps({
+                "ts": now, "method": method, "chat_id": chat_id, "status": status,
+                "ms": round((time.monotonic() - started) * 1000, 2),
+            }) + "\n")
+            self._record.flush()
+
+    # --- API ---
+
+    async def handle(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        method = request.match_info["method"]
+        params = await self._params(request)
+        chat_id = params.get("chat_id")
+
+        if method.lower() == "getupdates":
+            return await self._get_updates(params, method, started)
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if self._limited() or (self.error_rate and random.random() < self.error_rate):
+            self._log(method, chat_id, 429, started)
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        try:
+            blocked = int(chat_id) in self.blocked
+        except (TypeError, ValueError):
+            blocked = False
+        if blocked:
+            self._log(method, chat_id, 403, started)
+            return web.json_response({
+                "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user",
+            }, status=403)
+
+        result = self._result(method, params)
+        self._log(method, chat_id, 200, started)
+        return web.json_response({"ok": True, "result": result})
+
+    def _result(self, method: str, params: dict):
+        name = method.lower()
+        chat_id = params.get("chat_id")
+        if name == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if name == "sendmessage":
+            self.messages += 1
+            return self._next_message(chat_id, text=str(params.get("text") or ""))
+        if name == "sendphoto":
+            self.messages += 1
+            return self._next_message(chat_id, photo=self._photo(params.get("photo")), caption=params.get("caption"))
+        if name == "sendmediagroup":
+            media = params.get("media") or []
+            self.messages += len(media)
+            return [self._next_message(chat_id, photo=self._photo(m.get("media")), media_group_id="1") for m in media]
+        if name in ("editmessagetext", "editmessagecaption", "editmessagereplymarkup"):
+            return self._next_message(chat_id, text=str(params.get("text") or ""))
+        # deleteMessage(s), setWebhook, deleteWebhook, answerCallbackQuery, ...
+        return True
+
+    async def _get_updates(self, params: dict, method: str, started: float) -> web.Response:
+        try:
+            timeout = min(float(params.get("timeout") or 0), 30.0)
+        except (TypeError, ValueError):
+            timeout = 0.0
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self._updates.get(), timeout=timeout) if timeout else
+                           self._updates.get_nowait())
+        except (asyncio.TimeoutError, asyncio.QueueEmpty):
+            pass
+        while updates and not self._updates.empty() and len(updates) < 100:
+            updates.append(self._updates.get_nowait())
+        self._log(method, None, 200, started)
+        return web.json_response({"ok": True, "result": updates})
+
+    # --- control ---
+
+    async def put_updates(self, request: web.Request) -> web.Response:
+        items = await request.json()
+        for update in items if isinstance(items, list) else [items]:
+            self._update_id += 1
+            update.setdefault("update_id", self._update_id)
+            await self._updates.put(update)
+        return web.json_response({"ok": True, "queued": self._updates.qsize()})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        elapsed = (self.last_at - self.first_at) if self.first_at and self.last_at else 0.0
+        total = sum(self.calls.values())
+        return web.json_response({
+            "calls": dict(self.calls),
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "messages": self.messages,
+            "requests": total,
+            "first_at": self.first_at,
+            "last_at": self.last_at,
+            "rps": round(total / elapsed, 2) if elapsed > 0 else None,
+        })
+
+    async def reset_stats(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+
+def create_app(api: FakeBotAPI) -> web.Application:
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app.router.add_get("/_stats", api.stats)
+    app.router.add_post("/_reset", api.reset_stats)
+    app.router.add_post("/_updates", api.put_updates)
+    app.router.add_route("*", "/bot{token}/{method}", api.handle)
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="response latency, ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency jitter, ms")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second before 429 (0 = off)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of random 429 responses (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after in 429 responses, s")
+    parser.add_argument("--blocked", default="", help="comma-separated chat ids that answer 403")
+    parser.add_argument("--record", default=None, help="append every request as a JSON line to this file")
+    args = parser.parse_args()
+
+    blocked = {int(x) for x in args.blocked.split(",") if x.strip()}
+    api = FakeBotAPI(
+        latency_ms=args.latency,
+        jitter_ms=args.jitter,
+        rate_limit=args.rate_limit,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        blocked=blocked,
+        record_path=args.record,
+    )
+    web.run_app(create_app(api), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
 import asyncio
 import locale
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
+import time
 
+from aiogram import Bot
 from aiogram.filters import ExceptionTypeFilter
 from aiogram_dialog import DialogManager, setup_dialogs
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from aiogram_dialog.api.exceptions import UnknownIntent
+from aiohttp import web
 
-from telegram_bot import text_message
+from telegram_bot import broadcaster, db, env, migrations, text_message
 from telegram_bot.env import dp, bot
 from telegram_bot.handler import message, callback
 from telegram_bot.keyboards import inline_markup
@@ -22,7 +30,7 @@ async def on_unknown_intent(event, dialog_manager: DialogManager):
     await callback_query.message.edit_text(text=text_message.TRY_AGAIN_ERROR, reply_markup=inline_markup.get_delete_message_keyboard())
     # await message.send_menu(message=callback_query.message, state=dialog_manager.__dict__['_data']['state'])
 
-async def main():
+def setup_dispatcher():
     dp.update.outer_middleware(MediaGroupMiddleware())
     dp.include_routers(
         message.router,
@@ -36,14 +44,151 @@ async def main():
         calendar.dialog,
     )
     setup_dialogs(dp)
-    start_scheduler()
     dp.errors.register(
         on_unknown_intent,
         ExceptionTypeFilter(UnknownIntent),
     )
 
+
+async def on_startup(leader: bool):
+    # Схема БД обновляется один раз при старте, а не перед запросами
+    # (advisory lock: воркеры, стартующие одновременно, не мешают друг другу)
+    await migrations.run_migrations()
+    await db.load_images()
+    if not leader:
+        return
+    # Напоминания и рассылки — только в одном процессе, иначе они задвоятся
+    start_scheduler()
+    # Рассылки из всех воркеров отправляет лидер; прерванные перезапуском
+    # продолжаются с оставшихся получателей после истечения аренды
+    broadcaster.start_dispatcher()
+
+
+async def run_polling():
+    setup_dispatcher()
+    await on_startup(leader=True)
+    # Если раньше был вебхук — отключаем его, но накопившиеся апдейты не выбрасываем
+    await bot.delete_webhook(drop_pending_updates=False)
     print((await bot.get_me()).username + " запущен")
-    await dp.start_polling(bot, skip_updates=True)
+    await dp.start_polling(bot)
+
+
+def serve_webhook(worker: int = 0):
+    """Один воркер: aiohttp-сервер, принимающий апдейты от Telegram."""
+
+    leader = env.bot_leader and worker == 0
+    setup_dispatcher()
+
+    async def startup(bot: Bot):
+        await on_startup(leader)
+        if leader:
+            # Апдейты, пришедшие во время деплоя, Telegram доставит после запуска
+            await bot.set_webhook(
+                url=env.webhook_base_url + env.webhook_path,
+                secret_token=env.webhook_secret,
+                max_connections=env.webhook_max_connections,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=False,
+            )
+            print((await bot.get_me()).username + " запущен (webhook)")
+
+    dp.startup.register(startup)
+
+    app = web.Application()
+    # Отвечаем Telegram только после обработки: апдейт, не обработанный
+    # из-за остановки воркера, Telegram пришлёт повторно
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=env.webhook_secret,
+        handle_in_background=False,
+    ).register(app, path=env.webhook_path)
+    setup_application(app, dp, bot=bot)
+    web.run_app(
+        app,
+        host=env.webhook_host,
+        port=env.webhook_port,
+        reuse_port=env.bot_workers > 1,
+        print=None,
+    )
+
+
+# Упавший воркер перезапускается. Если он падает сразу после старта
+# WORKER_MAX_FAST_FAILS раз подряд (порт занят, нет БД…), перезапускать
+# бессмысленно: останавливаем всех и выходим с ошибкой — дальше решает
+# менеджер процессов (systemd, docker restart policy).
+WORKER_RESTART_DELAY = 1.0
+WORKER_MIN_UPTIME = 30.0
+WORKER_MAX_FAST_FAILS = 5
+
+
+def _worker_main(worker: int):
+    # Обработчики сигналов родителя воркеру не нужны: aiohttp ставит свои
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    serve_webhook(worker)
+
+
+def run_webhook():
+    if not env.webhook_base_url:
+        raise RuntimeError("WEBHOOK_BASE_URL is not set in environment")
+    if env.bot_workers == 1:
+        serve_webhook()
+        return
+
+    # Воркеры слушают один порт (SO_REUSEPORT), ядро распределяет соединения между ними.
+    # Воркер 0 — лидер, поэтому перезапускается под тем же номером.
+    ctx = multiprocessing.get_context("fork")
+    workers: dict[int, tuple[multiprocessing.Process, float]] = {}
+    fast_fails = [0] * env.bot_workers
+    stopping = False
+    failed = False
+
+    def start(worker: int):
+        p = ctx.Process(target=_worker_main, args=(worker,), name=f"bot-worker-{worker}")
+        p.start()
+        workers[worker] = (p, time.monotonic())
+
+    def stop(signum=None, frame=None):
+        nonlocal stopping
+        stopping = True
+        for p, _ in workers.values():
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(env.bot_workers):
+        start(i)
+
+    while not stopping:
+        multiprocessing.connection.wait([p.sentinel for p, _ in workers.values()], timeout=1.0)
+        for i, (p, started) in list(workers.items()):
+            if stopping or p.is_alive():
+                continue
+            fast_fails[i] = fast_fails[i] + 1 if time.monotonic() - started < WORKER_MIN_UPTIME else 0
+            if fast_fails[i] >= WORKER_MAX_FAST_FAILS:
+                print(f"{p.name} keeps exiting (code {p.exitcode}), stopping all workers")
+                failed = True
+                stop()
+                break
+            print(f"{p.name} exited with code {p.exitcode}, restarting")
+            time.sleep(WORKER_RESTART_DELAY)
+            if not stopping:
+                start(i)
+
+    for p, _ in workers.values():
+        p.join()
+    if failed:
+        sys.exit(1)
+
+
+def main():
+    if env.bot_mode == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(run_polling())
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
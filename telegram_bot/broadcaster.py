@@ -0,0 +1,383 @@
+"""Движок рассылок.
+
+Задание рассылки и получатели лежат в БД (broadcast_jobs / broadcast_recipients),
+поэтому обработчик кнопки «Отправить» (в любом воркере бота) только создаёт
+задание и сразу освобождается. Отправляет рассылки один процесс — лидер
+(см. bot.on_startup): run_dispatcher() забирает новые задания и задания с
+истёкшей арендой, так что после перезапуска рассылка продолжается с
+оставшихся получателей. Пока задание идёт, аренда продлевается; если её
+перехватил другой процесс, отправка здесь останавливается — одному
+получателю не уйдут две копии от двух процессов.
+
+Внутри задания отправляют несколько корутин параллельно. Скорость ограничивают:
+- общий token bucket процесса (лимит Telegram на все чаты, ~30 сообщений/с);
+  все рассылки идут из одного процесса, поэтому это и общий лимит бота;
+- интервал между сообщениями в один чат (лимит ~1 сообщение/с на чат).
+На 429 (TelegramRetryAfter) весь bucket ставится на паузу retry_after —
+Telegram ограничивает бота целиком, а не отдельный чат.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMediaGroup
+from aiogram.types import InputMediaPhoto
+
+from telegram_bot import db, env, text_message
+from telegram_bot.env import bot
+from telegram_bot.keyboards import inline_markup
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает media group с подписью до 1024 символов; длинный текст шлём отдельно
+CAPTION_LIMIT = 900
+PER_CHAT_INTERVAL = 1.0
+MAX_ATTEMPTS = 3
+PAGE_SIZE = 500
+# Как часто сохранять результаты в БД и обновлять прогресс у админа (сек)
+FLUSH_INTERVAL = 5.0
+# Аренда задания (продлевается при каждом сбросе) и период поиска новых заданий
+LEASE_SEC = 60.0
+DISPATCH_INTERVAL = 2.0
+
+
+class TokenBucket:
+    """Token bucket для asyncio: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        # Ждущие обслуживаются по очереди, без «обгона»
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        tokens = min(float(tokens), self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Остановить выдачу токенов (после 429 от Telegram)."""
+
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + float(seconds))
+        self._tokens = 0.0
+        self._updated = max(self._updated, self._paused_until)
+
+
+class _ChatLimiter:
+    """Не чаще одного сообщения в PER_CHAT_INTERVAL в один и тот же чат."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next: dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        now = time.monotonic()
+        ready_at = self._next.get(chat_id, 0.0)
+        self._next[chat_id] = max(now, ready_at) + self.interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+
+    def forget(self, chat_id: int) -> None:
+        self._next.pop(chat_id, None)
+
+
+# Общие на процесс: лимит Telegram считается на бота, а не на рассылку
+_bucket: TokenBucket | None = None
+_chats = _ChatLimiter(PER_CHAT_INTERVAL)
+_tasks: dict[int, asyncio.Task] = {}
+_dispatcher: asyncio.Task | None = None
+
+
+def get_bucket() -> TokenBucket:
+    """Общий token bucket отправки сообщений ботом."""
+
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(rate=env.broadcast_rps, capacity=env.broadcast_rps)
+    return _bucket
+
+
+@dataclass(frozen=True)
+class Payload:
+    """Готовое содержимое рассылки — собирается один раз на задание.
+
+    steps: [(метод Bot, аргументы без chat_id, стоимость в сообщениях)].
+    Объекты InputMediaPhoto создаются и валидируются здесь; перед отправкой
+    задания media group ещё и сериализуется один раз (serialize_payload).
+    """
+
+    steps: tuple[tuple[str, dict, int], ...]
+
+
+def prepare_payload(text: str, photos: list[str]) -> Payload:
+    photos = list(photos or [])[:10]
+    if not photos:
+        return Payload(steps=(("send_message", {"text": text}, 1),))
+    if len(text) > CAPTION_LIMIT:
+        # Подпись не влезет — текст отдельным сообщением, затем фото без подписи
+        media = [InputMediaPhoto(media=pid) for pid in photos]
+        return Payload(steps=(
+            ("send_message", {"text": text}, 1),
+            ("send_media_group", {"media": media}, len(media)),
+        ))
+    media = [InputMediaPhoto(media=photos[0], caption=text)]
+    media.extend(InputMediaPhoto(media=pid) for pid in photos[1:])
+    return Payload(steps=(("send_media_group", {"media": media}, len(media)),))
+
+
+def serialize_payload(payload: Payload) -> Payload:
+    """То же содержимое, но media group уже в виде JSON-строки.
+
+    aiogram при каждом send_media_group заново делает model_dump и json.dumps
+    всех InputMediaPhoto; готовую строку сессия отправляет как есть.
+    """
+
+    steps = []
+    for method, kwargs, cost in payload.steps:
+        if method == "send_media_group":
+            files: dict = {}
+            media = bot.session.prepare_value(kwargs["media"], bot=bot, files=files)
+            # Файлы для загрузки (не file_id) так не передать — оставляем объекты
+            if not files:
+                kwargs = {**kwargs, "media": media}
+        steps.append((method, kwargs, cost))
+    return Payload(steps=tuple(steps))
+
+
+async def _send(chat_id: int, method: str, kwargs: dict) -> None:
+    if method == "send_media_group" and isinstance(kwargs.get("media"), str):
+        # Без валидации: media — уже сериализованный список InputMediaPhoto
+        await bot(SendMediaGroup.model_construct(chat_id=chat_id, **kwargs))
+        return
+    await getattr(bot, method)(chat_id=chat_id, **kwargs)
+
+
+async def _deliver(chat_id: int, payload: Payload) -> tuple[str, str | None]:
+    """Отправляет рассылку одному получателю: ("sent" | "failed", ошибка)."""
+
+    bucket = get_bucket()
+    try:
+        for method, kwargs, cost in payload.steps:
+            # Повторяем только неудавшийся шаг, чтобы не дублировать уже доставленный текст
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                await _chats.wait(chat_id)
+                await bucket.acquire(cost)
+                try:
+                    await _send(chat_id, method, kwargs)
+                    break
+                except TelegramRetryAfter as e:
+                    bucket.pause(float(e.retry_after) + 0.5)
+                    if attempt == MAX_ATTEMPTS:
+                        return "failed", f"retry_after: {e.retry_after}"
+                except TelegramNetworkError as e:
+                    if attempt == MAX_ATTEMPTS:
+                        return "failed", f"network: {e}"
+                    await asyncio.sleep(2 ** attempt)
+        return "sent", None
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        # Бот заблокирован / чат удалён — повторять бессмысленно
+        return "failed", str(e)
+    except Exception as e:
+        logger.exception(f"broadcast: unexpected error for {chat_id}")
+        return "failed", str(e)
+    finally:
+        _chats.forget(chat_id)
+
+
+def _photos_of(job: dict) -> list[str]:
+    photos = job.get("photos") or []
+    if isinstance(photos, str):
+        try:
+            photos = json.loads(photos)
+        except ValueError:
+            photos = []
+    return [str(p) for p in photos][:10]
+
+
+async def _update_progress(job: dict, final: bool = False) -> None:
+    admin_chat_id, message_id = job.get("admin_chat_id"), job.get("progress_message_id")
+    if final:
+        text = text_message.BROADCAST_SENT_RESULT.format(ok=job["sent"], fail=job["failed"])
+        markup = inline_markup.get_back_admin_menu_keyboard()
+    else:
+        text = text_message.BROADCAST_PROGRESS.format(ok=job["sent"], fail=job["failed"], total=job["total"])
+        markup = None
+    if not message_id and not final:
+        return
+    try:
+        if message_id:
+            await bot.edit_message_text(chat_id=admin_chat_id, message_id=message_id, text=text, reply_markup=markup)
+            return
+    except TelegramBadRequest as e:
+        # «message is not modified» — прогресс не изменился
+        if not final or "not modified" in str(e):
+            return
+    except Exception:
+        if not final:
+            return
+    # Итог обязательно доводим до админа, даже если прогресс-сообщение недоступно
+    try:
+        await bot.send_message(chat_id=admin_chat_id, text=text, reply_markup=markup)
+    except Exception:
+        logger.exception(f"broadcast #{job['id']}: failed to report result")
+
+
+async def _flush(job: dict, results: list[tuple[int, str, str | None]]) -> dict:
+    if not results:
+        return job
+    batch = results[:]
+    updated = await db.save_broadcast_results(job["id"], batch)
+    if updated is None:
+        # БД недоступна — попробуем сохранить при следующем сбросе
+        return job
+    del results[:len(batch)]
+    return dict(updated)
+
+
+async def _run_job(job: dict, owner: str) -> None:
+    job_id = int(job["id"])
+    payload = serialize_payload(prepare_payload(str(job["text"]), _photos_of(job)))
+    queue: asyncio.Queue = asyncio.Queue(maxsize=env.broadcast_concurrency * 4)
+    results: list[tuple[int, str, str | None]] = []
+    main = asyncio.current_task()
+    lost = False
+
+    async def worker() -> None:
+        while True:
+            chat_id = await queue.get()
+            if chat_id is None:
+                return
+            status, error = await _deliver(chat_id, payload)
+            results.append((chat_id, status, error))
+
+    async def flusher() -> None:
+        nonlocal job, lost
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            job = await _flush(job, results)
+            if await db.renew_broadcast_lease(job_id, owner, LEASE_SEC) is False:
+                logger.warning(f"broadcast #{job_id}: lease taken over by another process, stopping")
+                lost = True
+                main.cancel()
+                return
+            await _update_progress(job)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, env.broadcast_concurrency))]
+    progress = asyncio.create_task(flusher())
+    try:
+        after_chat_id = -(2 ** 63)
+        while True:
+            page = await db.get_pending_broadcast_recipients(job_id, after_chat_id, PAGE_SIZE)
+            if page is None:
+                await asyncio.sleep(FLUSH_INTERVAL)
+                continue
+            if not page:
+                break
+            for chat_id in page:
+                await queue.put(chat_id)
+            after_chat_id = page[-1]
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    except asyncio.CancelledError:
+        if not lost:
+            raise
+        # Уже доставленное сохраняем, остальное продолжит новый владелец
+        for task in workers:
+            task.cancel()
+        await _flush(job, results)
+        return
+    finally:
+        progress.cancel()
+        for task in workers:
+            task.cancel()
+
+    while results:
+        job = await _flush(job, results)
+        if results:
+            await asyncio.sleep(FLUSH_INTERVAL)
+    finished = await db.finish_broadcast_job(job_id)
+    if finished:
+        job = dict(finished)
+    await _update_progress(job, final=True)
+    logger.info(f"broadcast #{job_id} finished: sent={job['sent']} failed={job['failed']}")
+
+
+def _spawn(job: dict, owner: str) -> None:
+    job_id = int(job["id"])
+    if job_id in _tasks and not _tasks[job_id].done():
+        return
+    task = asyncio.create_task(_run_job(job, owner), name=f"broadcast-{job_id}")
+    _tasks[job_id] = task
+    task.add_done_callback(lambda t: _tasks.pop(job_id, None))
+
+
+async def start_job(admin_chat_id: int, text: str, photos: list[str]) -> dict | None:
+    """Создать рассылку; отправит её диспетчер лидера. Возвращает задание или None."""
+
+    # Некорректное содержимое должно упасть здесь, до создания задания
+    prepare_payload(text, photos)
+    job = await db.create_broadcast_job(admin_chat_id, text, photos[:10])
+    if not job:
+        return None
+    job = dict(job)
+    try:
+        msg = await bot.send_message(
+            chat_id=admin_chat_id,
+            text=text_message.BROADCAST_PROGRESS.format(ok=0, fail=0, total=job["total"]),
+        )
+        job["progress_message_id"] = msg.message_id
+        await db.set_broadcast_progress_message(job["id"], msg.message_id)
+    except Exception:
+        logger.exception(f"broadcast #{job['id']}: failed to send progress message")
+    return job
+
+
+async def run_dispatcher() -> None:
+    """Забирать и отправлять рассылки: новые и брошенные упавшим процессом."""
+
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    while True:
+        try:
+            for job in await db.claim_broadcast_jobs(owner, LEASE_SEC):
+                job = dict(job)
+                if job["sent"] or job["failed"]:
+                    logger.info(
+                        f"broadcast #{job['id']}: resuming ({job['sent'] + job['failed']}/{job['total']} done)"
+                    )
+                _spawn(job, owner)
+        except Exception:
+            logger.exception("broadcast: dispatcher failed")
+        await asyncio.sleep(DISPATCH_INTERVAL)
+
+
+def start_dispatcher() -> None:
+    """Запустить диспетчер рассылок в текущем event loop (только в процессе-лидере)."""
+
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.done():
+        _dispatcher = asyncio.create_task(run_dispatcher(), name="broadcast-dispatcher")
@@ -1,12 +1,24 @@
 import asyncio
+import bisect
+import hashlib
+import json
+import os
 import random
 import re
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Callable
 
 import psycopg2
+import psycopg2.errors
+from cachetools import TTLCache
+from psycopg2.pool import PoolError
 
+from telegram_bot import env
+from telegram_bot.db_pool import ConnectionPool
 from telegram_bot.env import bot, local_timezone, pg_dsn
 from telegram_bot.helper import get_dict_fetch, timestamp_to_str
 
@@ -17,47 +29,203 @@ logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+class BookingConflictError(Exception):
+    """Запись пересекается с уже подтверждённой (ограничение bookings_no_overlap)."""
+
+
 def generate_promocode():
     return "DL" + ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(6))
 
 
+_IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]*$")
+
+
+def _check_columns(columns, allowed: frozenset[str] | None = None) -> None:
+    """Имена колонок попадают в текст SQL — пропускаем только известные."""
+
+    for column in columns:
+        if not _IDENTIFIER.match(column) or (allowed is not None and column not in allowed):
+            raise ValueError(f"Unknown column: {column!r}")
+
+
 # Return condition for sql queries
-def create_condition(args: dict, exception=None) -> str | None:
+def create_condition(args: dict, exception=None) -> tuple[str, tuple]:
     """
     Create condition for sql query. Take column's args from table.
     Use them to create 'WHERE' and 'AND' form for creating sql query.
+    Values are passed as %s parameters, so the statement text depends only on
+    which columns are set (stable for plan caching, no injection).
     :param args: column's args from table.
     :param exception: list of exceptions which create request with '<@' element (not '=' element).
-    :return: Stroke with condition
+    :return: (condition, params)
     """
     if exception is None:
         exception = []
-    if not list(args.values()) == [None] * len(args):
-        args_list = list(filter(lambda elem: args[elem] is not None, args))
-        condition = 'WHERE ' + ' AND '.join(list(map(
-            lambda elem: f"{elem} = '{args[elem]}'" if elem not in exception else "'{%s}' <@ %s" % (args[elem], elem),
-            args_list))
-        )
-        return condition
-    return ''
+    args_list = [elem for elem in args if args[elem] is not None]
+    if not args_list:
+        return '', ()
+    _check_columns(args_list)
+    # Значения передаём строками: как и раньше ('value'), тип выводит Postgres по колонке
+    condition = 'WHERE ' + ' AND '.join(
+        f"{elem} = %s" if elem not in exception else f"%s <@ {elem}"
+        for elem in args_list
+    )
+    params = tuple(
+        str(args[elem]) if elem not in exception else "{%s}" % args[elem]
+        for elem in args_list
+    )
+    return condition, params
+
+
+def _set_clause(values: dict, allowed: frozenset[str]) -> tuple[str, tuple]:
+    """'col = %s, ...' для UPDATE по белому списку колонок."""
+
+    _check_columns(values, allowed)
+    return ', '.join(f"{key} = %s" for key in values), tuple(values.values())
+
+
+# Колонки, которые разрешено менять через update_user / update_user_profile
+USERS_UPDATABLE = frozenset({"username", "full_name", "promocode", "level", "form_value"})
+USER_PROFILE_UPDATABLE = frozenset({"full_name", "birth_date", "phone_number", "about_me"})
+
+
+# Connection pool to database by pg_dsn
+pool = ConnectionPool(
+    str(pg_dsn),
+    min_size=env.db_pool_min_size,
+    max_size=env.db_pool_max_size,
+    timeout=env.db_pool_timeout,
+    max_idle=env.db_pool_max_idle,
+    max_lifetime=env.db_pool_max_lifetime,
+    check_after=env.db_pool_check_after,
+    stats_interval=env.db_pool_stats_interval,
+    keepalives=1,
+    keepalives_idle=30,
+    keepalives_interval=5,
+    keepalives_count=5,
+    # Не даём процессу зависать, если Postgres временно недоступен
+    connect_timeout=5,
+)
+
+
+# Dedicated executor for blocking psycopg2 calls
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Потоки для блокирующих вызовов psycopg2.
+
+    Размер равен размеру пула: больше параллельных запросов всё равно
+    не выполнить, а лишние корутины просто ждут в очереди executor'а,
+    не блокируя event loop. Executor пересоздаётся после fork.
+    """
 
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=pool.max_size, thread_name_prefix="db")
+                _executor_pid = pid
+    return _executor
 
-# Create connection to database by pg_dsn
-def create_connection():
+
+async def run_in_db_thread(func: Callable[..., Any], *args: Any) -> Any:
+    """Выполнить блокирующую функцию с БД вне event loop."""
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+# Ошибки, после которых prepared statement нужно подготовить заново:
+# схема поменялась (миграция) или statement пропал из сессии
+_STALE_STATEMENT_ERRORS = (psycopg2.errors.FeatureNotSupported, psycopg2.errors.InvalidSqlStatementName)
+
+
+def _statement_name(sql_query: str) -> str:
+    return "q_" + hashlib.md5(sql_query.encode()).hexdigest()[:16]
+
+
+def _numbered_placeholders(sql_query: str) -> str:
+    """%s -> $1, $2, ... для PREPARE."""
+
+    counter = iter(range(1, sql_query.count("%s") + 1))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", sql_query)
+
+
+def _run_statement(conn, cur, sql_query: str, params: tuple | list | None, prepare: bool) -> None:
+    if not (prepare and env.db_prepared_statements):
+        if params is None:
+            cur.execute(sql_query)
+        else:
+            cur.execute(sql_query, params)
+        return
+
+    name = _statement_name(sql_query)
+    if name not in conn.prepared:
+        # PREPARE не транзакционный: statement переживает rollback
+        cur.execute(f"PREPARE {name} AS {_numbered_placeholders(sql_query)}")
+        conn.prepared.add(name)
+    params = tuple(params or ())
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def _forget_statement(conn, sql_query: str) -> None:
+    name = _statement_name(sql_query)
+    conn.prepared.discard(name)
     try:
-        keepalive_kwargs = {
-            "keepalives": 1,
-            "keepalives_idle": 30,
-            "keepalives_interval": 5,
-            "keepalives_count": 5,
-            # Не даём процессу зависать, если Postgres временно недоступен
-            "connect_timeout": 5,
-        }
-        connection = psycopg2.connect(str(pg_dsn), **keepalive_kwargs)
-        return connection
-
-    except psycopg2.Error as error:
-        print(f"Error with connection to database {error}")
+        with conn.cursor() as cur:
+            cur.execute(f"DEALLOCATE {name}")
+    except psycopg2.Error:
+        pass
+    conn.rollback()
+
+
+def _execute(
+        sql_query: str,
+        is_return: bool,
+        is_multiple: bool,
+        params: tuple | list | None,
+        prepare: bool = False,
+) -> list[dict[Any, Any]] | dict[Any, Any] | None:
+    try:
+        with pool.connection() as conn:
+            for attempt in range(2):
+                try:
+                    with conn:
+                        with conn.cursor() as cur:
+                            _run_statement(conn, cur, sql_query, params, prepare)
+
+                            if not is_return:
+                                return None
+
+                            if is_multiple:
+                                return get_dict_fetch(cur, cur.fetchall())
+
+                            row = cur.fetchone()
+                            if row is None:
+                                return None
+                            return get_dict_fetch(cur, [row])[0]
+                except _STALE_STATEMENT_ERRORS:
+                    # «cached plan must not change result type» после миграции — готовим заново
+                    if not prepare or attempt:
+                        raise
+                    _forget_statement(conn, sql_query)
+    except psycopg2.errors.ExclusionViolation as error:
+        raise BookingConflictError(str(error)) from error
+    except PoolError as error:
+        logger.error(f"DB pool error: {error}")
+        return None
+    except psycopg2.OperationalError as error:
+        logger.error(f"Error with connection to database {error}")
+        return None
+    except Exception:
+        logger.exception("Error fetching sql request data from database")
         return None
 
 
@@ -67,46 +235,19 @@ async def create_request(
         is_return: bool = True,
         is_multiple: bool = True,
         params: tuple | list | None = None,
+        prepare: bool = False,
 ) -> list[dict[Any, Any]] | dict[Any, Any] | None:
     """Единая точка выполнения SQL.
 
-    - Всегда закрывает соединение.
+    - Берёт соединение из пула и всегда возвращает его обратно.
+    - Сам запрос выполняется в отдельном потоке и не блокирует event loop.
     - Поддерживает параметризованные запросы (cur.execute(sql, params)).
+    - prepare=True: server-side prepared statement (для частых запросов с
+      постоянным текстом) — разбор и план переиспользуются в сессии.
     - Не падает при временной недоступности БД.
     """
 
-    conn = create_connection()
-    if conn is None:
-        logger.error("DB connection is None")
-        return None
-
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                if params is None:
-                    cur.execute(sql_query)
-                else:
-                    cur.execute(sql_query, params)
-
-                if not is_return:
-                    conn.commit()
-                    return None
-
-                if is_multiple:
-                    return get_dict_fetch(cur, cur.fetchall())
-
-                row = cur.fetchone()
-                if row is None:
-                    return None
-                return get_dict_fetch(cur, [row])[0]
-    except Exception:
-        logger.exception("Error fetching sql request data from database")
-        return None
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    return await run_in_db_thread(_execute, sql_query, is_return, is_multiple, params, prepare)
 
 
 async def get_users(
@@ -116,33 +257,222 @@ async def get_users(
 ) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
+    condition, params = create_condition(condition_dict)
     sql_query = f"SELECT * FROM users {condition} ORDER by user_id"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await create_request(sql_query, is_multiple=is_multiple, params=params, prepare=True)
+
+
+# Фильтры списков пользователей в админке: users / forms / admins
+USER_LIST_FILTERS = {
+    "users": ("TRUE", ()),
+    "forms": ("form_value = %s", (1,)),
+    "admins": ("level = %s", (2,)),
+}
+
+
+async def get_users_page(
+        kind: str = "users", after: str | None = None, before: str | None = None, limit: int = 10,
+) -> tuple[list[dict], bool]:
+    """Страница списка пользователей по курсору (keyset по user_id, без OFFSET).
+
+    after — следующая страница после этого user_id, before — предыдущая перед ним.
+    Возвращает (строки по возрастанию user_id, есть ли ещё строки в направлении листания).
+    """
+
+    condition, params = USER_LIST_FILTERS[kind]
+    if before is not None:
+        condition, params, order = f"{condition} AND user_id < %s", (*params, str(before)), "DESC"
+    elif after is not None:
+        condition, params, order = f"{condition} AND user_id > %s", (*params, str(after)), "ASC"
+    else:
+        order = "ASC"
+    rows = await create_request(
+        f"SELECT user_id, full_name FROM users WHERE {condition} ORDER BY user_id {order} LIMIT %s",
+        params=(*params, limit + 1),
+    ) or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows.reverse()
+    return rows, has_more
+
+
+# Счётчики для админ-панели: один проход по users вместо трёх полных выборок
+_user_counts: TTLCache = TTLCache(maxsize=1, ttl=env.user_cache_ttl)
+
+
+async def get_user_counts() -> dict[str, int]:
+    """Число пользователей, анкет и админов (кэшируется на user_cache_ttl)."""
+
+    counts = _user_counts.get("counts")
+    if counts is not None:
+        return counts
+    row = await create_request(
+        """
+        SELECT count(*) AS users,
+               count(*) FILTER (WHERE form_value = 1) AS forms,
+               count(*) FILTER (WHERE level = 2) AS admins
+        FROM users
+        """,
+        is_multiple=False,
+    )
+    if row is None:
+        return {"users": 0, "forms": 0, "admins": 0}
+    counts = {key: int(value or 0) for key, value in row.items()}
+    _user_counts["counts"] = counts
+    return counts
+
+
+# Уровень пользователя читается перед почти каждой командой (check_block_user,
+# check_admin, админские callback'и). Держим его в памяти каждого процесса.
+# Смена уровня увеличивает версию в Redis (env.redis_url); остальные процессы
+# (воркеры бота, webapp) сверяют её не чаще раза в user_cache_check_interval
+# и при расхождении сбрасывают свой кэш. Без Redis процесс бота один и кэш
+# чисто локальный: update_user/add_user сбрасывают запись сразу.
+_user_levels: TTLCache = TTLCache(maxsize=50_000, ttl=env.user_cache_ttl)
+_user_levels_lock = threading.Lock()
+_USER_LEVELS_VERSION_KEY = "cache:user_levels:version"
+_user_levels_redis = None
+_user_levels_redis_pid: int | None = None
+_user_levels_version: bytes | None = None
+_user_levels_checked_at = 0.0
+_user_levels_redis_down = False
+
+
+def _get_user_levels_redis():
+    global _user_levels_redis, _user_levels_redis_pid
+    if not env.redis_url:
+        return None
+    if _user_levels_redis is None or _user_levels_redis_pid != os.getpid():
+        from redis.asyncio import Redis
+
+        # Недоступный Redis не должен задерживать каждую команду бота
+        _user_levels_redis = Redis.from_url(env.redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        _user_levels_redis_pid = os.getpid()
+    return _user_levels_redis
+
+
+def _clear_user_levels() -> None:
+    with _user_levels_lock:
+        _user_levels.clear()
+
+
+async def _user_levels_cache_valid() -> bool:
+    """Сверить версию кэша уровней с Redis. False — Redis недоступен, кэшу не верим."""
+
+    global _user_levels_version, _user_levels_checked_at, _user_levels_redis_down
+    client = _get_user_levels_redis()
+    if client is None:
+        return True
+    now = time.monotonic()
+    if now - _user_levels_checked_at < env.user_cache_check_interval:
+        return True
+    try:
+        version = await client.get(_USER_LEVELS_VERSION_KEY)
+    except Exception as e:
+        if not _user_levels_redis_down:
+            logger.warning(f"user level cache: Redis is unavailable, reading levels from DB: {e}")
+            _user_levels_redis_down = True
+        _clear_user_levels()
+        return False
+    _user_levels_redis_down = False
+    if version != _user_levels_version:
+        _clear_user_levels()
+        _user_levels_version = version
+    _user_levels_checked_at = now
+    return True
+
+
+async def invalidate_user_cache(user_id: int | str, level_changed: bool = False) -> None:
+    with _user_levels_lock:
+        _user_levels.pop(str(user_id), None)
+    # Новый пользователь / смена уровня или анкеты меняют и счётчики админки
+    _user_counts.clear()
+    client = _get_user_levels_redis() if level_changed else None
+    if client is None:
+        return
+    try:
+        await client.incr(_USER_LEVELS_VERSION_KEY)
+    except Exception as e:
+        logger.error(f"user level cache: failed to notify other processes about {user_id}: {e}")
+
+
+async def get_user_level(user_id: int | str) -> int | None:
+    """Уровень пользователя (-1 заблокирован, 0 клиент, 2 админ) или None, если его нет."""
+
+    key = str(user_id)
+    cache_valid = await _user_levels_cache_valid()
+    if cache_valid:
+        with _user_levels_lock:
+            level = _user_levels.get(key)
+        if level is not None:
+            return level
+
+    row = await create_request(
+        "SELECT level FROM users WHERE user_id = %s", is_multiple=False, params=(key,), prepare=True
+    )
+    if row is None:
+        # Отсутствие не кэшируем: новый пользователь сразу попадёт в add_user
+        return None
+    level = int(row["level"] or 0)
+    if cache_valid:
+        with _user_levels_lock:
+            _user_levels[key] = level
+    return level
+
+
+# Справочники (treatments, medicaments, pet_type) меняются редко, а читаются
+# при каждом тексте напоминания и каждой клавиатуре выбора. Держим их
+# в памяти целиком; фильтрация — по тем же правилам, что WHERE col = 'value'.
+_REFERENCE_TABLES = ("treatments", "medicaments", "pet_type")
+_reference: dict[str, list[dict]] = {}
+_reference_loaded_at: dict[str, float] = {}
+
+
+def invalidate_reference_cache(table: str | None = None) -> None:
+    """Сбросить кэш справочника (или всех) — после правки таблиц вручную."""
+
+    for name in ([table] if table else _REFERENCE_TABLES):
+        _reference_loaded_at.pop(name, None)
+
+
+def _reference_value(value: Any) -> str:
+    return str(int(value)) if isinstance(value, bool) else str(value)
+
+
+async def _get_reference(table: str, filters: dict, is_multiple: bool) -> list | dict | None:
+    loaded_at = _reference_loaded_at.get(table)
+    if loaded_at is None or time.monotonic() - loaded_at > env.reference_cache_ttl:
+        rows = await create_request(f"SELECT * FROM {table} ORDER by name ASC", is_multiple=True)
+        if rows is not None:
+            _reference[table] = rows
+            _reference_loaded_at[table] = time.monotonic()
+    wanted = {k: _reference_value(v) for k, v in filters.items() if v is not None}
+    found = [
+        row for row in _reference.get(table, [])
+        if all(_reference_value(row.get(k)) == v for k, v in wanted.items())
+    ]
+    if is_multiple:
+        return found
+    return found[0] if found else None
 
 
 async def get_treatments(id: int = None, name: str = None, value: int = None, pet_type: int = None, is_multiple: bool = False) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
-    sql_query = f"SELECT * FROM treatments {condition} ORDER by name ASC"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await _get_reference("treatments", condition_dict, is_multiple)
 
 async def get_pet_type(id: int = None, name: str = None, type: str = None, value: int = None, is_multiple: bool = False) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
-    sql_query = f"SELECT * FROM pet_type {condition} ORDER by name ASC"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await _get_reference("pet_type", condition_dict, is_multiple)
 
 async def get_medicament(
         id: int = None, name: str = None, treatments_id: int = None, value: int = None, is_multiple: bool = False
 ) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
-    sql_query = f"SELECT * FROM medicaments {condition} ORDER by name ASC"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await _get_reference("medicaments", condition_dict, is_multiple)
 
 
 async def add_user(user_id: int, username: str, name: str, last_name: str | None):
@@ -174,6 +504,7 @@ async def add_user(user_id: int, username: str, name: str, last_name: str | None
         is_return=False,
         params=(uid,),
     )
+    await invalidate_user_cache(uid)
 
 
 async def get_user_profile(
@@ -182,9 +513,9 @@ async def get_user_profile(
 ) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
+    condition, params = create_condition(condition_dict)
     sql_query = f"SELECT * FROM user_profile {condition} ORDER by full_name ASC"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await create_request(sql_query, is_multiple=is_multiple, params=params, prepare=True)
 
 
 async def get_pets(
@@ -193,9 +524,9 @@ async def get_pets(
 ) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
+    condition, params = create_condition(condition_dict)
     sql_query = f"SELECT * FROM pets {condition} ORDER by name ASC"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await create_request(sql_query, is_multiple=is_multiple, params=params, prepare=True)
 
 
 async def get_reminders(
@@ -204,9 +535,9 @@ async def get_reminders(
 ) -> list | dict:
     condition_dict = locals()
     is_multiple = condition_dict.pop('is_multiple')
-    condition = create_condition(condition_dict)
+    condition, params = create_condition(condition_dict)
     sql_query = f"SELECT * FROM reminders {condition} ORDER by start_date ASC"
-    return await create_request(sql_query, is_multiple=is_multiple)
+    return await create_request(sql_query, is_multiple=is_multiple, params=params, prepare=True)
 
 
 async def add_pet(
@@ -225,8 +556,6 @@ async def add_pet(
     и не рисковать SQL-инъекциями.
     """
 
-    await ensure_pets_schema()
-
     await create_request(
         """
         INSERT INTO pets (user_id, approx_weight, name, birth_date, gender, type, breed, about_pet)
@@ -246,26 +575,36 @@ async def add_pet(
     )
 
 
-_PETS_SCHEMA_READY = False
-
-
-async def ensure_pets_schema() -> None:
-    """Ленивая миграция схемы питомцев.
-
-    На проектах, где БД создавалась раньше, колонки about_pet может не быть.
-    Это приводит к падению сохранения анкеты (после delete_pets питомцы исчезают).
-    """
-
-    global _PETS_SCHEMA_READY
-    if _PETS_SCHEMA_READY:
-        return
-
-    # ALTER TABLE безопасен: IF NOT EXISTS не трогает существующую схему.
-    await create_request(
-        "ALTER TABLE pets ADD COLUMN IF NOT EXISTS about_pet TEXT",
-        is_return=False,
-    )
-    _PETS_SCHEMA_READY = True
+def _replace_pets(user_id: int | str, pets: list[dict]) -> bool:
+    try:
+        with pool.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM pets WHERE user_id = %s", (str(user_id),))
+                    cur.executemany(
+                        """
+                        INSERT INTO pets (user_id, approx_weight, name, birth_date, gender, type, breed, about_pet)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        """,
+                        [
+                            (
+                                str(user_id),
+                                p.get("weight"),
+                                p.get("name"),
+                                p.get("birth_date"),
+                                p.get("gender"),
+                                p.get("type"),
+                                p.get("breed", ""),
+                                p.get("about_pet", ""),
+                            )
+                            for p in pets
+                        ],
+                    )
+        return True
+    except Exception:
+        # `with conn` уже откатил транзакцию
+        logger.exception("replace_pets failed")
+        return False
 
 
 async def replace_pets(user_id: int | str, pets: list[dict]) -> bool:
@@ -277,76 +616,28 @@ async def replace_pets(user_id: int | str, pets: list[dict]) -> bool:
     Здесь всё делается в одной транзакции: либо всё обновится, либо ничего.
     """
 
-    await ensure_pets_schema()
-
-    conn = create_connection()
-    if conn is None:
-        return False
-
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM pets WHERE user_id = %s", (str(user_id),))
-                cur.executemany(
-                    """
-                    INSERT INTO pets (user_id, approx_weight, name, birth_date, gender, type, breed, about_pet)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    """,
-                    [
-                        (
-                            str(user_id),
-                            p.get("weight"),
-                            p.get("name"),
-                            p.get("birth_date"),
-                            p.get("gender"),
-                            p.get("type"),
-                            p.get("breed", ""),
-                            p.get("about_pet", ""),
-                        )
-                        for p in pets
-                    ],
-                )
-        return True
-    except Exception:
-        logger.exception("replace_pets failed")
-        try:
-            conn.rollback()
-        except Exception:
-            pass
-        return False
-    finally:
-        try:
-            conn.close()
-        except Exception:
-            pass
+    return await run_in_db_thread(_replace_pets, user_id, pets)
 
 
 async def delete_pets(user_id: int | str, **kwargs):
-    await create_request(f"DELETE FROM pets WHERE user_id = '{user_id}'", is_return=False)
+    await create_request("DELETE FROM pets WHERE user_id = %s", is_return=False, params=(str(user_id),))
 
 
 async def update_user_profile(user_id: int | str, **kwargs):
-    result = []
-    for key, value in kwargs.items():
-        if value is None:
-            result.append(f"{key} = NULL")
-        elif isinstance(value, str):
-            result.append(f"{key} = '{value}'")
-        else:
-            result.append(f"{key} = {value}")
-    updations = ', '.join(result)
-    await create_request(f"UPDATE user_profile SET {updations} WHERE user_id = '{user_id}'", is_return=False)
+    if not kwargs:
+        return
+    updations, params = _set_clause(kwargs, USER_PROFILE_UPDATABLE)
+    await create_request(
+        f"UPDATE user_profile SET {updations} WHERE user_id = %s", is_return=False, params=(*params, str(user_id))
+    )
 
 
 async def update_user(user_id: int, **kwargs):
-    result = []
-    for key, value in kwargs.items():
-        if isinstance(value, str):
-            result.append(f"{key} = '{value}'")
-        else:
-            result.append(f"{key} = {value}")
-    updations = ', '.join(result)
-    await create_request(f"UPDATE users SET {updations} WHERE user_id = '{user_id}'", is_return=False)
+    if not kwargs:
+        return
+    updations, params = _set_clause(kwargs, USERS_UPDATABLE)
+    await create_request(f"UPDATE users SET {updations} WHERE user_id = %s", is_return=False, params=(*params, str(user_id)))
+    await invalidate_user_cache(user_id, level_changed="level" in kwargs)
 
 
 async def validate_user_form_data(web_app_data):
@@ -422,8 +713,27 @@ async def validate_user_form_data(web_app_data):
         return False
 
 
+async def get_reminder_page(user_id: int | str, page: int) -> tuple[dict | None, int]:
+    """Одно активное напоминание пользователя для страницы page (с 1) и общее число.
+
+    Раньше для этого загружались все напоминания пользователя.
+    """
+
+    row = await create_request(
+        "SELECT *, count(*) OVER () AS total FROM reminders "
+        "WHERE user_id = %s AND value = 1 ORDER by start_date ASC OFFSET %s LIMIT 1",
+        is_multiple=False,
+        params=(str(user_id), max(0, int(page) - 1)),
+        prepare=True,
+    )
+    if not row:
+        return None, 0
+    row = dict(row)
+    return row, int(row.pop("total"))
+
+
 async def delete_reminder(id: int):
-    await create_request(f"DELETE FROM reminders WHERE id = {id}", is_return=False)
+    await create_request("DELETE FROM reminders WHERE id = %s", is_return=False, params=(int(id),))
 
 
 async def is_user_have_form(user_id: int) -> bool:
@@ -438,8 +748,14 @@ async def add_reminder(
     start_date = datetime.strptime(start_date, "%d.%m.%Y")
     end_date = start_date + timedelta(days=int(period))
     await create_request(
-        f"INSERT INTO reminders (user_id, treatment_id, medicament_id, medicament_name, start_date, end_date, period, value, pet_type) VALUES ('{user_id}', {treatment_id}, {medicament_id}, '{medicament_name}', '{start_date.timestamp()}', '{end_date.timestamp()}', '{period}', {value}, '{pet_type}')",
-        is_return=False)
+        "INSERT INTO reminders (user_id, treatment_id, medicament_id, medicament_name, start_date, end_date, "
+        "period, value, pet_type, next_fire_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+        is_return=False,
+        params=(
+            str(user_id), treatment_id, medicament_id, medicament_name, start_date.timestamp(),
+            end_date.timestamp(), str(period), value, str(pet_type), end_date.timestamp(),
+        ),
+    )
 
 
 async def update_reminder(task_id: int, treatment_id: int = None, medicament_id: int = None,
@@ -450,11 +766,24 @@ async def update_reminder(task_id: int, treatment_id: int = None, medicament_id:
     end_date = start_date + timedelta(days=int(period))
 
     await create_request(
-        f"UPDATE reminders SET treatment_id = {treatment_id}, medicament_id = {medicament_id}, medicament_name = '{medicament_name}', start_date = '{start_date.timestamp()}', end_date = '{end_date.timestamp()}', period = '{period}' WHERE id = {task_id}",
-        is_return=False)
+        "UPDATE reminders SET treatment_id = %s, medicament_id = %s, medicament_name = %s, start_date = %s, "
+        "end_date = %s, period = %s, next_fire_at = %s WHERE id = %s",
+        is_return=False,
+        params=(
+            treatment_id, medicament_id, medicament_name, start_date.timestamp(), end_date.timestamp(),
+            str(period), end_date.timestamp(), int(task_id),
+        ),
+    )
 
 
 async def check_reminders():
+    """Отправляет напоминания, срок которых наступил.
+
+    Берёт только «созревшие» напоминания по индексу next_fire_at, а не все
+    активные; когда вызывать следующий раз — решает telegram_bot/scheduler.py
+    по get_next_reminder_due().
+    """
+
     # Важно: webapp импортирует telegram_bot.db, но ему не нужны aiogram-хендлеры.
     # Поэтому подтягиваем их только в той функции, где они реально используются.
     from telegram_bot.handler import message
@@ -463,92 +792,63 @@ async def check_reminders():
     if bot is None:
         return
 
-    tasks = await get_reminders(value=int(True), is_multiple=True)
     now_timestamp = datetime.now().timestamp()
+    tasks = await create_request(
+        "SELECT * FROM reminders WHERE value = 1 AND next_fire_at <= %s ORDER BY next_fire_at LIMIT 500",
+        is_multiple=True,
+        params=(now_timestamp,),
+        prepare=True,
+    ) or []
+    if not tasks:
+        return
+
+    # Сначала сдвигаем сроки всех пачкой (один UPDATE на запуск):
+    # упавшая отправка не должна зациклить планировщик
+    now_local = datetime.fromtimestamp(now_timestamp, local_timezone)
+    params: list = []
+    for task in tasks:
+        end_ts = (now_local + timedelta(days=int(task['period']))).timestamp()
+        params.extend([int(task['id']), end_ts])
+    params.append(now_timestamp)
+    claimed = await create_request(
+        "UPDATE reminders AS r SET end_date = v.end_ts, next_fire_at = v.end_ts "
+        f"FROM (VALUES {', '.join(['(%s::integer, %s::double precision)'] * len(tasks))}) AS v(id, end_ts) "
+        "WHERE r.id = v.id AND r.next_fire_at <= %s "
+        "RETURNING r.id",
+        is_multiple=True,
+        params=params,
+    )
+    if claimed is None:
+        # Сроки не сдвинулись — без этого следующий запуск отправил бы те же напоминания ещё раз
+        logger.error(f"check_reminders: failed to move {len(tasks)} reminder(s), nothing sent")
+        return
+    # Сдвинутые параллельным запуском (уже не «созревшие») не отправляем повторно
+    claimed_ids = {row['id'] for row in claimed}
+
     for task in tasks:
-        if now_timestamp > float(task['end_date']):
-            end_date = datetime.fromtimestamp(now_timestamp, local_timezone) + timedelta(days=int(task['period']))
-            await create_request(f"UPDATE reminders SET end_date = '{end_date.timestamp()}' WHERE id = {task['id']}",
-                                 is_return=False)
+        if task['id'] not in claimed_ids:
+            continue
+        try:
             await bot.send_message(chat_id=task['user_id'], text=await message.get_task_text(task),
                                    reply_markup=inline_markup.get_delete_message_keyboard())
+        except Exception as e:
+            logger.warning(f"reminder {task['id']} to {task['user_id']} failed: {e}")
 
 
-# --- Online booking (single profile) ---
-
+async def get_next_reminder_due() -> float | None:
+    row = await create_request("SELECT min(next_fire_at) AS due FROM reminders WHERE value = 1", is_multiple=False)
+    return float(row["due"]) if row and row["due"] is not None else None
 
-async def ensure_bookings_table() -> None:
-    await create_request(
-        """
-        CREATE TABLE IF NOT EXISTS bookings (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            start_ts DOUBLE PRECISION NOT NULL,
-            end_ts DOUBLE PRECISION NOT NULL,
-            services JSONB NOT NULL,
-            total_price INTEGER NOT NULL,
-            comment TEXT,
-            promo_code TEXT,
-            specialist TEXT NOT NULL,
-            created_at DOUBLE PRECISION NOT NULL,
-            status TEXT NOT NULL DEFAULT 'confirmed'
-        );
-        """,
-        is_return=False,
-    )
-    await create_request("CREATE INDEX IF NOT EXISTS bookings_user_id_idx ON bookings(user_id);", is_return=False)
-    await create_request("CREATE INDEX IF NOT EXISTS bookings_start_ts_idx ON bookings(start_ts);", is_return=False)
-    await create_request(
-        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS reminder_24_sent BOOLEAN NOT NULL DEFAULT FALSE;",
-        is_return=False,
-    )
-    await create_request(
-        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS reminder_3_sent BOOLEAN NOT NULL DEFAULT FALSE;",
-        is_return=False,
-    )
-    await create_request(
-        "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS followup_sent BOOLEAN NOT NULL DEFAULT FALSE;",
-        is_return=False,
-    )
-
-    # --- Admin config tables ---
-    await create_request(
-        """
-        CREATE TABLE IF NOT EXISTS booking_services_custom (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            description TEXT,
-            duration_min INTEGER NOT NULL,
-            price INTEGER NOT NULL,
-            created_at DOUBLE PRECISION NOT NULL
-        );
-        """,
-        is_return=False,
-    )
-    await create_request(
-        "CREATE INDEX IF NOT EXISTS booking_services_custom_id_idx ON booking_services_custom(id);",
-        is_return=False,
-    )
-    await create_request(
-        """
-        CREATE TABLE IF NOT EXISTS booking_service_availability (
-            service_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            slots JSONB NOT NULL,
-            updated_at DOUBLE PRECISION NOT NULL,
-            PRIMARY KEY (service_id, date)
-        );
-        """,
-        is_return=False,
-    )
-    await create_request(
-        "CREATE INDEX IF NOT EXISTS booking_service_availability_date_idx ON booking_service_availability(date);",
-        is_return=False,
-    )
 
+# --- Online booking (single profile) ---
 
-def _escape_sql_text(value: str | None) -> str:
-    return (value or "").replace("'", "''")
+# Колонки записи без служебной slot (numrange для bookings_no_overlap):
+# она не сериализуется в JSON, а наружу не нужна
+BOOKING_FIELDS = (
+    "id", "user_id", "start_ts", "end_ts", "services", "total_price", "comment", "promo_code", "specialist",
+    "created_at", "status", "reminder_24_sent", "reminder_3_sent", "followup_sent",
+)
+BOOKING_COLUMNS = ", ".join(BOOKING_FIELDS)
 
 
 async def add_booking(
@@ -561,43 +861,42 @@ async def add_booking(
         comment: str | None = None,
         promo_code: str | None = None,
 ) -> dict | None:
-    import json
-
-    services_json = _escape_sql_text(json.dumps(services, ensure_ascii=False))
-    comment = _escape_sql_text(comment)
-    promo_code = _escape_sql_text(promo_code)
-    specialist = _escape_sql_text(specialist)
-    created_at = datetime.now().timestamp()
+    """Создаёт подтверждённую запись одним запросом.
 
+    Если время пересекается с другой подтверждённой записью —
+    поднимает BookingConflictError.
+    """
     sql = (
         "INSERT INTO bookings (user_id, start_ts, end_ts, services, total_price, comment, promo_code, specialist, created_at) "
-        f"VALUES ('{user_id}', {float(start_ts)}, {float(end_ts)}, '{services_json}'::jsonb, {int(total_price)}, "
-        f"'{comment}', '{promo_code}', '{specialist}', {float(created_at)}) "
-        "RETURNING *;"
+        "VALUES (%s, %s, %s, %s::jsonb, %s, %s, %s, %s, %s) "
+        f"RETURNING {BOOKING_COLUMNS}"
+    )
+    params = (
+        str(user_id), float(start_ts), float(end_ts), json.dumps(services, ensure_ascii=False), int(total_price),
+        comment or "", promo_code or "", specialist or "", datetime.now().timestamp(),
     )
-    return await create_request(sql, is_multiple=False)
+    return await create_request(sql, is_multiple=False, params=params, prepare=True)
 
 
 async def get_user_bookings(user_id: int | str, kind: str = "upcoming", limit: int = 50) -> list:
     now_ts = datetime.now().timestamp()
-    status_cond = "status = 'confirmed'"
     if kind == "past":
-        cond = f"user_id = '{user_id}' AND {status_cond} AND start_ts < {now_ts}"
-        order = "start_ts DESC"
+        cond, order = "start_ts < %s", "start_ts DESC"
     else:
-        cond = f"user_id = '{user_id}' AND {status_cond} AND start_ts >= {now_ts}"
-        order = "start_ts ASC"
-    sql = f"SELECT * FROM bookings WHERE {cond} ORDER BY {order} LIMIT {int(limit)}"
-    return await create_request(sql, is_multiple=True) or []
+        cond, order = "start_ts >= %s", "start_ts ASC"
+    sql = f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE user_id = %s AND status = 'confirmed' AND {cond} ORDER BY {order} LIMIT %s"
+    return await create_request(sql, is_multiple=True, params=(str(user_id), now_ts, int(limit)), prepare=True) or []
+
 
+async def get_bookings_in_range(start_ts: float, end_ts: float) -> list | None:
+    """Подтверждённые записи, пересекающие [start_ts, end_ts) (None — ошибка БД)."""
 
-async def get_bookings_in_range(start_ts: float, end_ts: float) -> list:
     sql = (
-        "SELECT * FROM bookings "
-        f"WHERE status = 'confirmed' AND start_ts < {float(end_ts)} AND end_ts > {float(start_ts)} "
+        f"SELECT {BOOKING_COLUMNS} FROM bookings "
+        "WHERE status = 'confirmed' AND start_ts < %s AND end_ts > %s "
         "ORDER BY start_ts ASC"
     )
-    return await create_request(sql, is_multiple=True) or []
+    return await create_request(sql, is_multiple=True, params=(float(end_ts), float(start_ts)), prepare=True)
 
 
 # --- Booking services (custom) & availability (admin-configured) ---
@@ -608,6 +907,53 @@ async def get_custom_booking_services() -> list:
     return await create_request(sql, is_multiple=True) or []
 
 
+# Воркеры webapp держат каталог услуг в памяти. Изменение каталога увеличивает
+# версию в cache_versions и шлёт NOTIFY — остальные воркеры перечитывают его
+# только тогда, когда он действительно поменялся.
+CACHE_CHANNEL = "webapp_cache"
+
+
+async def get_services_catalog() -> dict | None:
+    """Версия каталога и кастомные услуги одним запросом (согласованный снимок)."""
+
+    row = await create_request(
+        """
+        SELECT (SELECT version FROM cache_versions WHERE name = 'services') AS version,
+               COALESCE(json_agg(s ORDER BY s.id), '[]'::json) AS services
+        FROM booking_services_custom s
+        """,
+        is_multiple=False,
+    )
+    if row is None:
+        return None
+    return {"version": int(row["version"] or 0), "services": row["services"] or []}
+
+
+async def get_cache_version(name: str) -> int | None:
+    row = await create_request(
+        "SELECT version FROM cache_versions WHERE name = %s", is_multiple=False, params=(name,), prepare=True
+    )
+    return int(row["version"]) if row else None
+
+
+async def bump_cache_version(name: str) -> int | None:
+    """Увеличить версию кэша и оповестить воркеры (NOTIFY уходит при коммите)."""
+
+    row = await create_request(
+        """
+        WITH bumped AS (
+            INSERT INTO cache_versions (name, version) VALUES (%s, 1)
+            ON CONFLICT (name) DO UPDATE SET version = cache_versions.version + 1
+            RETURNING name, version
+        )
+        SELECT version, pg_notify(%s, name || ':' || version) FROM bumped
+        """,
+        is_multiple=False,
+        params=(name, CACHE_CHANNEL),
+    )
+    return int(row["version"]) if row else None
+
+
 async def get_custom_services_max_id() -> int:
     row = await create_request("SELECT MAX(id) AS max_id FROM booking_services_custom", is_multiple=False)
     try:
@@ -623,56 +969,63 @@ async def add_custom_booking_service(
         price: int,
         description: str | None = None,
 ) -> dict | None:
-    created_at = datetime.now().timestamp()
-    name = _escape_sql_text(name)
-    description = _escape_sql_text(description)
     sql = (
         "INSERT INTO booking_services_custom (id, name, description, duration_min, price, created_at) "
-        f"VALUES ({int(service_id)}, '{name}', '{description}', {int(duration_min)}, {int(price)}, {float(created_at)}) "
-        "RETURNING *;"
+        "VALUES (%s, %s, %s, %s, %s, %s) "
+        "RETURNING *"
     )
-    return await create_request(sql, is_multiple=False)
+    params = (
+        int(service_id), name or "", description or "", int(duration_min), int(price), datetime.now().timestamp(),
+    )
+    return await create_request(sql, is_multiple=False, params=params)
 
 
 async def get_service_availability(service_id: int, date: str) -> dict | None:
-    date = _escape_sql_text(date)
+    sql = "SELECT * FROM booking_service_availability WHERE service_id = %s AND date = %s LIMIT 1"
+    return await create_request(sql, is_multiple=False, params=(int(service_id), str(date)), prepare=True)
+
+
+async def get_service_availability_range(service_ids: list[int], date_from: str, date_to: str) -> list | None:
+    """Все настройки доступности услуг за окно дат одним запросом (None — ошибка БД).
+
+    Даты хранятся строками 'YYYY-MM-DD', поэтому BETWEEN по тексту совпадает
+    с хронологическим порядком.
+    """
+
     sql = (
         "SELECT * FROM booking_service_availability "
-        f"WHERE service_id = {int(service_id)} AND date = '{date}' LIMIT 1"
+        "WHERE service_id = ANY(%s) AND date BETWEEN %s AND %s "
+        "ORDER BY date ASC, service_id ASC"
     )
-    return await create_request(sql, is_multiple=False)
+    params = ([int(sid) for sid in service_ids], str(date_from), str(date_to))
+    return await create_request(sql, is_multiple=True, params=params, prepare=True)
 
 
 async def upsert_service_availability(service_id: int, date: str, slots: list[str]) -> dict | None:
-    import json
-
-    date = _escape_sql_text(date)
-    slots_json = _escape_sql_text(json.dumps(slots, ensure_ascii=False))
-    updated_at = datetime.now().timestamp()
-
     sql = (
         "INSERT INTO booking_service_availability (service_id, date, slots, updated_at) "
-        f"VALUES ({int(service_id)}, '{date}', '{slots_json}'::jsonb, {float(updated_at)}) "
+        "VALUES (%s, %s, %s::jsonb, %s) "
         "ON CONFLICT (service_id, date) DO UPDATE SET slots = EXCLUDED.slots, updated_at = EXCLUDED.updated_at "
-        "RETURNING *;"
+        "RETURNING *"
     )
-    return await create_request(sql, is_multiple=False)
+    params = (int(service_id), str(date), json.dumps(slots, ensure_ascii=False), datetime.now().timestamp())
+    return await create_request(sql, is_multiple=False, params=params)
 
 
 async def delete_service_availability(service_id: int, date: str) -> None:
-    date = _escape_sql_text(date)
     await create_request(
-        f"DELETE FROM booking_service_availability WHERE service_id = {int(service_id)} AND date = '{date}'",
+        "DELETE FROM booking_service_availability WHERE service_id = %s AND date = %s",
         is_return=False,
+        params=(int(service_id), str(date)),
     )
 
 
 async def list_availability_dates(service_id: int) -> list[str]:
     sql = (
         "SELECT date FROM booking_service_availability "
-        f"WHERE service_id = {int(service_id)} ORDER BY date ASC"
+        "WHERE service_id = %s ORDER BY date ASC"
     )
-    rows = await create_request(sql, is_multiple=True) or []
+    rows = await create_request(sql, is_multiple=True, params=(int(service_id),)) or []
     out: list[str] = []
     for r in rows:
         d = r.get('date')
@@ -684,23 +1037,57 @@ async def list_availability_dates(service_id: int) -> list[str]:
 # --- Admin bookings helpers ---
 
 
-async def get_upcoming_bookings_all(limit: int = 500) -> list:
-    now_ts = datetime.now().timestamp()
+BOOKING_STATUSES = ("confirmed", "cancelled")
+
+
+async def get_admin_bookings_page(
+        start_from: float | None = None,
+        start_to: float | None = None,
+        status: str | None = "confirmed",
+        after: tuple[float, int] | None = None,
+        limit: int = 50,
+) -> tuple[list, bool]:
+    """Страница записей для админки с именем клиента (user_profile.full_name).
+
+    Keyset по (start_ts, id): after — курсор последней показанной записи.
+    start_from/start_to — окно по началу записи [from, to), status=None — все статусы.
+    Возвращает (записи, есть ли следующая страница).
+    """
+
+    conditions: list[str] = []
+    params: list = []
+    if status is not None:
+        conditions.append("b.status = %s")
+        params.append(status)
+    if start_from is not None:
+        conditions.append("b.start_ts >= %s")
+        params.append(float(start_from))
+    if start_to is not None:
+        conditions.append("b.start_ts < %s")
+        params.append(float(start_to))
+    if after is not None:
+        conditions.append("(b.start_ts, b.id) > (%s, %s)")
+        params.extend([float(after[0]), int(after[1])])
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
     sql = (
-        "SELECT * FROM bookings "
-        f"WHERE status = 'confirmed' AND start_ts >= {float(now_ts)} "
-        "ORDER BY start_ts ASC "
-        f"LIMIT {int(limit)}"
+        f"SELECT {', '.join(f'b.{c}' for c in BOOKING_FIELDS)}, p.full_name AS user_name FROM bookings b "
+        "LEFT JOIN user_profile p ON p.user_id::text = b.user_id::text "
+        f"{where}"
+        "ORDER BY b.start_ts ASC, b.id ASC "
+        "LIMIT %s"
     )
-    return await create_request(sql, is_multiple=True) or []
+    rows = await create_request(sql, is_multiple=True, params=(*params, int(limit) + 1), prepare=True)
+    if rows is None:
+        return [], False
+    return rows[:limit], len(rows) > limit
 
 
 async def cancel_booking_admin(booking_id: int) -> dict | None:
     sql = (
         "UPDATE bookings SET status = 'cancelled' "
-        f"WHERE id = {int(booking_id)} RETURNING *;"
+        f"WHERE id = %s RETURNING {BOOKING_COLUMNS}"
     )
-    return await create_request(sql, is_multiple=False)
+    return await create_request(sql, is_multiple=False, params=(int(booking_id),))
 
 
 async def reschedule_booking_admin(
@@ -712,25 +1099,36 @@ async def reschedule_booking_admin(
         comment: str | None = None,
         promo_code: str | None = None,
 ) -> dict | None:
-    import json
+    updates, params = _reschedule_updates(start_ts, end_ts, services, total_price, comment, promo_code)
+    sql = f"UPDATE bookings SET {updates} WHERE id = %s RETURNING {BOOKING_COLUMNS}"
+    return await create_request(sql, is_multiple=False, params=(*params, int(booking_id)))
+
 
-    updates = [f"start_ts = {float(start_ts)}", f"end_ts = {float(end_ts)}", "status = 'confirmed'"]
+def _reschedule_updates(
+        start_ts: float,
+        end_ts: float,
+        services: list[dict] | None,
+        total_price: int | None,
+        comment: str | None,
+        promo_code: str | None,
+) -> tuple[str, tuple]:
+    """SET-часть переноса записи: меняются только переданные поля."""
+
+    updates = ["start_ts = %s", "end_ts = %s", "status = 'confirmed'"]
+    params: list = [float(start_ts), float(end_ts)]
     if services is not None:
-        services_json = _escape_sql_text(json.dumps(services, ensure_ascii=False))
-        updates.append(f"services = '{services_json}'::jsonb")
+        updates.append("services = %s::jsonb")
+        params.append(json.dumps(services, ensure_ascii=False))
     if total_price is not None:
-        updates.append(f"total_price = {int(total_price)}")
+        updates.append("total_price = %s")
+        params.append(int(total_price))
     if comment is not None:
-        updates.append(f"comment = '{_escape_sql_text(comment)}'")
+        updates.append("comment = %s")
+        params.append(comment)
     if promo_code is not None:
-        updates.append(f"promo_code = '{_escape_sql_text(promo_code)}'")
-
-    sql = (
-        "UPDATE bookings SET "
-        + ", ".join(updates)
-        + f" WHERE id = {int(booking_id)} RETURNING *;"
-    )
-    return await create_request(sql, is_multiple=False)
+        updates.append("promo_code = %s")
+        params.append(promo_code)
+    return ", ".join(updates), tuple(params)
 
 
 def _format_booking_dt(ts: float) -> str:
@@ -760,16 +1158,59 @@ def _format_booking_services(services: list[dict] | None) -> str:
     return "\n".join(lines)
 
 
-async def _mark_booking_notifications(booking_id: int, **flags) -> None:
-    allowed = {"reminder_24_sent", "reminder_3_sent", "followup_sent"}
-    updates = [f"{k} = {'TRUE' if v else 'FALSE'}" for k, v in flags.items() if k in allowed]
-    if not updates:
+_BOOKING_NOTIFICATION_FLAGS = ("reminder_24_sent", "reminder_3_sent", "followup_sent")
+# Сколько уведомлений о записях отправлять одновременно
+_BOOKING_NOTIFY_CONCURRENCY = 8
+
+
+async def _claim_booking_notifications(flag: str, booking_ids: list[int]) -> list[int]:
+    """Атомарно помечает уведомления отправленными и возвращает id, которые достались нам.
+
+    Флаг ставится до отправки: параллельный/наложившийся запуск получит
+    пустой список и не отправит то же уведомление второй раз.
+    """
+
+    if flag not in _BOOKING_NOTIFICATION_FLAGS or not booking_ids:
+        return []
+    sql = f"UPDATE bookings SET {flag} = TRUE WHERE id = ANY(%s) AND {flag} = FALSE RETURNING id"
+    rows = await create_request(sql, is_multiple=True, params=([int(x) for x in booking_ids],))
+    return [int(row["id"]) for row in rows or []]
+
+
+async def _release_booking_notifications(flag: str, booking_ids: list[int]) -> None:
+    """Снимает флаг с неотправленных (временная ошибка) — повторим на следующем запуске."""
+
+    if flag not in _BOOKING_NOTIFICATION_FLAGS or not booking_ids:
         return
-    sql = f"UPDATE bookings SET {', '.join(updates)} WHERE id = {int(booking_id)}";
-    await create_request(sql, is_return=False)
+    sql = f"UPDATE bookings SET {flag} = FALSE WHERE id = ANY(%s)"
+    await create_request(sql, is_return=False, params=([int(x) for x in booking_ids],))
+
+
+async def _send_booking_notification(user_id: int, text: str) -> bool:
+    """True — уведомление можно больше не отправлять (доставлено или не будет доставлено никогда)."""
+
+    from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+    from telegram_bot import broadcaster
+
+    try:
+        # Общий с рассылками лимит скорости бота
+        await broadcaster.get_bucket().acquire()
+        await bot.send_message(chat_id=user_id, text=text)
+        return True
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        logger.warning(f"booking notification to {user_id} dropped: {e}")
+        return True
+    except Exception as e:
+        # Временная ошибка — повторим на следующем запуске
+        logger.warning(f"booking notification to {user_id} failed: {e}")
+        return False
 
 
 async def check_booking_reminders() -> None:
+    if bot is None:
+        return
+
     now_ts = datetime.now().timestamp()
     in_24h = now_ts + 24 * 3600
     in_3h = now_ts + 3 * 3600
@@ -777,20 +1218,24 @@ async def check_booking_reminders() -> None:
     followup_window_start = now_ts - 7 * 24 * 3600
 
     sql = (
-        "SELECT * FROM bookings "
+        f"SELECT {BOOKING_COLUMNS} FROM bookings "
         "WHERE status = 'confirmed' AND ("
-        f"(start_ts BETWEEN {now_ts} AND {in_24h} AND reminder_24_sent = FALSE) OR "
-        f"(start_ts BETWEEN {now_ts} AND {in_3h} AND reminder_3_sent = FALSE) OR "
-        f"(start_ts BETWEEN {followup_window_start} AND {followup_threshold} AND followup_sent = FALSE)"
+        "(start_ts BETWEEN %s AND %s AND reminder_24_sent = FALSE) OR "
+        "(start_ts BETWEEN %s AND %s AND reminder_3_sent = FALSE) OR "
+        "(start_ts BETWEEN %s AND %s AND followup_sent = FALSE)"
         ")"
     )
-    bookings = await create_request(sql, is_multiple=True) or []
+    params = (now_ts, in_24h, now_ts, in_3h, followup_window_start, followup_threshold)
+    bookings = await create_request(sql, is_multiple=True, params=params, prepare=True) or []
 
     preparation = (
         "Важно: собака на занятии должна быть голодной. Приготовьте корм/лакомство, привычную амуницию и любимую игрушку."
     )
     followup_link = "https://t.me/DoggyLogy_bot/booking"
 
+    # flag -> [(booking_id, user_id, text)]
+    pending: dict[str, list[tuple[int, int, str]]] = {flag: [] for flag in _BOOKING_NOTIFICATION_FLAGS}
+
     for booking in bookings:
         start_ts = float(booking.get("start_ts") or 0)
         time_to_start = start_ts - now_ts
@@ -812,8 +1257,7 @@ async def check_booking_reminders() -> None:
                 f"• Услуги: {services_text}\n\n"
                 f"{preparation}"
             )
-            await bot.send_message(chat_id=user_id, text=text)
-            await _mark_booking_notifications(booking_id, reminder_24_sent=True)
+            pending["reminder_24_sent"].append((booking_id, user_id, text))
 
         if not booking.get("reminder_3_sent") and 0 < time_to_start <= 3 * 3600:
             text = (
@@ -822,8 +1266,7 @@ async def check_booking_reminders() -> None:
                 f"• Услуги: {services_text}\n\n"
                 f"{preparation}"
             )
-            await bot.send_message(chat_id=user_id, text=text)
-            await _mark_booking_notifications(booking_id, reminder_3_sent=True)
+            pending["reminder_3_sent"].append((booking_id, user_id, text))
 
         if (
             not booking.get("followup_sent")
@@ -834,21 +1277,63 @@ async def check_booking_reminders() -> None:
                 "Спасибо, что были на занятии! Прошло 6 дней — самое время закрепить результат.\n"
                 f"Запишитесь на следующее занятие: {followup_link}"
             )
-            await bot.send_message(chat_id=user_id, text=text)
-            await _mark_booking_notifications(booking_id, followup_sent=True)
+            pending["followup_sent"].append((booking_id, user_id, text))
+
+    semaphore = asyncio.Semaphore(_BOOKING_NOTIFY_CONCURRENCY)
+
+    async def send(booking_id: int, user_id: int, text: str) -> tuple[int, bool]:
+        async with semaphore:
+            return booking_id, await _send_booking_notification(user_id, text)
+
+    for flag, items in pending.items():
+        # Один UPDATE на тип уведомления: забираем себе ещё не отправленные
+        claimed = set(await _claim_booking_notifications(flag, [item[0] for item in items]))
+        results = await asyncio.gather(*(send(*item) for item in items if item[0] in claimed))
+        await _release_booking_notifications(flag, [booking_id for booking_id, done in results if not done])
+
+
+async def get_next_booking_reminder_due() -> float | None:
+    """Ближайший момент, когда check_booking_reminders() будет что отправить.
+
+    Условия совпадают с окнами в check_booking_reminders(): например, 24-часовое
+    напоминание уже не отправляется, если до начала осталось меньше 3 часов.
+    """
+
+    now_ts = datetime.now().timestamp()
+    sql = (
+        "SELECT min(due) AS due FROM ("
+        "  SELECT min(start_ts) - 86400 AS due FROM bookings "
+        "  WHERE status = 'confirmed' AND reminder_24_sent = FALSE AND user_id <> 0 AND start_ts > %s "
+        "  UNION ALL "
+        "  SELECT min(start_ts) - 10800 FROM bookings "
+        "  WHERE status = 'confirmed' AND reminder_3_sent = FALSE AND user_id <> 0 AND start_ts > %s "
+        "  UNION ALL "
+        "  SELECT min(start_ts) + 518400 FROM bookings "
+        "  WHERE status = 'confirmed' AND followup_sent = FALSE AND user_id <> 0 AND start_ts > %s "
+        ") t"
+    )
+    row = await create_request(
+        sql, is_multiple=False, params=(now_ts + 3 * 3600, now_ts, now_ts - 7 * 24 * 3600)
+    )
+    return float(row["due"]) if row and row["due"] is not None else None
 
 
 async def get_booking_by_id(booking_id: int) -> dict | None:
-    return await create_request(f"SELECT * FROM bookings WHERE id = {int(booking_id)} LIMIT 1", is_multiple=False)
+    return await create_request(
+        f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE id = %s LIMIT 1",
+        is_multiple=False,
+        params=(int(booking_id),),
+        prepare=True,
+    )
 
 
 async def cancel_booking(booking_id: int, user_id: int | str) -> dict | None:
     sql = (
         "UPDATE bookings SET status = 'cancelled' "
-        f"WHERE id = {int(booking_id)} AND user_id = '{user_id}' "
-        "RETURNING *;"
+        "WHERE id = %s AND user_id = %s "
+        f"RETURNING {BOOKING_COLUMNS}"
     )
-    return await create_request(sql, is_multiple=False)
+    return await create_request(sql, is_multiple=False, params=(int(booking_id), str(user_id)))
 
 
 async def reschedule_booking(
@@ -861,65 +1346,272 @@ async def reschedule_booking(
         comment: str | None = None,
         promo_code: str | None = None,
 ) -> dict | None:
-    import json
+    updates, params = _reschedule_updates(start_ts, end_ts, services, total_price, comment, promo_code)
+    sql = f"UPDATE bookings SET {updates} WHERE id = %s AND user_id = %s RETURNING {BOOKING_COLUMNS}"
+    return await create_request(sql, is_multiple=False, params=(*params, int(booking_id), str(user_id)))
 
-    updates = [f"start_ts = {float(start_ts)}", f"end_ts = {float(end_ts)}", "status = 'confirmed'"]
-    if services is not None:
-        services_json = _escape_sql_text(json.dumps(services, ensure_ascii=False))
-        updates.append(f"services = '{services_json}'::jsonb")
-    if total_price is not None:
-        updates.append(f"total_price = {int(total_price)}")
-    if comment is not None:
-        updates.append(f"comment = '{_escape_sql_text(comment)}'")
-    if promo_code is not None:
-        updates.append(f"promo_code = '{_escape_sql_text(promo_code)}'")
 
+# --- Notification outbox ---
+# Уведомления из webapp не отправляются прямо в HTTP-обработчике:
+# обработчик кладёт их в таблицу, а фоновый диспетчер
+# (telegram_webapp/outbox.py) отправляет с повторами.
+# Схема таблиц — в telegram_bot/migrations.py.
+
+
+async def enqueue_notifications(messages: list[tuple[int, str, dict]]) -> bool:
+    """Кладёт уведомления (chat_id, method, payload) в outbox одним INSERT."""
+
+    if not messages:
+        return True
+    now_ts = datetime.now().timestamp()
+    values = []
+    params: list = []
+    for chat_id, method, payload in messages:
+        values.append("(%s, %s, %s::jsonb, %s, %s)")
+        params.extend([int(chat_id), method, json.dumps(payload, ensure_ascii=False), now_ts, now_ts])
     sql = (
-        "UPDATE bookings SET "
-        + ", ".join(updates)
-        + f" WHERE id = {int(booking_id)} AND user_id = '{user_id}' RETURNING *;"
+        "INSERT INTO notification_outbox (chat_id, method, payload, next_attempt_at, created_at) "
+        f"VALUES {', '.join(values)} RETURNING id"
     )
-    return await create_request(sql, is_multiple=False)
+    rows = await create_request(sql, is_multiple=True, params=params)
+    return bool(rows)
 
 
-# --- Images cache ---
+async def claim_outbox(limit: int, lease_sec: float) -> list:
+    """Забирает пачку готовых к отправке уведомлений.
 
+    Строки блокируются через SKIP LOCKED, а next_attempt_at сдвигается на lease_sec:
+    параллельные диспетчеры (воркеры webapp) не возьмут одно и то же уведомление,
+    а если процесс упадёт посреди отправки — уведомление вернётся в очередь после lease.
+    """
 
-async def ensure_images_table() -> None:
-    await create_request(
-        """
-        CREATE TABLE IF NOT EXISTS bot_images (
-            key TEXT PRIMARY KEY,
-            file_id TEXT NOT NULL,
-            media_type TEXT NOT NULL DEFAULT 'photo'
-        );
-        """,
-        is_return=False,
+    now_ts = datetime.now().timestamp()
+    sql = (
+        "UPDATE notification_outbox SET attempts = attempts + 1, next_attempt_at = %s "
+        "WHERE id IN ("
+        "  SELECT id FROM notification_outbox "
+        "  WHERE status = 'pending' AND next_attempt_at <= %s "
+        "  ORDER BY next_attempt_at LIMIT %s FOR UPDATE SKIP LOCKED"
+        ") RETURNING *"
+    )
+    return await create_request(sql, is_multiple=True, params=(now_ts + float(lease_sec), now_ts, int(limit))) or []
+
+
+async def mark_outbox_sent(outbox_id: int) -> None:
+    sql = "UPDATE notification_outbox SET status = 'sent', sent_at = %s, last_error = NULL WHERE id = %s"
+    await create_request(sql, is_return=False, params=(datetime.now().timestamp(), int(outbox_id)))
+
+
+async def mark_outbox_retry(outbox_id: int, delay_sec: float, error: str) -> None:
+    sql = "UPDATE notification_outbox SET next_attempt_at = %s, last_error = %s WHERE id = %s"
+    params = (datetime.now().timestamp() + float(delay_sec), (error or "")[:1000], int(outbox_id))
+    await create_request(sql, is_return=False, params=params)
+
+
+async def release_outbox(outbox_ids: list[int]) -> None:
+    """Вернуть в очередь уведомления, которые забрали, но не успели отправить (попытка не считается)."""
+
+    sql = (
+        "UPDATE notification_outbox SET attempts = GREATEST(attempts - 1, 0), next_attempt_at = %s "
+        "WHERE id = ANY(%s) AND status = 'pending'"
+    )
+    params = (datetime.now().timestamp(), [int(i) for i in outbox_ids])
+    await create_request(sql, is_return=False, params=params)
+
+
+async def mark_outbox_failed(outbox_id: int, error: str) -> None:
+    sql = "UPDATE notification_outbox SET status = 'failed', last_error = %s WHERE id = %s"
+    await create_request(sql, is_return=False, params=((error or "")[:1000], int(outbox_id)))
+
+
+async def purge_outbox(older_than_ts: float) -> None:
+    sql = "DELETE FROM notification_outbox WHERE status = 'sent' AND sent_at < %s"
+    await create_request(sql, is_return=False, params=(float(older_than_ts),))
+
+
+# --- Broadcasts ---
+# Рассылка хранится в БД: задание + список получателей со статусами.
+# Движок (telegram_bot/broadcaster.py) отправляет pending-получателей и
+# после перезапуска продолжает с того же места. Задание в каждый момент
+# отправляет один процесс — владелец аренды (locked_by / lease_until).
+
+
+def _create_broadcast_job(admin_chat_id: int, text: str, photos: list[str]) -> dict | None:
+    try:
+        with pool.connection() as conn:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "INSERT INTO broadcast_jobs (admin_chat_id, text, photos, created_at) "
+                        "VALUES (%s, %s, %s::jsonb, %s) RETURNING id",
+                        (int(admin_chat_id), text, json.dumps(photos), time.time()),
+                    )
+                    job_id = cur.fetchone()[0]
+                    # Всем, включая админов, кроме заблокированных
+                    cur.execute(
+                        "INSERT INTO broadcast_recipients (job_id, chat_id) "
+                        "SELECT %s, user_id::bigint FROM users WHERE COALESCE(level, 0) >= 0 "
+                        "ON CONFLICT DO NOTHING",
+                        (job_id,),
+                    )
+                    cur.execute(
+                        "UPDATE broadcast_jobs SET total = %s WHERE id = %s RETURNING *",
+                        (cur.rowcount, job_id),
+                    )
+                    return get_dict_fetch(cur, [cur.fetchone()])[0]
+    except Exception:
+        logger.exception("create_broadcast_job failed")
+        return None
+
+
+async def create_broadcast_job(admin_chat_id: int, text: str, photos: list[str]) -> dict | None:
+    """Создаёт задание рассылки и список получателей в одной транзакции."""
+
+    return await run_in_db_thread(_create_broadcast_job, admin_chat_id, text, photos)
+
+
+async def claim_broadcast_jobs(owner: str, lease_sec: float) -> list:
+    """Забирает незанятые рассылки: новые и те, чья аренда истекла (владелец упал)."""
+
+    now_ts = time.time()
+    sql = (
+        "UPDATE broadcast_jobs SET locked_by = %s, lease_until = %s "
+        "WHERE id IN ("
+        "  SELECT id FROM broadcast_jobs "
+        "  WHERE status = 'running' AND (lease_until IS NULL OR lease_until < %s) "
+        "  ORDER BY id FOR UPDATE SKIP LOCKED"
+        ") RETURNING *"
     )
+    return await create_request(sql, is_multiple=True, params=(owner, now_ts + float(lease_sec), now_ts)) or []
+
+
+async def renew_broadcast_lease(job_id: int, owner: str, lease_sec: float) -> bool | None:
+    """Продлевает аренду. False — рассылку забрал другой процесс, None — БД недоступна."""
+
+    sql = "UPDATE broadcast_jobs SET lease_until = %s WHERE id = %s AND locked_by = %s RETURNING id"
+    rows = await create_request(
+        sql, is_multiple=True, params=(time.time() + float(lease_sec), int(job_id), owner)
+    )
+    if rows is None:
+        return None
+    return bool(rows)
+
+
+async def get_pending_broadcast_recipients(job_id: int, after_chat_id: int, limit: int) -> list[int] | None:
+    """Следующая страница получателей (keyset по chat_id); None — если БД недоступна."""
+
+    sql = (
+        "SELECT chat_id FROM broadcast_recipients "
+        "WHERE job_id = %s AND status = 'pending' AND chat_id > %s "
+        "ORDER BY chat_id LIMIT %s"
+    )
+    rows = await create_request(sql, is_multiple=True, params=(int(job_id), int(after_chat_id), int(limit)))
+    if rows is None:
+        return None
+    return [int(row["chat_id"]) for row in rows]
+
+
+async def save_broadcast_results(job_id: int, results: list[tuple[int, str, str | None]]) -> dict | None:
+    """Записывает пачку результатов (chat_id, sent|failed, ошибка) и обновляет счётчики задания."""
+
+    if not results:
+        return None
+    values = ", ".join(["(%s::bigint, %s, %s)"] * len(results))
+    params: list = []
+    for chat_id, status, error in results:
+        params.extend([int(chat_id), status, error[:500] if error else None])
+    params.extend([int(job_id), int(job_id)])
+    sql = (
+        "WITH upd AS ("
+        "  UPDATE broadcast_recipients r SET status = v.status, error = v.error, attempts = r.attempts + 1 "
+        f"  FROM (VALUES {values}) AS v(chat_id, status, error) "
+        "  WHERE r.job_id = %s AND r.chat_id = v.chat_id AND r.status = 'pending' "
+        "  RETURNING r.status"
+        ") "
+        "UPDATE broadcast_jobs SET "
+        "  sent = sent + (SELECT count(*) FROM upd WHERE status = 'sent'), "
+        "  failed = failed + (SELECT count(*) FROM upd WHERE status = 'failed') "
+        "WHERE id = %s RETURNING *"
+    )
+    return await create_request(sql, is_multiple=False, params=params)
+
+
+async def set_broadcast_progress_message(job_id: int, message_id: int) -> None:
+    sql = "UPDATE broadcast_jobs SET progress_message_id = %s WHERE id = %s"
+    await create_request(sql, is_return=False, params=(int(message_id), int(job_id)))
+
+
+async def finish_broadcast_job(job_id: int, status: str = "done") -> dict | None:
+    sql = (
+        "UPDATE broadcast_jobs SET status = %s, finished_at = %s, locked_by = NULL, lease_until = NULL "
+        "WHERE id = %s RETURNING *"
+    )
+    return await create_request(sql, is_multiple=False, params=(status, time.time(), int(job_id)))
+
+
+# --- Images cache ---
+# bot_images меняется только через /send_images, а читается на каждом экране
+# с картинками (/start — 9 file_id подряд). Держим таблицу в памяти процесса:
+# ключ -> строка и отсортированный список ключей для поиска по префиксу (bisect).
+
+_IMAGES_RELOAD_ON_MISS_SEC = 60.0
+_images: dict[str, dict] = {}
+_image_keys: list[str] = []
+_images_loaded_at: float | None = None
+
+
+async def load_images(force: bool = False) -> None:
+    """Загружает bot_images в память (один запрос на процесс)."""
+
+    global _images, _image_keys, _images_loaded_at
+    if _images_loaded_at is not None and not force:
+        return
+    rows = await create_request("SELECT * FROM bot_images", is_multiple=True)
+    if rows is None:
+        # БД недоступна — попробуем при следующем обращении
+        return
+    _images = {row["key"]: row for row in rows}
+    _image_keys = sorted(_images)
+    _images_loaded_at = time.monotonic()
+
+
+def _cache_image(row: dict) -> None:
+    if row["key"] not in _images:
+        bisect.insort(_image_keys, row["key"])
+    _images[row["key"]] = row
 
 
 async def upsert_image(key: str, file_id: str, media_type: str = "photo") -> None:
-    key = _escape_sql_text(key)
-    file_id = _escape_sql_text(file_id)
-    media_type = _escape_sql_text(media_type)
     sql = (
-        "INSERT INTO bot_images (key, file_id, media_type) "
-        f"VALUES ('{key}', '{file_id}', '{media_type}') "
-        "ON CONFLICT (key) DO UPDATE SET file_id = EXCLUDED.file_id, media_type = EXCLUDED.media_type;"
+        "INSERT INTO bot_images (key, file_id, media_type) VALUES (%s, %s, %s) "
+        "ON CONFLICT (key) DO UPDATE SET file_id = EXCLUDED.file_id, media_type = EXCLUDED.media_type "
+        "RETURNING *;"
     )
-    await create_request(sql, is_return=False)
+    row = await create_request(sql, is_multiple=False, params=(key, file_id, media_type))
+    if row:
+        _cache_image(row)
 
 
 async def get_image(key: str) -> dict | None:
-    key = _escape_sql_text(key)
-    sql = f"SELECT * FROM bot_images WHERE key = '{key}'"
-    return await create_request(sql, is_multiple=False)
+    await load_images()
+    image = _images.get(key)
+    if image is None and _images_loaded_at is not None \
+            and time.monotonic() - _images_loaded_at > _IMAGES_RELOAD_ON_MISS_SEC:
+        # Картинку могли загрузить из другого процесса бота — перечитываем, но не чаще раза в минуту
+        await load_images(force=True)
+        image = _images.get(key)
+    return image
 
 
 async def get_images_by_prefix(prefix: str) -> list:
-    prefix = _escape_sql_text(prefix)
-    sql = f"SELECT * FROM bot_images WHERE key LIKE '{prefix}%' ORDER BY key"
-    return await create_request(sql, is_multiple=True) or []
+    await load_images()
+    start = bisect.bisect_left(_image_keys, prefix)
+    out = []
+    for key in _image_keys[start:]:
+        if not key.startswith(prefix):
+            break
+        out.append(_images[key])
+    return out
 
 
 
@@ -0,0 +1,311 @@
+"""Потокобезопасный пул соединений psycopg2.
+
+Пул используется и ботом (aiogram), и Flask webapp:
+- захват/возврат соединений защищён блокировкой, поэтому пул можно
+  делить между потоками (Flask threaded, executor для БД);
+- после fork (gunicorn --preload) дочерний процесс не трогает
+  унаследованные сокеты и открывает свои соединения.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(PoolError):
+    """Свободное соединение не появилось за отведённое время."""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """psycopg2-соединение с метаданными пула."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        # Имена server-side prepared statements, уже подготовленных в этой сессии
+        self.prepared: set[str] = set()
+
+
+class ConnectionPool:
+    """Пул соединений с ограничением размера, health-check и метриками ожидания.
+
+    - max_size: больше соединений не открываем, остальные ждут до timeout;
+    - min_size: столько простаивающих соединений держим всегда;
+    - max_idle: лишние (сверх min_size) простаивающие соединения закрываются;
+    - max_lifetime: соединение переоткрывается, даже если оно живое;
+    - check_after: соединение, простоявшее дольше, проверяется `SELECT 1`;
+    - stats_interval: не чаще этого метрики пула пишутся в лог (0 — не писать).
+
+    Первые min_size соединений открываются при первом обращении к пулу
+    (и заново в дочернем процессе после fork), а не в конструкторе:
+    пул создаётся при импорте, когда Postgres может быть ещё недоступен.
+    """
+
+    def __init__(
+            self,
+            dsn: str,
+            min_size: int = 1,
+            max_size: int = 10,
+            timeout: float = 10.0,
+            max_idle: float = 300.0,
+            max_lifetime: float = 3600.0,
+            check_after: float = 30.0,
+            stats_interval: float = 300.0,
+            **connect_kwargs: Any,
+    ):
+        self.dsn = dsn
+        self.max_size = max(1, int(max_size))
+        self.min_size = max(0, min(int(min_size), self.max_size))
+        self.timeout = float(timeout)
+        self.max_idle = float(max_idle)
+        self.max_lifetime = float(max_lifetime)
+        self.check_after = float(check_after)
+        self.stats_interval = float(stats_interval)
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._pid = os.getpid()
+        # LIFO: самые «свежие» соединения в конце, самые старые в начале
+        self._idle: list[PooledConnection] = []
+        # Открытые соединения: простаивающие + выданные
+        self._size = 0
+        # Соединения родительского процесса после fork: не закрываем и не используем
+        self._orphans: list[PooledConnection] = []
+        # До этого момента не пытаемся добирать min_size (после неудачного подключения)
+        self._fill_retry_at = 0.0
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self._stats_logged_at = time.monotonic()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "discards": 0,
+            "failed_checks": 0,
+        }
+
+    def _check_pid(self) -> None:
+        # Вызывается под self._cond
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+        # close() в дочернем процессе отправил бы Terminate в чужую сессию —
+        # поэтому унаследованные соединения просто «забываем».
+        self._orphans.extend(self._idle)
+        self._idle = []
+        self._size = 0
+        self._pid = pid
+        self._reset_stats()
+
+    def _connect(self) -> PooledConnection:
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection, **self.connect_kwargs)
+        with self._cond:
+            self._stats["connects"] += 1
+        return conn
+
+    def _close(self, conn: PooledConnection) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn: PooledConnection) -> None:
+        self._close(conn)
+        with self._cond:
+            self._size -= 1
+            self._stats["discards"] += 1
+            self._cond.notify()
+
+    def _is_usable(self, conn: PooledConnection) -> bool:
+        """Health-check перед выдачей соединения (вне блокировки)."""
+
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - conn.created_at > self.max_lifetime:
+            return False
+        if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if now - conn.last_used <= self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats["failed_checks"] += 1
+            return False
+
+    def _pop_expired_idle(self) -> list[PooledConnection]:
+        # Вызывается под self._cond. Самые старые простаивающие — в начале списка.
+        expired = []
+        now = time.monotonic()
+        while len(self._idle) > self.min_size and now - self._idle[0].last_used > self.max_idle:
+            expired.append(self._idle.pop(0))
+            self._size -= 1
+            self._stats["discards"] += 1
+        return expired
+
+    def _fill_min_size(self) -> None:
+        """Открывает недостающие до min_size соединения и кладёт их в простаивающие."""
+
+        with self._cond:
+            self._check_pid()
+            missing = self.min_size - self._size
+            if missing <= 0 or time.monotonic() < self._fill_retry_at:
+                return
+            # Резервируем места, чтобы параллельные getconn не превысили max_size
+            self._size += missing
+
+        opened: list[PooledConnection] = []
+        try:
+            for _ in range(missing):
+                opened.append(self._connect())
+        except Exception as error:
+            # Не мешаем запросу: getconn сам попробует подключиться и вернёт ошибку,
+            # а следующие запросы во время сбоя не платят за лишнюю попытку
+            logger.warning(f"DB pool: opened {len(opened)} of {missing} min_size connections: {error}")
+            self._fill_retry_at = time.monotonic() + self.check_after
+
+        with self._cond:
+            self._size -= missing - len(opened)
+            # Самые старые простаивающие — в начале списка
+            self._idle[:0] = opened
+            self._cond.notify_all()
+
+    def getconn(self, timeout: float | None = None) -> PooledConnection:
+        if self._size < self.min_size or os.getpid() != self._pid:
+            self._fill_min_size()
+
+        timeout = self.timeout if timeout is None else float(timeout)
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            conn = None
+            with self._cond:
+                self._check_pid()
+                if self._idle:
+                    conn = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(f"no free connection in {timeout:.1f}s (max_size={self.max_size})")
+                    waited = True
+                    self._cond.wait(remaining)
+                    continue
+
+            if conn is not None:
+                if not self._is_usable(conn):
+                    self._discard(conn)
+                    continue
+            else:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            self._record_checkout(time.monotonic() - started, waited)
+            return conn
+
+    def _record_checkout(self, wait_time: float, waited: bool) -> None:
+        now = time.monotonic()
+        log_stats = False
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time_total"] += wait_time
+                self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait_time)
+            if self.stats_interval > 0 and now - self._stats_logged_at >= self.stats_interval:
+                self._stats_logged_at = now
+                log_stats = True
+        if waited:
+            logger.debug("DB pool: waited %.3fs for a connection", wait_time)
+        if log_stats:
+            # Счётчики накопительные с момента старта процесса
+            logger.info("DB pool stats (pid %s): %s", os.getpid(), self.stats())
+
+    def putconn(self, conn: PooledConnection, close: bool = False) -> None:
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+
+        with self._cond:
+            if os.getpid() != self._pid:
+                # Соединение выдано до fork — не наше
+                return
+            if close or conn.closed:
+                expired = [conn]
+                self._size -= 1
+                self._stats["discards"] += 1
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                expired = self._pop_expired_idle()
+            self._cond.notify()
+
+        for old in expired:
+            self._close(old)
+
+    @contextmanager
+    def connection(self, timeout: float | None = None) -> Iterator[PooledConnection]:
+        """Выдаёт соединение из пула и всегда возвращает его обратно."""
+
+        conn = self.getconn(timeout)
+        close = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Соединение, скорее всего, сломано — не возвращаем его в оборот
+            close = True
+            raise
+        finally:
+            self.putconn(conn, close=close)
+
+    def stats(self) -> dict:
+        """Снимок метрик пула (в т.ч. ожидания свободного соединения)."""
+
+        with self._cond:
+            data = dict(self._stats)
+            data.update(
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                min_size=self.min_size,
+                max_size=self.max_size,
+            )
+        return data
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            self._close(conn)
@@ -41,6 +41,20 @@ def _json_list_env(name: str, default: list[int] | None = None) -> list[int]:
         return list(default or [])
 
 
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
+def _float_env(name: str, default: float) -> float:
+    try:
+        return float((os.getenv(name) or "").strip() or default)
+    except ValueError:
+        return default
+
+
 webapp_url = os.getenv("WEBAPP_URL", "https://doggyform.ru/")
 admins_telegram_id = _json_list_env("ADMIN_TELEGRAM_ID", default=[])
 
@@ -51,6 +65,64 @@ pg_dsn = (
 )
 img_path = f"{os.path.dirname(__file__)}/img"
 
+# Пул соединений с Postgres (см. telegram_bot/db_pool.py).
+# Пул свой в каждом процессе: и у бота, и у каждого воркера webapp.
+db_pool_min_size = _int_env("DB_POOL_MIN_SIZE", 1)
+db_pool_max_size = _int_env("DB_POOL_MAX_SIZE", 10)
+# Сколько ждать свободное соединение, прежде чем сдаться (сек)
+db_pool_timeout = _float_env("DB_POOL_TIMEOUT", 10.0)
+# Соединения сверх min_size, простаивающие дольше max_idle, закрываются
+db_pool_max_idle = _float_env("DB_POOL_MAX_IDLE", 300.0)
+# Любое соединение переоткрывается после max_lifetime
+db_pool_max_lifetime = _float_env("DB_POOL_MAX_LIFETIME", 3600.0)
+# Соединение, простоявшее дольше этого, проверяется `SELECT 1` перед выдачей
+db_pool_check_after = _float_env("DB_POOL_CHECK_AFTER", 30.0)
+# Как часто писать метрики пула в лог (сек, 0 — не писать)
+db_pool_stats_interval = _float_env("DB_POOL_STATS_INTERVAL", 300.0)
+# Готовить частые запросы на сервере (PREPARE/EXECUTE). Выключить, если между
+# приложением и Postgres стоит pgbouncer в режиме transaction pooling.
+db_prepared_statements = (os.getenv("DB_PREPARED_STATEMENTS") or "1").strip().lower() not in ("0", "false", "no")
+
+# Сколько держать в памяти уровень пользователя (проверка блокировки/админа)
+user_cache_ttl = _float_env("USER_CACHE_TTL", 60.0)
+# Как часто сверять версию кэша уровней с Redis (сек): столько максимум другие
+# процессы видят старый уровень после блокировки/разблокировки/смены админа
+user_cache_check_interval = _float_env("USER_CACHE_CHECK_INTERVAL", 1.0)
+
+# Сколько держать в памяти справочники treatments/medicaments/pet_type (сек)
+reference_cache_ttl = _float_env("REFERENCE_CACHE_TTL", 600.0)
+
+# Рассылки: общий лимит отправки (сообщений в секунду) и число параллельных отправителей
+broadcast_rps = _float_env("BROADCAST_RPS", 25.0)
+broadcast_concurrency = _int_env("BROADCAST_CONCURRENCY", 8)
+
+# Приём апдейтов: polling (один процесс) или webhook (aiohttp, можно несколько воркеров).
+bot_mode = (os.getenv("BOT_MODE") or "polling").strip().lower()
+# Публичный адрес, по которому Telegram достучится до бота (https://host), и путь вебхука
+webhook_base_url = (os.getenv("WEBHOOK_BASE_URL") or "").strip().rstrip("/")
+webhook_path = (os.getenv("WEBHOOK_PATH") or "/telegram/webhook").strip()
+webhook_secret = (os.getenv("WEBHOOK_SECRET") or "").strip() or None
+webhook_host = (os.getenv("WEBHOOK_HOST") or "0.0.0.0").strip()
+webhook_port = _int_env("WEBHOOK_PORT", 8081)
+# Сколько одновременных запросов Telegram откроет к вебхуку
+webhook_max_connections = _int_env("WEBHOOK_MAX_CONNECTIONS", 40)
+# Число процессов-воркеров на этой машине (делят порт через SO_REUSEPORT)
+bot_workers = max(1, _int_env("BOT_WORKERS", 1))
+# Redis общий для всех процессов бота: FSM, блокировки чатов и сброс кэша уровней
+# пользователей. Нужен, когда процессов несколько (BOT_WORKERS > 1 или несколько
+# машин — тогда REDIS_URL задаётся явно). Один процесс без REDIS_URL обходится
+# памятью (MemoryStorage); при BOT_WORKERS > 1 по умолчанию — локальный Redis.
+redis_url = (os.getenv("REDIS_URL") or "").strip()
+if not redis_url and bot_workers > 1:
+    redis_url = "redis://localhost:6379/0"
+# Ведущий процесс запускает планировщик, досылает рассылки и ставит вебхук.
+# При нескольких машинах BOT_LEADER=1 должен быть ровно на одной из них.
+bot_leader = (os.getenv("BOT_LEADER") or "1").strip().lower() not in ("0", "false", "no")
+
+# Адрес Bot API (по умолчанию — официальный). Для прогонов без реальных
+# пользователей — локальный фейк: python -m benchmarks.fake_bot_api
+telegram_api_url = (os.getenv("TELEGRAM_API_URL") or "").strip().rstrip("/")
+
 # Сервер работает в UTC, поэтому явно указываем московский часовой пояс
 # чтобы время записей совпадало с ожидаемым для пользователей.
 local_timezone = ZoneInfo(os.getenv("LOCAL_TZ", "Europe/Moscow"))
@@ -72,19 +144,34 @@ def init_bot():
 
     from aiogram import Bot, Dispatcher
     from aiogram.client.bot import DefaultBotProperties
-    from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
-    from redis.asyncio.client import Redis
+    from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
 
     bot_token = os.getenv("BOT_TOKEN")
     if not bot_token:
         raise RuntimeError("BOT_TOKEN is not set in environment")
 
-    storage = RedisStorage(
-        Redis(),
-        key_builder=DefaultKeyBuilder(with_destiny=True),
-    )
-    bot = Bot(bot_token, default=DefaultBotProperties(parse_mode='HTML'), storage=storage)
-    dp = Dispatcher()
+    if redis_url:
+        from aiogram.fsm.storage.redis import DefaultKeyBuilder, RedisStorage
+        from redis.asyncio.client import Redis
+
+        storage = RedisStorage(
+            Redis.from_url(redis_url),
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+        )
+        # Апдейты одного чата обрабатываются по очереди даже в разных процессах (lock в Redis)
+        isolation = storage.create_isolation()
+    else:
+        # Один процесс бота: состояние диалогов в памяти (теряется при перезапуске)
+        storage = MemoryStorage()
+        isolation = SimpleEventIsolation()
+    session = None
+    if telegram_api_url:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_api_url))
+    bot = Bot(bot_token, session=session, default=DefaultBotProperties(parse_mode='HTML'))
+    dp = Dispatcher(storage=storage, events_isolation=isolation)
     return bot, dp
 
 
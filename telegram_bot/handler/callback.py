@@ -95,30 +95,38 @@ async def handle_form_request(callback: CallbackQuery) -> None:
 @router.callback_query(lambda call: call.data.startswith('admin:'))
 async def handle_admin_users(callback: CallbackQuery, state: FSMContext) -> None:
     # защита: админские разделы доступны только пользователям уровня 2
-    user = await db.get_users(user_id=callback.from_user.id)
-    if user is None:
+    level = await db.get_user_level(callback.from_user.id)
+    if level is None:
         await db.add_user(callback.from_user.id, callback.from_user.username, callback.from_user.first_name, callback.from_user.last_name)
-        user = await db.get_users(user_id=callback.from_user.id)
-    if not user or user.get("level") != 2:
+        level = await db.get_user_level(callback.from_user.id)
+    if level != 2:
         return
 
     await callback.message.delete()
     callback_data = callback.data.split(":")
-    page = int(callback_data[2]) if len(callback_data) > 2 else 1
+    # admin:<список>[:<страница>:<n|p>:<user_id курсора>]
+    page, after, before = 1, None, None
+    if len(callback_data) > 4:
+        page = int(callback_data[2])
+        if callback_data[3] == 'n':
+            after = callback_data[4]
+        else:
+            before = callback_data[4]
     if callback_data[1] == 'users':
         await callback.message.answer(
             text=text_message.USERS_TEXT,
-            reply_markup=await inline_markup.get_users_keyboard(page=page)
+            reply_markup=await inline_markup.get_users_keyboard(page=page, after=after, before=before)
         )
     elif callback_data[1] == 'admins':
         await callback.message.answer(
             text=text_message.ADMINS_TEXT,
-            reply_markup=await inline_markup.get_users_keyboard(page=page, is_admin=True)
+            reply_markup=await inline_markup.get_users_keyboard(page=page, is_admin=True, after=after, before=before)
         )
     elif callback_data[1] == 'forms':
         await callback.message.answer(
             text=text_message.LIST_OF_FORMS,
-            reply_markup=await inline_markup.get_users_keyboard(page=page, is_have_forms=True)
+            reply_markup=await inline_markup.get_users_keyboard(page=page, is_have_forms=True, after=after,
+                                                                before=before)
         )
     elif callback_data[1] == 'broadcast':
         # запуск FSM рассылки
@@ -160,16 +168,19 @@ async def handle_create_page_tasks(callback: CallbackQuery, state: FSMContext) -
 async def handle_edit_task(callback: CallbackQuery, state: FSMContext) -> None:
     await callback.message.delete()
     page = int(callback.data.split(":")[2])
-    tasks = await db.get_reminders(user_id=callback.message.chat.id, value=int(True), is_multiple=True)
-    task_id = tasks[page - 1]['id']
-    await edit_task.update_edit_data(callback.message, state, task_id)
+    task, _ = await db.get_reminder_page(callback.message.chat.id, page)
+    if task is None:
+        return
+    await edit_task.update_edit_data(callback.message, state, task['id'])
 
 @router.callback_query(F.data.startswith('task:delete'))
 async def handle_delete_task(callback: CallbackQuery) -> None:
     await callback.message.delete()
     page = int(callback.data.split(":")[2])
-    tasks = await db.get_reminders(user_id=callback.message.chat.id, value=int(True), is_multiple=True)
-    await db.delete_reminder(tasks[page - 1]['id'])
+    task, _ = await db.get_reminder_page(callback.message.chat.id, page)
+    if task is None:
+        return
+    await db.delete_reminder(task['id'])
     await callback.message.answer(text=text_message.DELETE_TASK_COMPLETE,
                                   reply_markup=inline_markup.get_back_menu_keyboard())
 
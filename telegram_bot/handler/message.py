@@ -29,9 +29,9 @@ async def send_about(message: Message, **kwargs):
 
 @router.message(Command("menu", "start"))
 async def send_menu(message: Message, state: FSMContext, **kwargs):
-    user = await db.get_users(user_id=message.chat.id)
+    level = await db.get_user_level(message.chat.id)
     await state.clear()
-    if user is None:
+    if level is None:
         await db.add_user(message.chat.id, message.chat.username, message.chat.first_name, message.chat.last_name)
 
     promo_code_text = ''
@@ -91,21 +91,16 @@ async def send_consultation(message: Message, **kwargs):
 @router.message(Command("calendar_reminder"))
 @check_block_user
 async def send_treatments_calendar(message: Message, **kwargs):
-    tasks = await db.get_reminders(user_id=message.chat.id, value=int(True), is_multiple=True)
-    if len(tasks) == 0:
-        await message.answer(text=text_message.NONE_REMINDER_TEXT, reply_markup=inline_markup.get_none_task_keyboard())
-    else:
-        await send_tasks(message, 1)
+    await send_tasks(message, 1)
 
 
 @router.message(Command(commands=["admin", "ap", "panel"]))
 @check_admin
 async def send_admin_panel(message: Message, **kwargs):
-    users = await db.get_users(is_multiple=True)
-    forms = await db.get_users(is_multiple=True, form_value=1)
-    admins = await db.get_users(level=2, is_multiple=True)
+    counts = await db.get_user_counts()
     await message.answer(
-        text=text_message.ADMIN_PANEL_TEXT.format(users_len=len(users), form_len=len(forms), admins_len=len(admins)),
+        text=text_message.ADMIN_PANEL_TEXT.format(users_len=counts['users'], form_len=counts['forms'],
+                                                  admins_len=counts['admins']),
         reply_markup=inline_markup.get_admin_menu_keyboard()
     )
 
@@ -113,7 +108,6 @@ async def send_admin_panel(message: Message, **kwargs):
 @router.message(Command("send_images"))
 @check_admin
 async def send_images(message: Message, **kwargs):
-    await db.ensure_images_table()
     images_dir = pathlib.Path(img_path)
     if not images_dir.exists():
         await message.answer(text=text_message.ERROR_TEXT)
@@ -136,9 +130,11 @@ async def send_images(message: Message, **kwargs):
 
 
 async def send_tasks(message: Message, page: int = 1) -> None:
-    tasks = await db.get_reminders(user_id=message.chat.id, value=int(True), is_multiple=True)
-    task = tasks[page - 1]
-    await message.answer(text=await get_task_text(task), reply_markup=inline_markup.get_task_keyboard(page, len(tasks)))
+    task, total = await db.get_reminder_page(message.chat.id, page)
+    if task is None:
+        await message.answer(text=text_message.NONE_REMINDER_TEXT, reply_markup=inline_markup.get_none_task_keyboard())
+        return
+    await message.answer(text=await get_task_text(task), reply_markup=inline_markup.get_task_keyboard(page, total))
 
 
 async def send_form_text(message: Message, user_id: int | str, promo_code: str,
@@ -137,7 +137,6 @@ def get_dict_fetch(cursor, fetch):
 
 async def get_photo_id(file_path: str) -> str:
     relative_path = _make_relative_path(file_path)
-    await db.ensure_images_table()
     image = await db.get_image(relative_path)
     if image is None:
         raise FileNotFoundError(f"Файл {relative_path} не найден в базе. Используйте /send_images для обновления хранилища.")
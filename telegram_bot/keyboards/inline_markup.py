@@ -300,38 +300,52 @@ def get_back_admin_menu_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[get_admin_menu_button(text='⬅️ Назад')])
 
 
-async def get_users_keyboard(page, is_admin: bool = False, is_have_forms: bool = False) -> InlineKeyboardMarkup:
+async def get_users_keyboard(page, is_admin: bool = False, is_have_forms: bool = False,
+                             after: str | None = None, before: str | None = None) -> InlineKeyboardMarkup:
+    """Страница списка пользователей.
+
+    Листание по курсору: в callback_data кнопок лежит номер страницы и
+    user_id крайнего пользователя, следующая страница читается от него (keyset).
+    """
+
     builder = InlineKeyboardBuilder()
     if is_admin:
-        users = await db.get_users(is_multiple=True, level=2)
+        kind = 'admins'
         callback_data_start = 'choose_admin'
-        prefix = 'admin:admins'
     elif is_have_forms:
-        users = await db.get_users(is_multiple=True, form_value=1)
+        kind = 'forms'
         callback_data_start = 'choose_forms'
-        prefix = 'admin:forms'
     else:
-        users = await db.get_users(is_multiple=True)
+        kind = 'users'
         callback_data_start = 'choose_user'
-        prefix = 'admin:users'
+    prefix = f'admin:{kind}'
 
-    total_pages = (len(users) + 9) // 10
-    users = users[(page - 1) * 10: page * 10]
+    users, has_more = await db.get_users_page(kind, after=after, before=before)
+    if before is not None:
+        has_prev, has_next = has_more, True
+        if not has_more:
+            page = 1
+    else:
+        has_prev, has_next = page > 1, has_more
     for user in users:
         builder.row(InlineKeyboardButton(text=f"{user['full_name']} (ID: {user['user_id']})",
                                          callback_data=f"{callback_data_start}:{user['user_id']}"))
-    navigation_buttons = get_page_buttons(page, total_pages, prefix)
-    builder.row(*navigation_buttons)
+    if users:
+        navigation_buttons = get_page_buttons(page, prefix, users[0]['user_id'] if has_prev else None,
+                                              users[-1]['user_id'] if has_next else None)
+        builder.row(*navigation_buttons)
     builder.row(*get_admin_menu_button('🔙 Главное меню'))
     return builder.as_markup()
 
 
-def get_page_buttons(page: int, total_pages: int, callback_data_start: str):
+def get_page_buttons(page: int, callback_data_start: str, first_id=None, last_id=None):
     buttons = []
-    if page > 1:
-        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{callback_data_start}:{page - 1}"))
-    if page < total_pages:
-        buttons.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"{callback_data_start}:{page + 1}"))
+    if first_id is not None:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад",
+                                            callback_data=f"{callback_data_start}:{page - 1}:p:{first_id}"))
+    if last_id is not None:
+        buttons.append(InlineKeyboardButton(text="Вперед ➡️",
+                                            callback_data=f"{callback_data_start}:{page + 1}:n:{last_id}"))
     return buttons
 
 
@@ -0,0 +1,418 @@
+"""Версионные миграции схемы БД.
+
+Раньше таблицы создавались лениво (ensure_* перед запросами): каждый
+холодный воркер webapp и каждый поиск картинки платили за лишние
+DDL-запросы. Теперь схема обновляется один раз — при старте бота или
+командой:
+
+    python -m telegram_bot.migrations          # применить новые миграции
+    python -m telegram_bot.migrations --status # показать версию схемы
+
+В таблице schema_version записаны применённые версии. Миграции выполняются
+под advisory lock, поэтому одновременный запуск бота и webapp безопасен.
+Каждая миграция идёт в своей транзакции вместе с записью в schema_version.
+
+Первые миграции повторяют старые ensure_* (IF NOT EXISTS), так что на
+существующей базе они просто отмечаются как применённые.
+Новую миграцию добавляем в конец MIGRATIONS со следующим номером;
+уже применённые миграции не редактируем.
+"""
+
+import argparse
+import logging
+import time
+
+from telegram_bot import db
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock для миграций (любое постоянное число)
+_LOCK_KEY = 724_310_001
+
+# Другой защиты от двойной записи, кроме этого ограничения, нет (проверки
+# пересечений в webapp опираются на него), поэтому без него миграция не
+# проходит: пересекающиеся записи нужно отменить или перенести вручную.
+_ADD_BOOKINGS_NO_OVERLAP = """
+DO $$
+DECLARE
+    pairs BIGINT;
+    sample TEXT;
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'bookings_no_overlap') THEN
+        RETURN;
+    END IF;
+    SELECT count(*), array_to_string((array_agg(a.id || '/' || b.id ORDER BY a.id, b.id))[1:10], ', ')
+    INTO pairs, sample
+    FROM bookings a
+    JOIN bookings b ON a.id < b.id AND a.slot && b.slot
+    WHERE a.status = 'confirmed' AND b.status = 'confirmed';
+    IF pairs > 0 THEN
+        RAISE EXCEPTION 'bookings_no_overlap: % pair(s) of confirmed bookings overlap (ids: %)', pairs, sample
+            USING HINT = 'Cancel or move the overlapping bookings, then run python -m telegram_bot.migrations';
+    END IF;
+    ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap
+        EXCLUDE USING gist (slot WITH &&) WHERE (status = 'confirmed');
+END $$
+"""
+
+# Миграции 8 и 9 впервые читают текстовые метки времени как числа
+_NUMERIC_RE = r"^-?[0-9]+(\.[0-9]*)?([eE][-+]?[0-9]+)?$"
+_NUMERIC_TIMESTAMP_COLUMNS = (
+    ("reminders", "start_date"),
+    ("reminders", "end_date"),
+    ("pets", "birth_date"),
+    ("user_profile", "birth_date"),
+)
+# Нечисловое значение уронило бы приведение типа в миграции 8 или пропало бы
+# (стало NULL) без следа в миграции 9 — вместо этого ещё до миграции 8
+# останавливаемся и называем, сколько таких строк и где
+_CHECK_NUMERIC_TIMESTAMPS = """
+DO $$
+DECLARE
+    bad TEXT := '';
+    n BIGINT;
+BEGIN
+""" + "".join(
+    f"""
+    SELECT count(*) INTO n FROM {table}
+    WHERE trim({column}::text) <> '' AND trim({column}::text) !~ '{_NUMERIC_RE}';
+    IF n > 0 THEN
+        bad := bad || '{table}.{column}: ' || n || ' row(s); ';
+    END IF;
+"""
+    for table, column in _NUMERIC_TIMESTAMP_COLUMNS
+) + """
+    IF bad <> '' THEN
+        RAISE EXCEPTION 'non-numeric timestamps would be lost: %', bad
+            USING HINT = 'Fix or clear these values (unix timestamps expected), then run python -m telegram_bot.migrations';
+    END IF;
+END $$
+"""
+
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (
+        1,
+        "pets.about_pet",
+        [
+            "ALTER TABLE pets ADD COLUMN IF NOT EXISTS about_pet TEXT",
+        ],
+    ),
+    (
+        2,
+        "bookings",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS bookings (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                start_ts DOUBLE PRECISION NOT NULL,
+                end_ts DOUBLE PRECISION NOT NULL,
+                services JSONB NOT NULL,
+                total_price INTEGER NOT NULL,
+                comment TEXT,
+                promo_code TEXT,
+                specialist TEXT NOT NULL,
+                created_at DOUBLE PRECISION NOT NULL,
+                status TEXT NOT NULL DEFAULT 'confirmed'
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS bookings_user_id_idx ON bookings(user_id)",
+            "CREATE INDEX IF NOT EXISTS bookings_start_ts_idx ON bookings(start_ts)",
+            "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS reminder_24_sent BOOLEAN NOT NULL DEFAULT FALSE",
+            "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS reminder_3_sent BOOLEAN NOT NULL DEFAULT FALSE",
+            "ALTER TABLE bookings ADD COLUMN IF NOT EXISTS followup_sent BOOLEAN NOT NULL DEFAULT FALSE",
+        ],
+    ),
+    (
+        3,
+        "bookings_no_overlap",
+        [
+            # Подтверждённые записи не могут пересекаться по времени (см. db.BookingConflictError)
+            """
+            ALTER TABLE bookings ADD COLUMN IF NOT EXISTS slot NUMRANGE
+                GENERATED ALWAYS AS (numrange(start_ts::numeric, end_ts::numeric, '[)')) STORED
+            """,
+            _ADD_BOOKINGS_NO_OVERLAP,
+        ],
+    ),
+    (
+        4,
+        "booking admin config",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS booking_services_custom (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                description TEXT,
+                duration_min INTEGER NOT NULL,
+                price INTEGER NOT NULL,
+                created_at DOUBLE PRECISION NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS booking_services_custom_id_idx ON booking_services_custom(id)",
+            """
+            CREATE TABLE IF NOT EXISTS booking_service_availability (
+                service_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                slots JSONB NOT NULL,
+                updated_at DOUBLE PRECISION NOT NULL,
+                PRIMARY KEY (service_id, date)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS booking_service_availability_date_idx ON booking_service_availability(date)",
+        ],
+    ),
+    (
+        5,
+        "bot_images",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS bot_images (
+                key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                media_type TEXT NOT NULL DEFAULT 'photo'
+            )
+            """,
+        ],
+    ),
+    (
+        6,
+        "notification_outbox",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id BIGSERIAL PRIMARY KEY,
+                chat_id BIGINT NOT NULL,
+                method TEXT NOT NULL DEFAULT 'sendMessage',
+                payload JSONB NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at DOUBLE PRECISION NOT NULL,
+                last_error TEXT,
+                created_at DOUBLE PRECISION NOT NULL,
+                sent_at DOUBLE PRECISION
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS notification_outbox_due_idx "
+            "ON notification_outbox(next_attempt_at) WHERE status = 'pending'",
+        ],
+    ),
+    (
+        7,
+        "broadcast jobs",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                admin_chat_id BIGINT NOT NULL,
+                text TEXT NOT NULL,
+                photos JSONB NOT NULL DEFAULT '[]'::jsonb,
+                status TEXT NOT NULL DEFAULT 'running',
+                total INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                progress_message_id BIGINT,
+                created_at DOUBLE PRECISION NOT NULL,
+                finished_at DOUBLE PRECISION
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                job_id BIGINT NOT NULL REFERENCES broadcast_jobs(id) ON DELETE CASCADE,
+                chat_id BIGINT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (job_id, chat_id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS broadcast_recipients_pending_idx "
+            "ON broadcast_recipients(job_id, chat_id) WHERE status = 'pending'",
+        ],
+    ),
+    (
+        8,
+        "reminders.next_fire_at",
+        [
+            # end_date здесь ещё текст: сначала убеждаемся, что все значения числовые
+            _CHECK_NUMERIC_TIMESTAMPS,
+            # Когда напоминание сработает в следующий раз (= end_date активного напоминания)
+            "ALTER TABLE reminders ADD COLUMN IF NOT EXISTS next_fire_at DOUBLE PRECISION",
+            f"""
+            UPDATE reminders SET next_fire_at = CASE WHEN trim(end_date::text) ~ '{_NUMERIC_RE}'
+                                                     THEN trim(end_date::text)::double precision
+                                                END
+            WHERE next_fire_at IS NULL
+            """,
+            "CREATE INDEX IF NOT EXISTS reminders_next_fire_at_idx ON reminders(next_fire_at) WHERE value = 1",
+        ],
+    ),
+    (
+        9,
+        "numeric timestamps and filter indexes",
+        [
+            # Метки времени хранились текстом: сортировка по start_date была строковой,
+            # а сравнение — только после float() в Python. Пустые строки станут NULL;
+            # другие нечисловые значения остановили бы ещё миграцию 8 (_CHECK_NUMERIC_TIMESTAMPS).
+            *[
+                f"""
+                ALTER TABLE {table} ALTER COLUMN {column} TYPE DOUBLE PRECISION USING (
+                    CASE WHEN trim({column}::text) ~ '{_NUMERIC_RE}'
+                         THEN trim({column}::text)::double precision
+                    END
+                )
+                """
+                for table, column in _NUMERIC_TIMESTAMP_COLUMNS
+            ],
+            # Список напоминаний пользователя (get_reminder_page, get_reminders)
+            "CREATE INDEX IF NOT EXISTS reminders_user_value_idx ON reminders(user_id, value, start_date)",
+            "CREATE INDEX IF NOT EXISTS pets_user_id_idx ON pets(user_id)",
+            # Поиск по промокоду и списки анкет/админов в админке (keyset по user_id)
+            "CREATE INDEX IF NOT EXISTS users_promocode_idx ON users(promocode)",
+            "CREATE INDEX IF NOT EXISTS users_level_idx ON users(level, user_id)",
+            "CREATE INDEX IF NOT EXISTS users_form_value_idx ON users(form_value, user_id)",
+            # user_profile.user_id обычно уже уникален (ON CONFLICT в add_user) — не дублируем индекс
+            """
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_index i
+                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                    WHERE i.indrelid = 'user_profile'::regclass AND a.attname = 'user_id'
+                ) THEN
+                    CREATE INDEX user_profile_user_id_idx ON user_profile(user_id);
+                END IF;
+            END $$
+            """,
+            "ANALYZE reminders",
+            "ANALYZE pets",
+            "ANALYZE users",
+            "ANALYZE user_profile",
+        ],
+    ),
+    (
+        10,
+        "cache_versions",
+        [
+            # Версии кэшей воркеров webapp (см. db.bump_cache_version и telegram_webapp/catalog.py)
+            """
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0
+            )
+            """,
+            "INSERT INTO cache_versions (name, version) VALUES ('services', 1) ON CONFLICT (name) DO NOTHING",
+        ],
+    ),
+    (
+        11,
+        "bookings admin cursor index",
+        [
+            # Список записей в админке: фильтр по статусу и окну дат, keyset по (start_ts, id)
+            "CREATE INDEX IF NOT EXISTS bookings_status_start_id_idx ON bookings(status, start_ts, id)",
+        ],
+    ),
+    (
+        12,
+        "broadcast_jobs lease",
+        [
+            # Кто сейчас отправляет рассылку и до какого времени (см. broadcaster.run_dispatcher)
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS locked_by TEXT",
+            "ALTER TABLE broadcast_jobs ADD COLUMN IF NOT EXISTS lease_until DOUBLE PRECISION",
+            "CREATE INDEX IF NOT EXISTS broadcast_jobs_running_idx ON broadcast_jobs(lease_until) WHERE status = 'running'",
+        ],
+    ),
+]
+
+
+def _ensure_version_table(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DOUBLE PRECISION NOT NULL
+        )
+        """
+    )
+
+
+def _applied_versions(cur) -> set[int]:
+    cur.execute("SELECT version FROM schema_version")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate() -> list[int]:
+    """Применяет недостающие миграции. Возвращает номера применённых."""
+
+    applied_now: list[int] = []
+    with db.pool.connection() as conn:
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                # Сессионная блокировка: второй процесс дождётся окончания миграций
+                cur.execute("SELECT pg_advisory_lock(%s)", (_LOCK_KEY,))
+                try:
+                    _ensure_version_table(cur)
+                    done = _applied_versions(cur)
+                    for version, name, statements in MIGRATIONS:
+                        if version in done:
+                            continue
+                        logger.info(f"Applying migration {version}: {name}")
+                        cur.execute("BEGIN")
+                        try:
+                            for sql in statements:
+                                cur.execute(sql)
+                            cur.execute(
+                                "INSERT INTO schema_version (version, name, applied_at) VALUES (%s, %s, %s)",
+                                (version, name, time.time()),
+                            )
+                            cur.execute("COMMIT")
+                        except Exception:
+                            cur.execute("ROLLBACK")
+                            raise
+                        applied_now.append(version)
+                finally:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+        finally:
+            conn.autocommit = False
+    return applied_now
+
+
+def current_version() -> int:
+    with db.pool.connection() as conn:
+        with conn:
+            with conn.cursor() as cur:
+                _ensure_version_table(cur)
+                cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+                return int(cur.fetchone()[0])
+
+
+def latest_version() -> int:
+    return max(version for version, _, _ in MIGRATIONS)
+
+
+async def run_migrations() -> list[int]:
+    """migrate() для async-кода (бот): выполняется в потоке БД."""
+
+    return await db.run_in_db_thread(migrate)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("--status", action="store_true", help="show schema version and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        print(f"schema version: {current_version()} (latest: {latest_version()})")
+        return
+    applied = migrate()
+    if applied:
+        print(f"applied migrations: {', '.join(map(str, applied))}")
+    else:
+        print("schema is up to date")
+    print(f"schema version: {current_version()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,89 @@
+"""Планировщик напоминаний.
+
+Вместо опроса по интервалу (раз в 3 часа / 30 минут с полным просмотром
+таблиц) у каждого вида напоминаний одна date-задача APScheduler, которая
+срабатывает ровно к ближайшему сроку:
+
+1. check_* отправляет только наступившие напоминания (выборка по индексу);
+2. next_due() возвращает ближайший следующий срок (min по индексу);
+3. задача переставляется на этот срок.
+
+Раз в SAFETY_SWEEP задача запускается в любом случае — так подхватываются
+изменения из других процессов (например, записи, созданные в webapp).
+"""
+
+import logging
+import time
+from datetime import datetime
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
 from telegram_bot import db
+from telegram_bot.env import local_timezone
+
+logger = logging.getLogger(__name__)
 
 scheduler = AsyncIOScheduler()
 
+# Не реже этого перепроверяем сроки, даже если ничего не запланировано (сек)
+SAFETY_SWEEP = 10 * 60
+# Если срок уже прошёл, а отправить не удалось — пауза перед повтором (сек)
+RETRY_DELAY = 30
+
+# name -> (отправить наступившие, ближайший срок)
+_JOBS = {
+    "reminders": (db.check_reminders, db.get_next_reminder_due),
+    "booking_reminders": (db.check_booking_reminders, db.get_next_booking_reminder_due),
+}
+
+
+def _schedule_at(name: str, run_at: float) -> None:
+    scheduler.add_job(
+        _run,
+        "date",
+        run_date=datetime.fromtimestamp(run_at, local_timezone),
+        args=[name],
+        id=name,
+        replace_existing=True,
+        # Срабатывание, отложенное занятым event loop, всё равно выполняем
+        misfire_grace_time=None,
+    )
+
+
+async def _run(name: str) -> None:
+    check, next_due = _JOBS[name]
+    try:
+        await check()
+    except Exception:
+        logger.exception(f"scheduler: {name} failed")
+
+    now = time.time()
+    try:
+        due = await next_due()
+    except Exception:
+        logger.exception(f"scheduler: {name} next_due failed")
+        due = None
+    if due is None:
+        run_at = now + SAFETY_SWEEP
+    elif due <= now:
+        run_at = now + RETRY_DELAY
+    else:
+        run_at = min(due, now + SAFETY_SWEEP)
+    _schedule_at(name, run_at)
+
+
+def wake(name: str) -> None:
+    """Перепланировать немедленно (после добавления/изменения напоминания)."""
+
+    if scheduler.running:
+        _schedule_at(name, time.time())
+
+
+def wake_reminders() -> None:
+    wake("reminders")
+
+
 def start_scheduler():
-    scheduler.add_job(db.check_reminders, 'interval', hours=3)
-    scheduler.add_job(db.check_booking_reminders, 'interval', minutes=30)
     scheduler.start()
+    for name in _JOBS:
+        _schedule_at(name, time.time())
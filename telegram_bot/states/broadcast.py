@@ -1,15 +1,13 @@
-import asyncio
 import html
-import time
 from typing import List
 
 from aiogram import F, Router
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery, InputMediaPhoto, Message
-from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import CallbackQuery, Message
+from aiogram.exceptions import TelegramBadRequest
 
-from telegram_bot import db, text_message
+from telegram_bot import broadcaster, text_message
 from telegram_bot.env import bot
 from telegram_bot.keyboards import inline_markup
 
@@ -23,12 +21,6 @@ class Broadcast(StatesGroup):
 router = Router()
 
 
-# Soft global rate limit for mass-send to avoid flood limits.
-# Telegram API limits vary; this is a safe default for a small/medium bot.
-BROADCAST_RPS = 20  # ~20 send actions per second
-BROADCAST_DELAY = 1.0 / BROADCAST_RPS
-
-
 async def _remember_msg(state: FSMContext, msg: Message | None) -> None:
     """Remember message ids to cleanup the admin chat after confirm/cancel.
 
@@ -179,27 +171,30 @@ async def broadcast_photos_done(callback: CallbackQuery, state: FSMContext) -> N
     await _remember_msg(state, title_msg)
 
     if photos:
-        # Caption limit is 1024; if longer — send text separately.
-        if len(formatted) > 900:
-            m = await callback.message.answer(formatted)
-            await _remember_msg(state, m)
-            media = [InputMediaPhoto(media=pid) for pid in photos]
-        else:
-            media = [InputMediaPhoto(media=photos[0], caption=formatted)]
-            media.extend(InputMediaPhoto(media=pid) for pid in photos[1:])
-        try:
-            sent = await bot.send_media_group(chat_id=callback.from_user.id, media=media)
-            await _remember_many(state, sent)
-        except TelegramBadRequest:
-            # fallback: send as separate photos
-            m = await callback.message.answer(formatted)
-            await _remember_msg(state, m)
-            for pid in photos:
-                try:
-                    pm = await bot.send_photo(chat_id=callback.from_user.id, photo=pid)
-                    await _remember_msg(state, pm)
-                except Exception:
-                    continue
+        # Превью собирается тем же кодом, что и сама рассылка
+        # (длинный текст — отдельным сообщением, см. broadcaster.prepare_payload).
+        payload = broadcaster.prepare_payload(formatted, photos)
+        text_sent = False
+        for method, kwargs, _ in payload.steps:
+            if method != "send_media_group":
+                sent = await getattr(bot, method)(chat_id=callback.from_user.id, **kwargs)
+                await _remember_msg(state, sent)
+                text_sent = True
+                continue
+            try:
+                sent = await bot.send_media_group(chat_id=callback.from_user.id, **kwargs)
+                await _remember_many(state, sent)
+            except TelegramBadRequest:
+                # fallback: send as separate photos (текст — только если он ещё не ушёл отдельным шагом)
+                if not text_sent:
+                    m = await callback.message.answer(formatted)
+                    await _remember_msg(state, m)
+                for pid in photos:
+                    try:
+                        pm = await bot.send_photo(chat_id=callback.from_user.id, photo=pid)
+                        await _remember_msg(state, pm)
+                    except Exception:
+                        continue
     else:
         m = await callback.message.answer(formatted)
         await _remember_msg(state, m)
@@ -225,79 +220,15 @@ async def broadcast_send(callback: CallbackQuery, state: FSMContext) -> None:
     photos: List[str] = list(data.get("photos") or [])[:10]
     formatted = _format_broadcast_text(raw_text)
 
-    users = await db.get_users(is_multiple=True)
-    # отправляем всем, включая админов, но пропускаем заблокированных в БД
-    user_ids = [int(u["user_id"]) for u in users if int(u.get("level", 0)) >= 0]
-
-    ok = 0
-    fail = 0
-
-    # Soft rate limiting (token bucket-ish): keep a target delay between send actions.
-    next_allowed = time.monotonic()
-
-    async def _soft_wait() -> None:
-        nonlocal next_allowed
-        now = time.monotonic()
-        if now < next_allowed:
-            await asyncio.sleep(next_allowed - now)
-        # schedule next slot
-        next_allowed = max(next_allowed, time.monotonic()) + BROADCAST_DELAY
-
-    async def _send_to(uid: int) -> None:
-        nonlocal ok, fail, next_allowed
-        try:
-            if photos:
-                if len(formatted) > 900:
-                    await bot.send_message(chat_id=uid, text=formatted)
-                    media = [InputMediaPhoto(media=pid) for pid in photos]
-                else:
-                    media = [InputMediaPhoto(media=photos[0], caption=formatted)]
-                    media.extend(InputMediaPhoto(media=pid) for pid in photos[1:])
-                await bot.send_media_group(chat_id=uid, media=media)
-            else:
-                await bot.send_message(chat_id=uid, text=formatted)
-            ok += 1
-        except TelegramRetryAfter as e:
-            # If Telegram asks to slow down, wait and retry once.
-            try:
-                wait_s = float(getattr(e, "retry_after", 1.0))
-            except Exception:
-                wait_s = 1.0
-            await asyncio.sleep(wait_s + 0.5)
-            # Also shift the limiter window forward.
-            next_allowed = max(next_allowed, time.monotonic() + wait_s + 0.5)
-            try:
-                if photos:
-                    if len(formatted) > 900:
-                        await bot.send_message(chat_id=uid, text=formatted)
-                        media = [InputMediaPhoto(media=pid) for pid in photos]
-                    else:
-                        media = [InputMediaPhoto(media=photos[0], caption=formatted)]
-                        media.extend(InputMediaPhoto(media=pid) for pid in photos[1:])
-                    await bot.send_media_group(chat_id=uid, media=media)
-                else:
-                    await bot.send_message(chat_id=uid, text=formatted)
-                ok += 1
-            except (TelegramForbiddenError, TelegramBadRequest, TelegramRetryAfter, Exception):
-                fail += 1
-        except (TelegramForbiddenError, TelegramBadRequest):
-            fail += 1
-        except Exception:
-            fail += 1
-
-    # Running sequentially (safer for flood limits). Do not stop on errors.
-    for uid in user_ids:
-        await _soft_wait()
-        await _send_to(uid)
-
-    # Cleanup preview + all steps before it (best-effort), then show result.
+    # Cleanup preview + all steps before it (best-effort).
     try:
         await _cleanup_trail(chat_id=int(callback.from_user.id), state=state)
     except Exception:
         pass
-
     await state.clear()
-    await callback.message.answer(
-        text_message.BROADCAST_SENT_RESULT.format(ok=ok, fail=fail),
-        reply_markup=inline_markup.get_back_admin_menu_keyboard(),
-    )
+
+    # Рассылка идёт в фоне (telegram_bot/broadcaster.py): прогресс и итог
+    # бот присылает отдельным сообщением, обработчик не ждёт отправки.
+    job = await broadcaster.start_job(int(callback.from_user.id), formatted, photos)
+    if job is None:
+        await callback.message.answer(text_message.ERROR_TEXT, reply_markup=inline_markup.get_back_admin_menu_keyboard())
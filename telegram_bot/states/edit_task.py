@@ -6,7 +6,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
 from aiogram_dialog import DialogManager, StartMode
 
-from telegram_bot import db, text_message
+from telegram_bot import db, scheduler, text_message
 from telegram_bot.helper import get_media_group, get_photo_id, str_to_timestamp, timestamp_to_str
 from telegram_bot.env import bot, img_path
 from telegram_bot.keyboards import inline_markup
@@ -257,6 +257,7 @@ async def edit_data(callback: CallbackQuery, state: FSMContext) -> None:
     try:
         data = await state.get_data()
         await db.update_reminder(**data)
+        scheduler.wake_reminders()
         await callback.message.answer(
             text_message.REMINDER_EDIT_COMPLETE, reply_markup=inline_markup.get_reminder_add_complete_keyboard()
         )
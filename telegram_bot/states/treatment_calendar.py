@@ -6,7 +6,7 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, Message
 from aiogram_dialog import DialogManager, StartMode
 
-from telegram_bot import db, text_message
+from telegram_bot import db, scheduler, text_message
 from telegram_bot.env import bot, img_path
 from telegram_bot.helper import get_media_group, get_photo_id
 from telegram_bot.keyboards import inline_markup
@@ -245,6 +245,7 @@ async def process_reminder(callback: CallbackQuery, state: FSMContext) -> None:
             pet_type=pet_type,
             period=period
         )
+        scheduler.wake_reminders()
         await callback.message.answer(text=text_message.ADD_REMINDER_SUCCESSFUL_TEXT,
                                       reply_markup=inline_markup.get_reminder_add_complete_keyboard())
     except KeyError:
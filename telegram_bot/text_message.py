@@ -142,6 +142,8 @@ BROADCAST_SENT_RESULT = """✅ <b>Рассылка завершена</b>\n\n•
 
 BROADCAST_CANCELLED = """❌ <b>Рассылка отменена</b>"""
 
+BROADCAST_PROGRESS = """⏳ <b>Рассылка идёт</b>\n\n• <b>Отправлено</b>: <code>{ok}</code> из <code>{total}</code>\n• <b>Ошибок</b>: <code>{fail}</code>"""
+
 USER_INFO_TEXT = """👤 <b>{full_name} (ID: {user_id})</b>
 <b>Статус:</b> <code>{user_status}</code>"""
 
@@ -1,17 +1,19 @@
-import asyncio
 import json
 import os
 import re
 from datetime import datetime, timedelta
 from urllib.parse import parse_qs
 
-import requests
 from dotenv import load_dotenv
 from flask import Flask, jsonify, render_template, request
 
-from telegram_bot import db
+from telegram_bot import db, migrations
 from telegram_bot.env import admins_telegram_id
 from telegram_bot.helper import str_to_timestamp, get_user_stroke, get_pets_stroke
+from telegram_webapp import outbox
+from telegram_webapp.catalog import ServiceCatalog
+from telegram_webapp.runtime import run_async
+from telegram_webapp.slot_index import SlotIndex
 from telegram_webapp.services_text import SERVICES, SURVEY_FORM_TEXT, BOOKING_PROFILE, BOOKING_SERVICES
 
 app = Flask(__name__, static_folder='static')
@@ -47,20 +49,22 @@ def _is_admin(init_data: str) -> bool:
 
 
 def _send_bot_message(chat_id: int, text: str) -> bool:
-    """Отправка сообщения пользователю от бота (без aiogram, через HTTP API)."""
+    """Сообщение пользователю от бота — через outbox, без ожидания Telegram API."""
 
-    token = (os.getenv("BOT_TOKEN") or "").strip()
-    if not token:
-        return False
     try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {"chat_id": int(chat_id), "text": text, "parse_mode": "HTML"}
-        r = requests.post(url, json=payload, timeout=10)
-        return r.status_code == 200
+        return outbox.enqueue_message([int(chat_id)], text, parse_mode="HTML")
     except Exception:
         return False
 
 
+def _notify_admins(text: str) -> bool:
+    """Сообщение всем админам — через outbox, без ожидания Telegram API."""
+
+    if not admins_telegram_id:
+        return False
+    return outbox.enqueue_message(admins_telegram_id, text, parse_mode="HTML", disable_web_page_preview=True)
+
+
 def _format_dt(ts: float) -> str:
     try:
         from telegram_bot.env import local_timezone
@@ -76,7 +80,7 @@ def _format_dt(ts: float) -> str:
 
 
 def _sum_services(service_ids: list[int]) -> tuple[list[dict], int, int]:
-    by_id = {int(s["id"]): s for s in _get_all_services()}
+    by_id = service_catalog.get().by_id
     chosen = []
     total_price = 0
     total_minutes = 0
@@ -103,8 +107,8 @@ def _work_bounds(date_str: str) -> tuple[float, float]:
     from telegram_bot.env import local_timezone
 
     dt = datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=local_timezone)
-    start = dt.replace(hour=10, minute=0, second=0, microsecond=0).timestamp()
-    end = dt.replace(hour=21, minute=0, second=0, microsecond=0).timestamp()
+    start = dt.replace(hour=BOOKING_WORK_HOURS[0], minute=0, second=0, microsecond=0).timestamp()
+    end = dt.replace(hour=BOOKING_WORK_HOURS[1], minute=0, second=0, microsecond=0).timestamp()
     return start, end
 
 
@@ -114,6 +118,8 @@ def _work_bounds(date_str: str) -> tuple[float, float]:
 BOOKING_STEP_MIN = 30
 # Окно записи: показываем только ближайший месяц
 BOOKING_HORIZON_DAYS = 30
+# Рабочий день (часы, местное время): запись должна целиком в него помещаться
+BOOKING_WORK_HOURS = (10, 21)
 
 # Внешняя запись (не из бота) по умолчанию занимает 60 минут и блокирует слот.
 EXTERNAL_BOOKING_DURATION_MIN = 60
@@ -126,14 +132,8 @@ def _default_slot_hhmm() -> list[str]:
     шаг между стартами — 30 минут.
     """
     out: list[str] = []
-    for h in range(10, 21):
-        for m in range(0, 60, BOOKING_STEP_MIN):
-            # последний старт: 20:30 (рабочий день до 21:00)
-            if h == 20 and m > 30:
-                continue
-            if h == 21:
-                continue
-            out.append(f"{h:02d}:{m:02d}")
+    for minutes in range(BOOKING_WORK_HOURS[0] * 60, BOOKING_WORK_HOURS[1] * 60, BOOKING_STEP_MIN):
+        out.append(f"{minutes // 60:02d}:{minutes % 60:02d}")
     return out
 
 
@@ -156,84 +156,23 @@ def _parse_time_hhmm(value: str):
     return hh, mm
 
 
-def _coerce_slots_list(raw) -> list[str]:
-    """Normalize DB slots JSON to list[str] of HH:MM."""
-    if raw is None:
-        return []
-    if isinstance(raw, str):
-        try:
-            raw = json.loads(raw)
-        except Exception:
-            return []
-    if not isinstance(raw, list):
-        return []
-    out: list[str] = []
-    for x in raw:
-        t = _parse_time_hhmm(str(x))
-        if not t:
-            continue
-        hh, mm = t
-        out.append(f"{hh:02d}:{mm:02d}")
-    return sorted(set(out))
-
-
-def _allowed_hhmm_for_services(date_str: str, service_ids: list[int]) -> list[str]:
-    """Allowed start times (HH:MM) for given services on date.
+def _allowed_start_ts_for_services(date_str: str, service_ids: list[int], fresh: bool = False) -> list[int]:
+    """Allowed start timestamps for given services on date in local TZ.
 
     Logic:
     - If admin did not configure a date for a service -> use default slots.
     - If admin configured empty slots -> day is закрыт for this service.
     - For multiple services -> intersection across services.
-    """
 
-    if not service_ids:
-        return []
-
-    allowed: set[str] | None = None
-    for sid in service_ids:
-        row = None
-        try:
-            row = asyncio.run(db.get_service_availability(service_id=int(sid), date=date_str))
-        except Exception as e:
-            logger.error(f"get_service_availability failed: {e}")
-            row = None
-
-        if row is None:
-            slots = _default_slot_hhmm()
-        else:
-            slots = _coerce_slots_list(row.get('slots'))
-
-        # Empty list means "closed" for this service
-        cur = set(slots)
-        if allowed is None:
-            allowed = cur
-        else:
-            allowed &= cur
-
-        if not allowed:
-            return []
-
-    return sorted(allowed or [])
-
-
-def _allowed_start_ts_for_services(date_str: str, service_ids: list[int]) -> list[int]:
-    """Allowed start timestamps for given services on date in local TZ."""
-    from telegram_bot.env import local_timezone
-
-    hhmm_list = _allowed_hhmm_for_services(date_str, service_ids)
+    fresh=True — для записи в БД: расписание читается из БД, а не из индекса
+    воркера (админ мог закрыть день в другом процессе меньше ttl назад).
+    """
     try:
-        base = datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=local_timezone)
-    except Exception:
+        return slot_index.allowed_start_ts(date_str, service_ids, fresh=fresh)
+    except Exception as e:
+        logger.error(f"allowed_start_ts failed: {e}")
         return []
 
-    out: list[int] = []
-    for t in hhmm_list:
-        parsed = _parse_time_hhmm(t)
-        if not parsed:
-            continue
-        hh, mm = parsed
-        out.append(int(base.replace(hour=hh, minute=mm, second=0, microsecond=0).timestamp()))
-    return out
 
 def _is_date_in_booking_window(date_str: str) -> bool:
     """True if date_str is within [today, today+BOOKING_HORIZON_DAYS] in local TZ."""
@@ -250,67 +189,38 @@ def _is_date_in_booking_window(date_str: str) -> bool:
     return base <= req <= (base + timedelta(days=int(BOOKING_HORIZON_DAYS)))
 
 
-_BOOKINGS_READY = False
-
-
-def _ensure_bookings_ready() -> None:
-    """Создаём таблицы для онлайн-записи лениво.
-
-    На уровне импорта вызывать asyncio.run() не стоит — Flask reloader
-    может инициализировать модуль несколько раз.
-    """
-
-    global _BOOKINGS_READY
-    if _BOOKINGS_READY:
-        return
-    try:
-        asyncio.run(db.ensure_bookings_table())
-        _BOOKINGS_READY = True
-    except Exception as e:
-        logger.warning(f"ensure_bookings_table failed: {e}")
+# Свободные слоты в памяти воркера, обновляются при изменениях записей/расписания
+slot_index = SlotIndex(
+    step_min=BOOKING_STEP_MIN,
+    default_hhmm=_default_slot_hhmm(),
+    work_hours=BOOKING_WORK_HOURS,
+    ttl=float(os.getenv("SLOT_INDEX_TTL", "60")),
+)
 
 
 @app.before_request
 def _before_any_request():
-    _ensure_bookings_ready()
+    # Досылаем то, что осталось в outbox с прошлого запуска.
+    # Схема БД здесь не проверяется — её обновляют миграции (см. migrate ниже).
+    outbox.start_dispatcher()
 
 
-_SERVICES_CACHE: dict[str, object] = {"ts": 0.0, "services": BOOKING_SERVICES}
+@app.cli.command("migrate")
+def migrate_command():
+    """Применить миграции схемы БД: flask --app telegram_webapp.app migrate"""
 
+    applied = migrations.migrate()
+    print(f"applied migrations: {applied or 'none'}, schema version: {migrations.current_version()}")
 
-def _get_all_services(force: bool = False) -> list[dict]:
-    """Базовые + кастомные услуги из админки.
 
-    Чтобы не дёргать БД на каждый запрос — держим лёгкий кэш.
-    """
-    now = datetime.now().timestamp()
-    if (not force) and (now - float(_SERVICES_CACHE.get("ts") or 0) < 10):
-        return list(_SERVICES_CACHE.get("services") or BOOKING_SERVICES)
+# Базовые + кастомные услуги; перечитываются только после изменения каталога (см. catalog.py)
+service_catalog = ServiceCatalog(BOOKING_SERVICES)
 
-    services = list(BOOKING_SERVICES)
-    try:
-        custom = asyncio.run(db.get_custom_booking_services()) or []
-        # psycopg2 -> dict already
-        services.extend([dict(x) for x in custom])
-    except Exception:
-        pass
 
-    # гарантируем уникальность по id
-    seen = set()
-    uniq: list[dict] = []
-    for s in services:
-        try:
-            sid = int(s.get("id"))
-        except Exception:
-            continue
-        if sid in seen:
-            continue
-        seen.add(sid)
-        uniq.append(s)
+def _get_all_services() -> list[dict]:
+    """Базовые + кастомные услуги из админки."""
 
-    _SERVICES_CACHE["ts"] = now
-    _SERVICES_CACHE["services"] = uniq
-    return uniq
+    return list(service_catalog.get().services)
 
 
 @app.route("/", methods=['GET'])
@@ -393,8 +303,8 @@ def survey():
 def get_user_data(telegram_id):
     logger.info(f"GET /get_user_data/{telegram_id}")
     try:
-        user_profile = asyncio.run(db.get_user_profile(user_id=telegram_id))
-        pets = asyncio.run(db.get_pets(user_id=telegram_id, is_multiple=True))
+        user_profile = run_async(db.get_user_profile(user_id=telegram_id))
+        pets = run_async(db.get_pets(user_id=telegram_id, is_multiple=True))
 
         if user_profile:
             logger.info(f"Профиль пользователя найден: {user_profile['full_name']}")
@@ -513,31 +423,60 @@ def api_admin_bookings_upcoming():
     if not ok:
         return jsonify({"ok": False, "error": "forbidden"}), 403
 
+    payload = request.get_json(silent=True) or {}
+
+    # Окно по дате начала (YYYY-MM-DD, включительно); по умолчанию — с текущего момента
+    start_from = datetime.now().timestamp()
+    start_to = None
+    try:
+        if payload.get("date_from"):
+            start_from = _day_bounds(str(payload["date_from"]))[0]
+        if payload.get("date_to"):
+            start_to = _day_bounds(str(payload["date_to"]))[0] + 24 * 3600
+    except ValueError:
+        return jsonify({"ok": False, "error": "invalid_date"}), 400
+
+    status = str(payload.get("status") or "confirmed")
+    if status == "all":
+        status = None
+    elif status not in db.BOOKING_STATUSES:
+        return jsonify({"ok": False, "error": "invalid_status"}), 400
+
+    # Курсор "start_ts:id" последней записи предыдущей страницы
+    after = None
+    cursor = str(payload.get("cursor") or "").strip()
+    if cursor:
+        try:
+            ts_part, id_part = cursor.split(":", 1)
+            after = (float(ts_part), int(id_part))
+        except ValueError:
+            return jsonify({"ok": False, "error": "invalid_cursor"}), 400
+
+    try:
+        limit = min(max(int(payload.get("limit") or 50), 1), 200)
+    except (TypeError, ValueError):
+        limit = 50
+
     try:
-        bookings = asyncio.run(db.get_upcoming_bookings_all(limit=500)) or []
+        bookings, has_more = run_async(db.get_admin_bookings_page(start_from, start_to, status, after, limit))
     except Exception as e:
         logger.error(f"admin bookings failed: {e}")
-        bookings = []
+        bookings, has_more = [], False
 
     out = []
     for b in bookings:
         b = dict(b)
         user_id = b.get("user_id")
-        full_name = ""
         try:
             uid_int = int(user_id) if user_id is not None else 0
         except Exception:
             uid_int = 0
 
-        # Внешняя запись (без пользователя)
+        # Внешняя запись (без пользователя); имя клиента приходит из JOIN с user_profile
         if uid_int == 0:
             full_name = "Внешняя запись"
         else:
-            try:
-                prof = asyncio.run(db.get_user_profile(user_id=uid_int))
-                full_name = (prof or {}).get("full_name") or ""
-            except Exception:
-                full_name = ""
+            full_name = b.get("user_name") or ""
 
         services = b.get("services") or []
         primary = ""
@@ -561,10 +500,15 @@ def api_admin_bookings_upcoming():
                     (s.get("name") or "Услуга") for s in services if isinstance(s, dict)
                 ]),
                 "comment": b.get("comment") or "",
+                "status": b.get("status"),
             }
         )
 
-    return jsonify({"ok": True, "bookings": out})
+    next_cursor = None
+    if has_more and bookings:
+        last = bookings[-1]
+        next_cursor = f"{float(last['start_ts'])!r}:{int(last['id'])}"
+    return jsonify({"ok": True, "bookings": out, "next_cursor": next_cursor})
 
 
 @app.route("/api/admin/booking/details", methods=["POST"])
@@ -580,7 +524,7 @@ def api_admin_booking_details():
     except Exception:
         return jsonify({"ok": False, "error": "booking_id_required"}), 400
 
-    booking = asyncio.run(db.get_booking_by_id(booking_id))
+    booking = run_async(db.get_booking_by_id(booking_id))
     if not booking:
         return jsonify({"ok": False, "error": "not_found"}), 404
 
@@ -592,7 +536,7 @@ def api_admin_booking_details():
         uid = 0
     if uid != 0:
         try:
-            user_profile = asyncio.run(db.get_user_profile(user_id=uid))
+            user_profile = run_async(db.get_user_profile(user_id=uid))
         except Exception:
             user_profile = None
 
@@ -667,11 +611,6 @@ def api_admin_booking_create_external():
     if start_ts < day_start or end_ts > day_end:
         return jsonify({"ok": False, "error": "outside_work_hours"}), 400
 
-    # conflict check
-    conflicts = asyncio.run(db.get_bookings_in_range(start_ts, end_ts)) or []
-    if conflicts:
-        return jsonify({"ok": False, "error": "slot_busy"}), 409
-
     services = [
         {
             "id": -1,
@@ -681,21 +620,26 @@ def api_admin_booking_create_external():
         }
     ]
 
-    created = asyncio.run(
-        db.add_booking(
-            user_id=0,
-            start_ts=start_ts,
-            end_ts=end_ts,
-            services=services,
-            total_price=0,
-            specialist=str(BOOKING_PROFILE.get("specialist") or ""),
-            comment=comment,
-            promo_code=None,
+    # Пересечения проверяет ограничение bookings_no_overlap в самой вставке
+    try:
+        created = run_async(
+            db.add_booking(
+                user_id=0,
+                start_ts=start_ts,
+                end_ts=end_ts,
+                services=services,
+                total_price=0,
+                specialist=str(BOOKING_PROFILE.get("specialist") or ""),
+                comment=comment,
+                promo_code=None,
+            )
         )
-    )
+    except db.BookingConflictError:
+        return jsonify({"ok": False, "error": "slot_busy"}), 409
 
     if not created:
         return jsonify({"ok": False, "error": "create_failed"}), 500
+    slot_index.booking_added(created)
     return jsonify({"ok": True, "booking": created})
 
 
@@ -715,13 +659,14 @@ def api_admin_booking_cancel():
     except Exception:
         return jsonify({"ok": False, "error": "booking_id_required"}), 400
 
-    booking = asyncio.run(db.get_booking_by_id(booking_id))
+    booking = run_async(db.get_booking_by_id(booking_id))
     if not booking:
         return jsonify({"ok": False, "error": "not_found"}), 404
 
-    cancelled = asyncio.run(db.cancel_booking_admin(booking_id))
+    cancelled = run_async(db.cancel_booking_admin(booking_id))
     if not cancelled:
         return jsonify({"ok": False, "error": "update_failed"}), 500
+    slot_index.booking_removed(cancelled)
 
     cancelled = dict(cancelled)
     user_id = cancelled.get("user_id")
@@ -804,37 +749,32 @@ def api_admin_booking_update():
 
     # Валидация по расписанию (строго): админ не может поставить время,
     # которое не выбрано в доступности услуги(услуг) на эту дату.
-    allowed = set(_allowed_start_ts_for_services(date_str, service_ids))
+    allowed = set(_allowed_start_ts_for_services(date_str, service_ids, fresh=True))
     if int(start_ts) not in allowed:
         return jsonify({"ok": False, "error": "slot_not_allowed"}), 409
 
-    old = asyncio.run(db.get_booking_by_id(booking_id))
+    old = run_async(db.get_booking_by_id(booking_id))
     if not old:
         return jsonify({"ok": False, "error": "not_found"}), 404
 
-    # Conflict check (exclude current booking)
-    conflicts = asyncio.run(db.get_bookings_in_range(start_ts, end_ts)) or []
-    for c in conflicts:
-        try:
-            if int(c.get("id")) == int(booking_id):
-                continue
-        except Exception:
-            pass
-        return jsonify({"ok": False, "error": "slot_busy"}), 409
-
-    updated = asyncio.run(
-        db.reschedule_booking_admin(
-            booking_id=booking_id,
-            start_ts=start_ts,
-            end_ts=end_ts,
-            services=chosen,
-            total_price=total_price,
+    # Пересечения (кроме самой записи) проверяет ограничение bookings_no_overlap
+    try:
+        updated = run_async(
+            db.reschedule_booking_admin(
+                booking_id=booking_id,
+                start_ts=start_ts,
+                end_ts=end_ts,
+                services=chosen,
+                total_price=total_price,
+            )
         )
-    )
+    except db.BookingConflictError:
+        return jsonify({"ok": False, "error": "slot_busy"}), 409
     if not updated:
         return jsonify({"ok": False, "error": "update_failed"}), 500
 
     updated = dict(updated)
+    slot_index.booking_moved(updated)
 
     # Notify user
     try:
@@ -890,12 +830,12 @@ def api_admin_services_add():
         base_max = 0
     custom_max = 0
     try:
-        custom_max = asyncio.run(db.get_custom_services_max_id())
+        custom_max = run_async(db.get_custom_services_max_id())
     except Exception:
         custom_max = 0
 
     new_id = max(base_max, custom_max) + 1
-    created = asyncio.run(
+    created = run_async(
         db.add_custom_booking_service(
             service_id=new_id,
             name=name,
@@ -907,8 +847,9 @@ def api_admin_services_add():
     if not created:
         return jsonify({"ok": False, "error": "create_failed"}), 500
 
-    # refresh cache
-    _get_all_services(force=True)
+    # Новая версия каталога: этот воркер перечитает его сразу, остальные — по NOTIFY
+    run_async(db.bump_cache_version("services"))
+    service_catalog.invalidate()
     return jsonify({"ok": True, "service": dict(created)})
 
 
@@ -931,7 +872,7 @@ def api_admin_availability_get():
 
     row = None
     try:
-        row = asyncio.run(db.get_service_availability(service_id=service_id, date=date_str))
+        row = run_async(db.get_service_availability(service_id=service_id, date=date_str))
     except Exception as e:
         logger.error(f"availability get failed: {e}")
 
@@ -967,7 +908,7 @@ def api_admin_availability_dates():
         return jsonify({"ok": False, "error": "service_id_required"}), 400
 
     try:
-        dates = asyncio.run(db.list_availability_dates(service_id=service_id)) or []
+        dates = run_async(db.list_availability_dates(service_id=service_id)) or []
     except Exception as e:
         logger.error(f"availability dates failed: {e}")
         dates = []
@@ -1022,17 +963,19 @@ def api_admin_availability_set():
     # Пустой список = админ закрыл день по этой услуге
     if not slots:
         try:
-            row = asyncio.run(db.upsert_service_availability(service_id=service_id, date=date_str, slots=[]))
+            row = run_async(db.upsert_service_availability(service_id=service_id, date=date_str, slots=[]))
         except Exception as e:
             logger.error(f"availability set (close day) failed: {e}")
             return jsonify({"ok": False, "error": "server_error"}), 500
+        slot_index.availability_set(service_id, date_str, [])
         return jsonify({"ok": True, "availability": dict(row) if row else None, "slots": []})
 
     try:
-        row = asyncio.run(db.upsert_service_availability(service_id=service_id, date=date_str, slots=slots))
+        row = run_async(db.upsert_service_availability(service_id=service_id, date=date_str, slots=slots))
     except Exception as e:
         logger.error(f"availability set failed: {e}")
         return jsonify({"ok": False, "error": "server_error"}), 500
+    slot_index.availability_set(service_id, date_str, slots)
 
     return jsonify({"ok": True, "availability": dict(row) if row else None, "slots": slots})
 
@@ -1060,10 +1003,11 @@ def api_admin_availability_delete():
 
     # «Удалить дату» = закрыть день (слоты = [])
     try:
-        asyncio.run(db.upsert_service_availability(service_id=service_id, date=date_str, slots=[]))
+        run_async(db.upsert_service_availability(service_id=service_id, date=date_str, slots=[]))
     except Exception as e:
         logger.error(f"availability delete (close day) failed: {e}")
         return jsonify({"ok": False, "error": "server_error"}), 500
+    slot_index.availability_set(service_id, date_str, [])
 
     return jsonify({"ok": True, "date": date_str, "service_id": service_id})
 
@@ -1082,9 +1026,9 @@ def api_ensure_user():
     last_name = tg_user.get("last_name") or ""
 
     try:
-        exists = asyncio.run(db.get_users(user_id=user_id))
+        exists = run_async(db.get_users(user_id=user_id))
         if not exists:
-            asyncio.run(db.add_user(user_id=user_id, username=username, name=first_name, last_name=last_name))
+            run_async(db.add_user(user_id=user_id, username=username, name=first_name, last_name=last_name))
         return jsonify({"ok": True, "user_id": user_id})
     except Exception as e:
         logger.error(f"ensure_user failed: {e}")
@@ -1094,7 +1038,7 @@ def api_ensure_user():
 @app.route("/api/profile/has_form/<telegram_id>", methods=["GET"])
 def api_has_form(telegram_id):
     try:
-        value = asyncio.run(db.is_user_have_form(user_id=telegram_id))
+        value = run_async(db.is_user_have_form(user_id=telegram_id))
         return jsonify({"ok": True, "has_form": bool(value)})
     except Exception as e:
         logger.error(f"has_form failed: {e}")
@@ -1104,8 +1048,8 @@ def api_has_form(telegram_id):
 @app.route("/api/profile/details/<telegram_id>", methods=["GET"])
 def api_profile_details(telegram_id):
     try:
-        user_profile = asyncio.run(db.get_user_profile(user_id=telegram_id))
-        pets = asyncio.run(db.get_pets(user_id=telegram_id, is_multiple=True)) or []
+        user_profile = run_async(db.get_user_profile(user_id=telegram_id))
+        pets = run_async(db.get_pets(user_id=telegram_id, is_multiple=True)) or []
 
         if not user_profile:
             return jsonify({"ok": True, "profile": None, "pets": []})
@@ -1153,7 +1097,7 @@ def api_booking_available_dates():
     except Exception:
         service_ids = []
 
-    chosen, _, _ = _sum_services(service_ids)
+    chosen, _, total_minutes = _sum_services(service_ids)
     if not chosen:
         return jsonify({"ok": False, "error": "services_required"}), 400
 
@@ -1164,11 +1108,16 @@ def api_booking_available_dates():
     except Exception:
         base = datetime.now().date()
 
-    out: list[str] = []
-    for i in range(0, int(BOOKING_HORIZON_DAYS) + 1):
-        d = (base + timedelta(days=i)).strftime('%Y-%m-%d')
-        if _allowed_hhmm_for_services(d, service_ids):
-            out.append(d)
+    days = [(base + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(0, int(BOOKING_HORIZON_DAYS) + 1)]
+    duration_sec = max(15, int(total_minutes)) * 60
+
+    # Закрытые и полностью занятые дни не показываем. Всё окно считается
+    # по индексу слотов в памяти; в БД он ходит только за устаревшими днями.
+    try:
+        out = slot_index.available_dates(days, service_ids, duration_sec, datetime.now().timestamp())
+    except Exception as e:
+        logger.error(f"available_dates failed: {e}")
+        out = []
 
     return jsonify({"ok": True, "dates": out})
 
@@ -1193,43 +1142,20 @@ def api_booking_slots():
         return jsonify({"ok": False, "error": "services_required"}), 400
 
     duration_sec = max(15, int(total_minutes)) * 60
-    work_start, work_end = _work_bounds(date_str)
     now_ts = datetime.now().timestamp()
 
-    day_start, day_end = _day_bounds(date_str)
-    try:
-        bookings = asyncio.run(db.get_bookings_in_range(day_start, day_end)) or []
-    except Exception as e:
-        logger.error(f"slots get_bookings_in_range failed: {e}")
-        bookings = []
-
-    occupied = []
-    for b in bookings:
-        try:
-            occupied.append((float(b["start_ts"]), float(b["end_ts"])))
-        except Exception:
-            continue
-
     slots = []
 
     # Пользователи видят только разрешённые старты. Если админ не настраивал дату —
     # используется дефолт (10:00–21:00, шаг 30 минут). Если день закрыт — слотов нет.
-    candidates = _allowed_start_ts_for_services(date_str, service_ids)
+    # Занятость и расписание берутся из индекса слотов (см. slot_index.py).
+    try:
+        free = slot_index.free_start_ts(date_str, service_ids, duration_sec, now_ts)
+    except Exception as e:
+        logger.error(f"slots free_start_ts failed: {e}")
+        free = []
 
-    end_limit = int(work_end - duration_sec)
-    for s in sorted(set(int(x) for x in candidates)):
-        if s < now_ts:
-            continue
-        if s < int(work_start) or s > end_limit:
-            continue
-        e = s + duration_sec
-        is_free = True
-        for os, oe in occupied:
-            if s < oe and e > os:
-                is_free = False
-                break
-        if not is_free:
-            continue
+    for s in free:
         try:
             # Время в таймзоне специалиста (МСК по умолчанию)
             from telegram_bot.env import local_timezone
@@ -1249,7 +1175,7 @@ def api_booking_list(telegram_id):
     if kind not in {"upcoming", "past"}:
         kind = "upcoming"
     try:
-        items = asyncio.run(db.get_user_bookings(user_id=telegram_id, kind=kind, limit=100)) or []
+        items = run_async(db.get_user_bookings(user_id=telegram_id, kind=kind, limit=100)) or []
     except Exception as e:
         logger.error(f"booking_list failed: {e}")
         items = []
@@ -1306,7 +1232,7 @@ def api_booking_create():
         return jsonify({"ok": False, "error": "start_ts_invalid"}), 400
 
     try:
-        has_form = asyncio.run(db.is_user_have_form(user_id=user_id))
+        has_form = run_async(db.is_user_have_form(user_id=user_id))
     except Exception:
         has_form = False
     if not has_form:
@@ -1331,19 +1257,16 @@ def api_booking_create():
         return jsonify({"ok": False, "error": "outside_working_hours"}), 409
 
     # Строгое расписание: старт должен быть разрешён админом для всех выбранных услуг.
-    allowed = set(_allowed_start_ts_for_services(date_str, [int(x) for x in service_ids if str(x).isdigit()]))
+    allowed = set(_allowed_start_ts_for_services(
+        date_str, [int(x) for x in service_ids if str(x).isdigit()], fresh=True
+    ))
     if int(start_ts) not in allowed:
         return jsonify({"ok": False, "error": "slot_not_allowed"}), 409
 
+    # Занятость проверяет сама вставка (ограничение bookings_no_overlap):
+    # один запрос либо создаёт запись, либо сообщает о пересечении.
     try:
-        conflicts = asyncio.run(db.get_bookings_in_range(start_ts, end_ts)) or []
-    except Exception:
-        conflicts = []
-    if conflicts:
-        return jsonify({"ok": False, "error": "slot_unavailable"}), 409
-
-    try:
-        created = asyncio.run(
+        created = run_async(
             db.add_booking(
                 user_id=user_id,
                 start_ts=start_ts,
@@ -1355,13 +1278,18 @@ def api_booking_create():
                 promo_code=promo_code,
             )
         )
+    except db.BookingConflictError:
+        return jsonify({"ok": False, "error": "slot_unavailable"}), 409
     except Exception as e:
         logger.error(f"add_booking failed: {e}")
         return jsonify({"ok": False, "error": "server_error"}), 500
+    if not created:
+        return jsonify({"ok": False, "error": "server_error"}), 500
+    slot_index.booking_added(created)
 
     try:
-        user_profile = asyncio.run(db.get_user_profile(user_id=user_id))
-        pets = asyncio.run(db.get_pets(user_id=user_id, is_multiple=True)) or []
+        user_profile = run_async(db.get_user_profile(user_id=user_id))
+        pets = run_async(db.get_pets(user_id=user_id, is_multiple=True)) or []
 
         services_lines = "\n".join(
             [f"• {s['name']} — {s['duration_min']} мин — {s['price']} ₽" for s in chosen]
@@ -1382,20 +1310,7 @@ def api_booking_create():
             f"🐾 <b>Питомцы:</b>\n{pets_text}"
         )
 
-        admin_ids = admins_telegram_id
-        token = os.environ.get("BOT_TOKEN")
-        if token and admin_ids:
-            for admin_id in admin_ids:
-                requests.post(
-                    f"https://api.telegram.org/bot{token}/sendMessage",
-                    json={
-                        "chat_id": admin_id,
-                        "text": msg,
-                        "parse_mode": "HTML",
-                        "disable_web_page_preview": True,
-                    },
-                    timeout=10,
-                )
+        _notify_admins(msg)
     except Exception as e:
         logger.warning(f"booking notification failed: {e}")
 
@@ -1423,7 +1338,7 @@ def api_booking_cancel():
     user_id = int(tg_user["id"])
 
     try:
-        current = asyncio.run(db.get_booking_by_id(booking_id))
+        current = run_async(db.get_booking_by_id(booking_id))
     except Exception as e:
         logger.error(f"get_booking_by_id failed: {e}")
         current = None
@@ -1439,13 +1354,14 @@ def api_booking_cancel():
         pass
 
     try:
-        updated = asyncio.run(db.cancel_booking(booking_id=booking_id, user_id=user_id))
+        updated = run_async(db.cancel_booking(booking_id=booking_id, user_id=user_id))
     except Exception as e:
         logger.error(f"cancel_booking failed: {e}")
         return jsonify({"ok": False, "error": "server_error"}), 500
 
     if not updated:
         return jsonify({"ok": False, "error": "booking_not_found"}), 404
+    slot_index.booking_removed(updated)
 
     try:
         services = current.get("services")
@@ -1466,20 +1382,7 @@ def api_booking_cancel():
             f"👤 <b>Пользователь:</b> @{tg_user.get('username') or '—'}"
         )
 
-        admin_ids = admins_telegram_id
-        token = os.environ.get("BOT_TOKEN")
-        if token and admin_ids:
-            for admin_id in admin_ids:
-                requests.post(
-                    f"https://api.telegram.org/bot{token}/sendMessage",
-                    json={
-                        "chat_id": admin_id,
-                        "text": msg,
-                        "parse_mode": "HTML",
-                        "disable_web_page_preview": True,
-                    },
-                    timeout=10,
-                )
+        _notify_admins(msg)
     except Exception as e:
         logger.warning(f"cancel notification failed: {e}")
 
@@ -1504,7 +1407,7 @@ def api_booking_reschedule():
     user_id = int(tg_user["id"])
 
     try:
-        current = asyncio.run(db.get_booking_by_id(booking_id))
+        current = run_async(db.get_booking_by_id(booking_id))
     except Exception as e:
         logger.error(f"get_booking_by_id failed: {e}")
         current = None
@@ -1528,7 +1431,7 @@ def api_booking_reschedule():
         return jsonify({"ok": False, "error": "start_ts_invalid"}), 400
 
     try:
-        has_form = asyncio.run(db.is_user_have_form(user_id=user_id))
+        has_form = run_async(db.is_user_have_form(user_id=user_id))
     except Exception:
         has_form = False
     if not has_form:
@@ -1552,21 +1455,15 @@ def api_booking_reschedule():
 
     # Строгое расписание: перенос возможен только на слоты,
     # которые разрешены админом для всех выбранных услуг.
-    allowed = set(_allowed_start_ts_for_services(date_str, [int(x) for x in service_ids if str(x).isdigit()]))
+    allowed = set(_allowed_start_ts_for_services(
+        date_str, [int(x) for x in service_ids if str(x).isdigit()], fresh=True
+    ))
     if int(start_ts) not in allowed:
         return jsonify({"ok": False, "error": "slot_not_allowed"}), 409
 
+    # Пересечения с другими записями проверяет ограничение bookings_no_overlap
     try:
-        conflicts = asyncio.run(db.get_bookings_in_range(start_ts, end_ts)) or []
-    except Exception:
-        conflicts = []
-
-    conflicts = [c for c in conflicts if int(c.get('id') or 0) != booking_id]
-    if conflicts:
-        return jsonify({"ok": False, "error": "slot_unavailable"}), 409
-
-    try:
-        updated = asyncio.run(
+        updated = run_async(
             db.reschedule_booking(
                 booking_id=booking_id,
                 user_id=user_id,
@@ -1578,12 +1475,15 @@ def api_booking_reschedule():
                 promo_code=promo_code,
             )
         )
+    except db.BookingConflictError:
+        return jsonify({"ok": False, "error": "slot_unavailable"}), 409
     except Exception as e:
         logger.error(f"reschedule_booking failed: {e}")
         return jsonify({"ok": False, "error": "server_error"}), 500
 
     if not updated:
         return jsonify({"ok": False, "error": "booking_not_found"}), 404
+    slot_index.booking_moved(updated)
 
     try:
         old_dt = _format_dt(float(current.get('start_ts') or 0))
@@ -1600,20 +1500,7 @@ def api_booking_reschedule():
             f"👤 <b>Пользователь:</b> @{tg_user.get('username') or '—'}"
         )
 
-        admin_ids = admins_telegram_id
-        token = os.environ.get("BOT_TOKEN")
-        if token and admin_ids:
-            for admin_id in admin_ids:
-                requests.post(
-                    f"https://api.telegram.org/bot{token}/sendMessage",
-                    json={
-                        "chat_id": admin_id,
-                        "text": msg,
-                        "parse_mode": "HTML",
-                        "disable_web_page_preview": True,
-                    },
-                    timeout=10,
-                )
+        _notify_admins(msg)
     except Exception as e:
         logger.warning(f"reschedule notification failed: {e}")
 
@@ -1633,7 +1520,7 @@ def handle_webapp_data():
             return jsonify({"ok": False, "error": "initData отсутствует"})
 
         # Валидируем данные формы
-        validated_data = asyncio.run(db.validate_user_form_data(form_data))
+        validated_data = run_async(db.validate_user_form_data(form_data))
 
         # Проверяем результат валидации
         if validated_data is False:
@@ -1646,13 +1533,13 @@ def handle_webapp_data():
 
         # Обновляем профиль пользователя
         human = validated_data['human']
-        asyncio.run(db.update_user_profile(
+        run_async(db.update_user_profile(
             user_id=user_id,
             birth_date=str_to_timestamp(human["birth_date"]),
             full_name=human["full_name"],
             phone_number=human["phone_number"]
         ))
-        asyncio.run(db.update_user(user_id=user_id, form_value=1))
+        run_async(db.update_user(user_id=user_id, form_value=1))
 
         # Атомарно заменяем питомцев (в одной транзакции).
         # Это защищает от ситуации, когда delete прошёл, а insert упал — и питомцы пропали.
@@ -1668,29 +1555,24 @@ def handle_webapp_data():
                 "about_pet": pet.get("about_pet", ""),
             })
 
-        ok = asyncio.run(db.replace_pets(user_id, pets_payload))
+        ok = run_async(db.replace_pets(user_id, pets_payload))
         if not ok:
             logger.error("Не удалось сохранить питомцев (replace_pets)")
             return jsonify({"ok": False, "error": "Не удалось сохранить питомцев. Попробуйте ещё раз."})
 
-        # Отправляем сообщение пользователю
-        answer_url = f"https://api.telegram.org/bot{str(os.environ['BOT_TOKEN'])}/sendMessage"
-        answer_payload = {
-            "chat_id": user_id,
-            "text": f"Спасибо, {human['full_name']}! Мы получили ваши данные.",
-            "reply_markup": {"inline_keyboard": [[{"text": "🔙 Главное меню",
-                                                   "callback_data": "menu"}]]}
-        }
-
-        logger.info(f"Отправка сообщения пользователю {user_id}")
-        response = requests.post(answer_url, json=answer_payload)
-
-        if response.status_code == 200:
-            logger.info("Сообщение успешно отправлено")
-            return jsonify({"ok": True})
-        else:
-            logger.error(f"Ошибка отправки сообщения: {response.text}")
-            return jsonify({"ok": False, "error": response.text})
+        # Сообщение пользователю уходит через outbox — данные уже сохранены,
+        # ответ Telegram API не ждём
+        logger.info(f"Постановка сообщения пользователю {user_id} в очередь")
+        queued = outbox.enqueue_message(
+            [user_id],
+            f"Спасибо, {human['full_name']}! Мы получили ваши данные.",
+            reply_markup={"inline_keyboard": [[{"text": "🔙 Главное меню",
+                                                "callback_data": "menu"}]]},
+        )
+        if not queued:
+            # Анкета уже сохранена — не показываем пользователю ошибку, но фиксируем потерю сообщения
+            logger.error(f"Не удалось поставить в очередь сообщение пользователю {user_id}")
+        return jsonify({"ok": True})
 
     except Exception as e:
         logger.error(f"Ошибка обработки webapp_data: {e}")
@@ -1718,7 +1600,7 @@ def number_to_emoji(number):
 
 
 @app.route("/survey_data", methods=["POST"])
-async def handle_survey_data():
+def handle_survey_data():
     logger.info("POST /survey_data")
     try:
         content = request.json
@@ -1749,8 +1631,8 @@ async def handle_survey_data():
         logger.info(f"Обработка опроса: услуга {service_id}, пользователь {user_id}")
 
         # Получаем данные пользователя
-        user = await db.get_users(user_id=user_id)
-        user_profile = await db.get_user_profile(user_id=user_id)
+        user = run_async(db.get_users(user_id=user_id))
+        user_profile = run_async(db.get_user_profile(user_id=user_id))
 
         # Проверяем, что получили данные пользователя
         if not user_profile:
@@ -1770,57 +1652,16 @@ async def handle_survey_data():
 
         logger.info(f"Текст сообщения подготовлен, длина: {len(message_text)}")
 
-        # Отправляем сообщение в Telegram
-        bot_token = os.environ.get('BOT_TOKEN')
-        if not bot_token:
-            logger.error("BOT_TOKEN not configured")
-            return jsonify({"ok": False, "error": "BOT_TOKEN not configured"})
-
         # Получаем список администраторов
         admin_ids = admins_telegram_id
-        logger.info(f"Отправка администраторам: {admin_ids}")
         if not admin_ids:
             return jsonify({"ok": False, "error": "Администраторы не настроены"})
 
-        # Отправляем сообщение всем администраторам
-        success_count = 0
-        errors = []
-
-        for admin_id in admin_ids:
-            try:
-                answer_url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
-                answer_payload = {
-                    "chat_id": admin_id,
-                    "text": message_text,
-                    "parse_mode": "HTML"
-                }
-
-                logger.info(f"Отправка администратору {admin_id}")
-                response = requests.post(answer_url, json=answer_payload)
-                logger.info(f"Ответ Telegram API для администратора {admin_id}: {response.status_code}")
-
-                if response.status_code == 200:
-                    success_count += 1
-                else:
-                    error_msg = f"Ошибка отправки администратору {admin_id}: {response.status_code} - {response.text}"
-                    errors.append(error_msg)
-                    logger.error(error_msg)
-
-            except Exception as e:
-                error_msg = f"Исключение при отправке администратору {admin_id}: {str(e)}"
-                errors.append(error_msg)
-                logger.error(error_msg)
-
-        # Если сообщение отправлено хотя бы одному администратору, считаем успехом
-        if success_count > 0:
-            logger.info(f"Сообщение успешно отправлено {success_count} администраторам")
-            if errors:
-                logger.warning(f"Были ошибки при отправке некоторым администраторам: {errors}")
-            return jsonify({"ok": True})
-        else:
-            error_msg = "Не удалось отправить сообщение ни одному администратору: " + "; ".join(errors)
-            logger.error(error_msg)
-            return jsonify({"ok": False, "error": error_msg})
+        # Ставим сообщение администраторам в outbox — отправит фоновый диспетчер
+        logger.info(f"Постановка сообщения в очередь для {len(admin_ids)} администраторов")
+        if not outbox.enqueue_message(admin_ids, message_text, parse_mode="HTML"):
+            return jsonify({"ok": False, "error": "Не удалось поставить сообщение в очередь"})
+        return jsonify({"ok": True})
 
     except Exception as e:
         error_msg = f"Exception in handle_survey_data: {str(e)}"
@@ -1831,4 +1672,5 @@ async def handle_survey_data():
 
 
 if __name__ == "__main__":
+    migrations.migrate()
     app.run(debug=True, port=80)
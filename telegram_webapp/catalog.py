@@ -0,0 +1,151 @@
+"""Каталог услуг онлайн-записи в памяти воркера.
+
+Каталог = базовые услуги (services_text.BOOKING_SERVICES) + кастомные из
+админки (booking_services_custom). Он собирается один раз в неизменяемый
+снимок с готовым индексом id -> услуга и живёт, пока не поменяется версия.
+
+Версия хранится в cache_versions (см. db.bump_cache_version): добавление
+услуги увеличивает её и шлёт NOTIFY. Каждый воркер слушает канал
+отдельным соединением (LISTEN) и помечает каталог устаревшим; перечитывается
+он при следующем обращении. Если слушатель недоступен (например, соединение
+оборвалось), раз в CHECK_INTERVAL сверяется только номер версии — сам каталог
+перечитывается лишь при расхождении.
+"""
+
+import logging
+import os
+import select
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+import psycopg2
+import psycopg2.extensions
+
+from telegram_bot import db
+from telegram_webapp.runtime import run_async
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL = float(os.getenv("CATALOG_CHECK_INTERVAL", "30"))
+# Пауза перед переподключением слушателя (сек)
+RECONNECT_DELAY = 5.0
+
+
+@dataclass(frozen=True)
+class Catalog:
+    version: int
+    services: tuple[dict, ...]
+    by_id: Mapping[int, dict]
+
+
+def _build(version: int, base: list[dict], custom: list[dict]) -> Catalog:
+    # Базовые услуги важнее кастомных с тем же id
+    by_id: dict[int, dict] = {}
+    for s in [*base, *custom]:
+        try:
+            sid = int(s.get("id"))
+        except Exception:
+            continue
+        by_id.setdefault(sid, dict(s))
+    return Catalog(version=version, services=tuple(by_id.values()), by_id=MappingProxyType(by_id))
+
+
+class ServiceCatalog:
+    def __init__(self, base: list[dict]):
+        self.base = list(base)
+        self._lock = threading.Lock()
+        self._catalog = _build(0, self.base, [])
+        self._loaded = False
+        self._stale = True
+        self._checked_at = 0.0
+        self._listener: threading.Thread | None = None
+        self._listener_pid: int | None = None
+        self._listening = False
+
+    def get(self) -> Catalog:
+        self._start_listener()
+        if not self._stale and self._loaded:
+            if self._listening or time.monotonic() - self._checked_at < CHECK_INTERVAL:
+                return self._catalog
+            self._check_version()
+            if not self._stale:
+                return self._catalog
+        return self._reload()
+
+    def invalidate(self) -> None:
+        self._stale = True
+
+    def _check_version(self) -> None:
+        self._checked_at = time.monotonic()
+        version = run_async(db.get_cache_version("services"))
+        if version is not None and version != self._catalog.version:
+            self._stale = True
+
+    def _reload(self) -> Catalog:
+        with self._lock:
+            if not self._stale and self._loaded:
+                return self._catalog
+            # Сбрасываем до чтения: NOTIFY, пришедший во время загрузки, не потеряется
+            self._stale = False
+            snapshot = run_async(db.get_services_catalog())
+            if snapshot is None:
+                # БД недоступна — отдаём то, что есть, и попробуем в следующий раз
+                self._stale = True
+                return self._catalog
+            self._catalog = _build(snapshot["version"], self.base, snapshot["services"])
+            self._loaded = True
+            self._checked_at = time.monotonic()
+            return self._catalog
+
+    # --- LISTEN ---
+
+    def _start_listener(self) -> None:
+        pid = os.getpid()
+        if self._listener is not None and self._listener_pid == pid and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener is not None and self._listener_pid == pid and self._listener.is_alive():
+                return
+            # После fork унаследованный слушатель не наш
+            self._listening = False
+            self._stale = True
+            self._listener = threading.Thread(target=self._listen_forever, name="catalog-listener", daemon=True)
+            self._listener_pid = pid
+            self._listener.start()
+
+    def _listen_forever(self) -> None:
+        while True:
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning(f"catalog: listener failed ({e}), reconnecting in {RECONNECT_DELAY:.0f}s")
+            self._listening = False
+            # Пока не слушали, уведомления могли пропасть
+            self._stale = True
+            time.sleep(RECONNECT_DELAY)
+
+    def _listen(self) -> None:
+        conn = psycopg2.connect(db.pool.dsn, **db.pool.connect_kwargs)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {db.CACHE_CHANNEL}")
+            self._listening = True
+            self._stale = True
+            while True:
+                if select.select([conn], [], [], 60.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    note = conn.notifies.pop(0)
+                    name, _, version = note.payload.partition(":")
+                    if name == "services" and version != str(self._catalog.version):
+                        self._stale = True
+        finally:
+            try:
+                conn.close()
+            except Exception:
+                pass
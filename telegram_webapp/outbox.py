@@ -0,0 +1,157 @@
+"""Outbox уведомлений Telegram для webapp.
+
+HTTP-обработчики не ходят в Telegram API сами: enqueue_message() кладёт
+уведомление в таблицу notification_outbox, а фоновый поток-диспетчер
+отправляет его и при ошибке повторяет:
+
+- 429 — ждём ровно parameters.retry_after из ответа Telegram: уведомление
+  переносится, клиент сам не ждёт (иначе пачка могла бы пережить аренду);
+- 5xx и сетевые ошибки — экспоненциальная задержка с джиттером;
+- остальные 4xx (бот заблокирован, чат не найден) — повторять бессмысленно,
+  уведомление помечается failed.
+
+Диспетчер свой в каждом процессе (после fork запускается заново), а
+строки забираются через SKIP LOCKED с арендой на LEASE_SEC — несколько
+воркеров не отправят одно уведомление дважды. Пачка укладывается в аренду:
+новые вызовы начинаются только в первой её половине, а таймаут вызова не
+больше четверти аренды; не начатые уведомления возвращаются в очередь.
+
+Без BOT_TOKEN диспетчер не запускается — уведомления остаются в очереди.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+from telegram_bot import db
+from telegram_webapp.runtime import run_async
+from telegram_webapp.telegram_api import ApiResult, TelegramAPI, get_client
+
+logger = logging.getLogger(__name__)
+
+# Сколько уведомлений забирать за раз и на сколько «арендовать» их
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+LEASE_SEC = float(os.getenv("OUTBOX_LEASE_SEC", "60"))
+# Как часто проверять таблицу, если новых уведомлений из этого процесса не было
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 600.0
+# Отправленные уведомления храним неделю
+SENT_RETENTION_SEC = 7 * 24 * 3600
+
+_wake = threading.Event()
+_thread: threading.Thread | None = None
+_pid: int | None = None
+_lock = threading.Lock()
+
+
+def enqueue_message(chat_ids: list[int], text: str, **params) -> bool:
+    """Поставить sendMessage в очередь для каждого chat_id.
+
+    Возвращает True, если уведомления сохранены в outbox.
+    """
+
+    messages = []
+    for chat_id in chat_ids or []:
+        try:
+            chat_id = int(chat_id)
+        except Exception:
+            continue
+        messages.append((chat_id, "sendMessage", {"chat_id": chat_id, "text": text, **params}))
+    if not messages:
+        return False
+    ok = run_async(db.enqueue_notifications(messages))
+    if ok:
+        start_dispatcher()
+        _wake.set()
+    else:
+        logger.error(f"outbox: failed to enqueue {len(messages)} notification(s)")
+    return ok
+
+
+def start_dispatcher() -> None:
+    """Запустить фоновый поток отправки (один на процесс)."""
+
+    global _thread, _pid
+    pid = os.getpid()
+    if _thread is not None and _pid == pid and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is not None and _pid == pid and _thread.is_alive():
+            return
+        client = get_client()
+        if client is None:
+            if _pid != pid:
+                logger.warning("outbox: BOT_TOKEN is not set, notifications stay queued")
+                _pid = pid
+            return
+        _thread = threading.Thread(target=_run, args=(client,), name="outbox-dispatcher", daemon=True)
+        _pid = pid
+        _thread.start()
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE ** max(1, attempts))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _classify(item: dict, result: ApiResult) -> tuple[str, float, str]:
+    """Итог отправки одного уведомления: ("sent" | "retry" | "failed", задержка, ошибка)."""
+
+    if result.ok:
+        return "sent", 0.0, ""
+    if result.retry_after is not None:
+        return "retry", result.retry_after + random.uniform(0, 1), result.error
+    if result.status == 0 or result.status == 429 or result.status >= 500:
+        return "retry", _backoff(int(item["attempts"])), result.error
+    return "failed", 0.0, result.error
+
+
+def _dispatch_once(client: TelegramAPI) -> int:
+    items = run_async(db.claim_outbox(BATCH_SIZE, LEASE_SEC)) or []
+    if not items:
+        return 0
+    # Пачка уходит параллельно (разные чаты одновременно) по общему keep-alive пулу.
+    # Без ожидания 429 внутри клиента и с дедлайном — аренда не истечёт посреди отправки
+    results = client.call_many(
+        [(item["method"], item["payload"]) for item in items],
+        timeout=min(client.timeout, LEASE_SEC / 4),
+        retries=0,
+        deadline=time.monotonic() + LEASE_SEC / 2,
+    )
+    not_started = [item["id"] for item, result in zip(items, results) if result is None]
+    if not_started:
+        run_async(db.release_outbox(not_started))
+    for item, result in zip(items, results):
+        if result is None:
+            continue
+        status, delay, error = _classify(item, result)
+        if status == "sent":
+            run_async(db.mark_outbox_sent(item["id"]))
+        elif status == "retry" and int(item["attempts"]) < MAX_ATTEMPTS:
+            logger.warning(f"outbox: #{item['id']} to {item['chat_id']} retry in {delay:.1f}s ({error})")
+            run_async(db.mark_outbox_retry(item["id"], delay, error))
+        else:
+            logger.error(f"outbox: #{item['id']} to {item['chat_id']} failed ({error})")
+            run_async(db.mark_outbox_failed(item["id"], error))
+    return len(items)
+
+
+def _run(client: TelegramAPI) -> None:
+    last_purge = 0.0
+    while True:
+        # Сбрасываем до выборки: enqueue во время отправки не потеряется
+        _wake.clear()
+        try:
+            if _dispatch_once(client) >= BATCH_SIZE:
+                # Очередь не пуста — сразу берём следующую пачку
+                continue
+            if time.monotonic() - last_purge > 3600:
+                run_async(db.purge_outbox(time.time() - SENT_RETENTION_SEC))
+                last_purge = time.monotonic()
+        except Exception:
+            logger.exception("outbox: dispatch failed")
+        _wake.wait(POLL_INTERVAL)
@@ -0,0 +1,50 @@
+"""Долгоживущий event loop для вызова async-функций из Flask.
+
+Функции telegram_bot.db асинхронные, а Flask-вьюхи синхронные.
+Раньше каждый вызов шёл через asyncio.run(), который создаёт и закрывает
+новый event loop. Здесь loop один на процесс: он крутится в фоновом
+потоке, а вьюхи отдают ему корутины через run_async().
+"""
+
+import asyncio
+import os
+import threading
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_thread: threading.Thread | None = None
+_pid: int | None = None
+_lock = threading.Lock()
+
+
+def _serve(loop: asyncio.AbstractEventLoop) -> None:
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Loop текущего процесса (создаётся лениво и заново после fork)."""
+
+    global _loop, _thread, _pid
+    pid = os.getpid()
+    if _loop is not None and _pid == pid and _thread is not None and _thread.is_alive():
+        return _loop
+    with _lock:
+        if _loop is None or _pid != pid or _thread is None or not _thread.is_alive():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_serve, args=(loop,), name="webapp-loop", daemon=True)
+            thread.start()
+            _loop, _thread, _pid = loop, thread, pid
+    return _loop
+
+
+def run_async(coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+    """Выполнить корутину на общем loop и дождаться результата.
+
+    Нельзя вызывать из самого loop (получится deadlock) — только из потоков Flask.
+    """
+
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    return future.result(timeout)
@@ -0,0 +1,348 @@
+"""Индекс свободных слотов онлайн-записи в памяти воркера.
+
+День делится на ячейки по BOOKING_STEP_MIN минут; всё хранится битовыми
+масками (int): бит k — ячейка, начинающаяся в k * step минут от полуночи.
+
+- занятость дня — OR ячеек всех подтверждённых записей этого дня;
+- доступность услуги на дату — маска разрешённых стартов
+  (нет настройки в БД — дефолтные слоты);
+- свободные старты для (дата, набор услуг, длительность) считаются
+  из этих масок и кэшируются до ближайшего изменения дня.
+
+Изменения, сделанные этим воркером (создание/отмена/перенос записи,
+настройка доступности), применяются к индексу сразу. Изменения других
+процессов подхватываются по истечении ttl — после него день
+перечитывается из БД. Перед записью разрешённые старты проверяются по
+БД (allowed_start_ts(fresh=True)), так что устаревший индекс влияет
+только на то, что показано клиенту.
+
+Старты записи всегда лежат на сетке шага, поэтому для них проверка
+пересечений по ячейкам точная. Записи с нестандартными границами
+занимают ячейки с округлением наружу — это может лишь скрыть слот,
+но не приведёт к двойной записи.
+"""
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from telegram_bot import db
+from telegram_bot.env import local_timezone
+from telegram_webapp.runtime import run_async
+
+
+@dataclass
+class _Day:
+    loaded_at: float
+    # booking_id -> (start_ts, end_ts)
+    bookings: dict[int, tuple[float, float]] = field(default_factory=dict)
+    occupied: int = 0
+    # Счётчик изменений: загрузка, начатая до изменения, не должна его затереть
+    version: int = 0
+
+
+class SlotIndex:
+    def __init__(self, step_min: int, default_hhmm: list[str], work_hours: tuple[int, int], ttl: float = 60.0):
+        self.step_min = int(step_min)
+        self.cells = (24 * 60) // self.step_min
+        self.work_start_cell = work_hours[0] * 60 // self.step_min
+        self.work_end_cell = work_hours[1] * 60 // self.step_min
+        self.default_mask = self._hhmm_to_mask(default_hhmm)
+        self.ttl = float(ttl)
+
+        self._lock = threading.Lock()
+        self._days: dict[str, _Day] = {}
+        # (service_id, date) -> (маска стартов, loaded_at)
+        self._availability: dict[tuple[int, str], tuple[int, float]] = {}
+        # (date, service_ids, n_cells) -> маска свободных стартов
+        self._free: dict[tuple[str, tuple[int, ...], int], int] = {}
+        # date -> timestamps начал всех ячеек дня (с учётом таймзоны)
+        self._starts: dict[str, list[int]] = {}
+
+    # --- masks ---
+
+    def _hhmm_to_mask(self, slots) -> int:
+        if isinstance(slots, str):
+            try:
+                slots = json.loads(slots)
+            except Exception:
+                return 0
+        mask = 0
+        for value in slots or []:
+            try:
+                hh, mm = str(value).strip().split(":")[:2]
+                minutes = int(hh) * 60 + int(mm)
+            except Exception:
+                continue
+            if 0 <= minutes < 24 * 60 and minutes % self.step_min == 0:
+                mask |= 1 << (minutes // self.step_min)
+        return mask
+
+    def _cell_of(self, ts: float, ceil: bool = False) -> int:
+        dt = datetime.fromtimestamp(float(ts), local_timezone)
+        seconds = dt.hour * 3600 + dt.minute * 60 + dt.second
+        step = self.step_min * 60
+        return -(-seconds // step) if ceil else seconds // step
+
+    def _interval_mask(self, start_ts: float, end_ts: float) -> int:
+        first = max(0, self._cell_of(start_ts))
+        if _day_of(end_ts) != _day_of(start_ts):
+            last = self.cells
+        else:
+            last = min(self.cells, self._cell_of(end_ts, ceil=True))
+        if last <= first:
+            return 0
+        return ((1 << (last - first)) - 1) << first
+
+    def _start_ts(self, date_str: str, cell: int) -> int:
+        starts = self._starts.get(date_str)
+        if starts is None:
+            base = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=local_timezone)
+            starts = [
+                int(base.replace(hour=m // 60, minute=m % 60).timestamp())
+                for m in range(0, 24 * 60, self.step_min)
+            ]
+            if len(self._starts) > 512:
+                self._starts.clear()
+            self._starts[date_str] = starts
+        return starts[cell]
+
+    def _recount(self, day: _Day) -> None:
+        occupied = 0
+        for start_ts, end_ts in day.bookings.values():
+            occupied |= self._interval_mask(start_ts, end_ts)
+        day.occupied = occupied
+
+    def _drop_free(self, date_str: str) -> None:
+        for key in [k for k in self._free if k[0] == date_str]:
+            del self._free[key]
+
+    # --- loading ---
+
+    def _ensure(self, dates: list[str], service_ids: tuple[int, ...]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            stale_days = [d for d in dates if d not in self._days or now - self._days[d].loaded_at > self.ttl]
+            stale_keys = [
+                (sid, d) for d in dates for sid in service_ids
+                if (sid, d) not in self._availability or now - self._availability[(sid, d)][1] > self.ttl
+            ]
+            versions = {d: self._days[d].version for d in stale_days if d in self._days}
+        if stale_days:
+            self._load_days(sorted(stale_days), versions)
+        if stale_keys:
+            self._load_availability(stale_keys)
+
+    def _load_days(self, dates: list[str], versions: dict[str, int]) -> None:
+        range_start = _day_start_ts(dates[0])
+        range_end = _day_start_ts(dates[-1]) + 24 * 3600
+        bookings = run_async(db.get_bookings_in_range(range_start, range_end))
+        if bookings is None:
+            # БД недоступна: день без записей выглядел бы полностью свободным,
+            # поэтому ничего не кэшируем — запрос вернёт ошибку, следующий перечитает
+            raise RuntimeError("bookings are unavailable")
+
+        by_day: dict[str, dict[int, tuple[float, float]]] = {d: {} for d in dates}
+        for b in bookings:
+            try:
+                start_ts, end_ts = float(b["start_ts"]), float(b["end_ts"])
+                by_day.setdefault(_day_of(start_ts), {})[int(b["id"])] = (start_ts, end_ts)
+            except Exception:
+                continue
+
+        now = time.monotonic()
+        with self._lock:
+            for d in dates:
+                current = self._days.get(d)
+                if current is not None and current.version != versions.get(d, current.version):
+                    # День поменялся, пока мы читали БД — перечитаем при следующем запросе
+                    current.loaded_at = 0.0
+                    continue
+                day = _Day(loaded_at=now, bookings=by_day[d], version=current.version if current else 0)
+                self._recount(day)
+                self._days[d] = day
+                self._drop_free(d)
+
+    def _load_availability(self, keys: list[tuple[int, str]]) -> bool:
+        service_ids = sorted({sid for sid, _ in keys})
+        dates = sorted({d for _, d in keys})
+        rows = run_async(db.get_service_availability_range(service_ids, dates[0], dates[-1]))
+        if rows is None:
+            # БД недоступна: не подменяем настройки админа дефолтными слотами
+            return False
+        found = {}
+        for row in rows:
+            try:
+                found[(int(row["service_id"]), str(row["date"]))] = self._hhmm_to_mask(row.get("slots"))
+            except Exception:
+                continue
+
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                self._availability[key] = (found.get(key, self.default_mask), now)
+                self._drop_free(key[1])
+        return True
+
+    # --- queries ---
+
+    def _allowed_mask(self, date_str: str, service_ids: tuple[int, ...]) -> int:
+        # Вызывается под self._lock
+        mask = (1 << self.cells) - 1
+        for sid in service_ids:
+            mask &= self._availability.get((sid, date_str), (self.default_mask, 0.0))[0]
+        return mask
+
+    def _free_mask(self, date_str: str, service_ids: tuple[int, ...], duration_sec: int) -> int:
+        n = max(1, -(-int(duration_sec) // (self.step_min * 60)))
+        key = (date_str, service_ids, n)
+        with self._lock:
+            cached = self._free.get(key)
+            if cached is not None:
+                return cached
+            day = self._days.get(date_str)
+            occupied = day.occupied if day else 0
+            free = self._allowed_mask(date_str, service_ids)
+            # старт k свободен, если ячейки k..k+n-1 не заняты
+            for j in range(n):
+                free &= ~(occupied >> j)
+            # и запись целиком помещается в рабочий день
+            last_start = self.work_end_cell - n
+            if last_start < self.work_start_cell:
+                free = 0
+            else:
+                free &= ((1 << (last_start - self.work_start_cell + 1)) - 1) << self.work_start_cell
+            self._free[key] = free
+            return free
+
+    def _mask_to_starts(self, date_str: str, mask: int, now_ts: float | None) -> list[int]:
+        out = []
+        cell = 0
+        while mask:
+            if mask & 1:
+                start_ts = self._start_ts(date_str, cell)
+                if now_ts is None or start_ts >= now_ts:
+                    out.append(start_ts)
+            mask >>= 1
+            cell += 1
+        return out
+
+    def allowed_start_ts(self, date_str: str, service_ids: list[int], fresh: bool = False) -> list[int]:
+        """Разрешённые админом старты (без учёта занятости).
+
+        fresh=True — расписание перечитывается из БД (проверка перед записью);
+        если БД недоступна, разрешённых стартов нет.
+        """
+
+        sids = _normalize(service_ids)
+        if not sids:
+            return []
+        if fresh:
+            if not self._load_availability([(sid, date_str) for sid in sids]):
+                return []
+        else:
+            self._ensure([date_str], sids)
+        with self._lock:
+            mask = self._allowed_mask(date_str, sids)
+        return self._mask_to_starts(date_str, mask, None)
+
+    def free_start_ts(self, date_str: str, service_ids: list[int], duration_sec: int, now_ts: float) -> list[int]:
+        sids = _normalize(service_ids)
+        if not sids:
+            return []
+        self._ensure([date_str], sids)
+        return self._mask_to_starts(date_str, self._free_mask(date_str, sids, duration_sec), now_ts)
+
+    def available_dates(self, dates: list[str], service_ids: list[int], duration_sec: int, now_ts: float) -> list[str]:
+        sids = _normalize(service_ids)
+        if not sids or not dates:
+            return []
+        self._ensure(dates, sids)
+        out = []
+        for d in dates:
+            mask = self._free_mask(d, sids, duration_sec)
+            if not mask:
+                continue
+            # Сегодня все старты могли уже пройти: достаточно проверить последний
+            if self._start_ts(d, mask.bit_length() - 1) < now_ts:
+                continue
+            out.append(d)
+        return out
+
+    # --- incremental updates ---
+
+    def booking_added(self, booking: dict | None) -> None:
+        if not booking or str(booking.get("status") or "confirmed") != "confirmed":
+            return
+        try:
+            booking_id = int(booking["id"])
+            start_ts, end_ts = float(booking["start_ts"]), float(booking["end_ts"])
+        except Exception:
+            return
+        date_str = _day_of(start_ts)
+        with self._lock:
+            day = self._days.get(date_str)
+            if day is None:
+                return
+            day.bookings[booking_id] = (start_ts, end_ts)
+            day.occupied |= self._interval_mask(start_ts, end_ts)
+            day.version += 1
+            self._drop_free(date_str)
+
+    def booking_removed(self, booking: dict | None) -> None:
+        if not booking:
+            return
+        try:
+            booking_id = int(booking["id"])
+        except Exception:
+            return
+        with self._lock:
+            for date_str, day in self._days.items():
+                if day.bookings.pop(booking_id, None) is not None:
+                    self._recount(day)
+                    day.version += 1
+                    self._drop_free(date_str)
+                    break
+
+    def booking_moved(self, booking: dict | None) -> None:
+        self.booking_removed(booking)
+        self.booking_added(booking)
+
+    def availability_set(self, service_id: int, date_str: str, slots: list[str]) -> None:
+        with self._lock:
+            self._availability[(int(service_id), date_str)] = (self._hhmm_to_mask(slots), time.monotonic())
+            self._drop_free(date_str)
+
+    def invalidate(self, date_str: str | None = None) -> None:
+        """Сбросить день (или весь индекс) — он перечитается при следующем запросе."""
+
+        with self._lock:
+            if date_str is None:
+                self._days.clear()
+                self._availability.clear()
+                self._free.clear()
+                return
+            self._days.pop(date_str, None)
+            for key in [k for k in self._availability if k[1] == date_str]:
+                del self._availability[key]
+            self._drop_free(date_str)
+
+
+def _normalize(service_ids: list[int]) -> tuple[int, ...]:
+    out = set()
+    for sid in service_ids or []:
+        try:
+            out.add(int(sid))
+        except Exception:
+            continue
+    return tuple(sorted(out))
+
+
+def _day_of(ts: float) -> str:
+    return datetime.fromtimestamp(float(ts), local_timezone).strftime("%Y-%m-%d")
+
+
+def _day_start_ts(date_str: str) -> float:
+    return datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=local_timezone).timestamp()
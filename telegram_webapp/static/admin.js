@@ -467,18 +467,59 @@
         }
     }
 
+    // Записи грузятся страницами (курсор next_cursor от сервера), по умолчанию — ближайшая неделя
+    const BOOKINGS_PAGE_SIZE = 50;
+    let BOOKINGS_LOADED = [];
+    let BOOKINGS_CURSOR = null;
+    // Номер текущего списка: ответы запросов, начатых до смены фильтра, отбрасываются
+    let BOOKINGS_GENERATION = 0;
+
+    function bookingsFilter() {
+        const periodEl = document.getElementById('bookings-period');
+        const statusEl = document.getElementById('bookings-status');
+        const period = periodEl ? String(periodEl.value || 'week') : 'week';
+        const filter = { status: statusEl ? String(statusEl.value || 'confirmed') : 'confirmed' };
+        if (period === 'week') filter.date_to = addDaysISO(todayISO(), 6);
+        else if (period === 'month') filter.date_to = addDaysISO(todayISO(), 29);
+        return filter;
+    }
+
     async function loadBookings() {
+        BOOKINGS_GENERATION += 1;
+        BOOKINGS_LOADED = [];
+        BOOKINGS_CURSOR = null;
+        await loadMoreBookings();
+    }
+
+    async function loadMoreBookings() {
+        const more = document.getElementById('bookings-more');
+        if (more) more.disabled = true;
+        const generation = BOOKINGS_GENERATION;
+        const data = await api('/api/admin/bookings/upcoming', {
+            method: 'POST',
+            body: JSON.stringify(Object.assign(
+                { initData: INIT_DATA, limit: BOOKINGS_PAGE_SIZE, cursor: BOOKINGS_CURSOR },
+                bookingsFilter()
+            )),
+        });
+        if (generation !== BOOKINGS_GENERATION) return;
+        const page = Array.isArray(data && data.bookings) ? data.bookings : [];
+        BOOKINGS_LOADED = BOOKINGS_LOADED.concat(page);
+        BOOKINGS_CURSOR = (data && data.next_cursor) || null;
+        if (more) {
+            more.disabled = false;
+            more.style.display = BOOKINGS_CURSOR ? 'inline-flex' : 'none';
+        }
+        renderBookings(BOOKINGS_LOADED);
+    }
+
+    function renderBookings(bookings) {
         const root = document.getElementById('bookings-root');
         const empty = document.getElementById('bookings-empty');
         if (!root) return;
         root.innerHTML = '';
         if (empty) empty.style.display = 'none';
 
-        const data = await api('/api/admin/bookings/upcoming', {
-            method: 'POST',
-            body: JSON.stringify({ initData: INIT_DATA }),
-        });
-        const bookings = Array.isArray(data && data.bookings) ? data.bookings : [];
         if (!bookings.length) {
             if (empty) empty.style.display = 'block';
             return;
@@ -509,6 +550,7 @@
                 const dt = escapeHtml(b.start_label || '—');
                 const price = b.total_price != null ? `${Number(b.total_price)} ₽` : '';
                 const comment = escapeHtml(b.comment || '');
+                const cancelled = b.status === 'cancelled' ? '<span>• ❌ отменена</span>' : '';
                 item.innerHTML = `
                     <div class="service-title">
                         <strong>#${b.id} • ${name}</strong>
@@ -518,6 +560,7 @@
                         <span>🗓️ ${dt}</span>
                         ${b.services_summary ? `<span>• ${escapeHtml(b.services_summary)}</span>` : ''}
                         ${comment ? `<span>• 💬 ${comment}</span>` : ''}
+                        ${cancelled}
                     </div>
                 `;
                 item.addEventListener('click', () => openBooking(b.id));
@@ -810,6 +853,12 @@
     function wireActions() {
         const refresh = document.getElementById('refresh-bookings');
         if (refresh) refresh.addEventListener('click', loadBookings);
+        const more = document.getElementById('bookings-more');
+        if (more) more.addEventListener('click', loadMoreBookings);
+        ['bookings-period', 'bookings-status'].forEach((id) => {
+            const el = document.getElementById(id);
+            if (el) el.addEventListener('change', loadBookings);
+        });
 
         const createExternal = document.getElementById('create-external-booking');
         if (createExternal) createExternal.addEventListener('click', openExternalBookingModal);
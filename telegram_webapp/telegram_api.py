@@ -0,0 +1,158 @@
+"""HTTP-клиент Telegram Bot API для webapp (синхронный, на requests).
+
+- одна requests.Session на процесс: пул keep-alive соединений к API,
+  DNS/TCP/TLS не повторяются на каждое уведомление;
+- таймаут на каждый вызов;
+- 429: короткий retry_after (не больше MAX_INLINE_RETRY_AFTER) выжидаем
+  прямо здесь, длинный возвращаем вызывающему (outbox переносит отправку);
+- call_many() отправляет пачку параллельно: разные чаты одновременно,
+  сообщения в один чат — по порядку.
+
+Адрес API задаётся TELEGRAM_API_URL — так клиент можно направить на
+локальный фейковый сервер (benchmarks/fake_bot_api.py).
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = (os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org").strip().rstrip("/")
+TIMEOUT = float(os.getenv("TELEGRAM_API_TIMEOUT", "10"))
+# Соединений в пуле и параллельных отправок в call_many
+POOL_SIZE = int(os.getenv("TELEGRAM_API_POOL_SIZE", "8"))
+MAX_INLINE_RETRY_AFTER = float(os.getenv("TELEGRAM_API_MAX_INLINE_RETRY_AFTER", "5"))
+
+
+@dataclass(frozen=True)
+class ApiResult:
+    ok: bool
+    # HTTP-статус; 0 — сетевая ошибка или таймаут
+    status: int
+    error: str = ""
+    retry_after: float | None = None
+    result: Any = None
+
+
+class TelegramAPI:
+    def __init__(
+            self,
+            token: str,
+            base_url: str = API_URL,
+            timeout: float = TIMEOUT,
+            pool_size: int = POOL_SIZE,
+            max_inline_retry_after: float = MAX_INLINE_RETRY_AFTER,
+    ):
+        self.base_url = f"{base_url.rstrip('/')}/bot{token}"
+        self.timeout = float(timeout)
+        self.pool_size = max(1, int(pool_size))
+        self.max_inline_retry_after = float(max_inline_retry_after)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _post(self, method: str, payload: dict, timeout: float | None) -> ApiResult:
+        try:
+            r = self.session.post(f"{self.base_url}/{method}", json=payload, timeout=timeout or self.timeout)
+        except requests.RequestException as e:
+            return ApiResult(ok=False, status=0, error=f"network: {e}")
+        try:
+            body = r.json()
+        except ValueError:
+            body = {}
+        if r.status_code == 200 and body.get("ok", True):
+            return ApiResult(ok=True, status=200, result=body.get("result"))
+
+        error = f"{r.status_code}: {body.get('description') or r.text[:200]}"
+        retry_after = None
+        if r.status_code == 429:
+            try:
+                retry_after = float((body.get("parameters") or {}).get("retry_after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        return ApiResult(ok=False, status=r.status_code, error=error, retry_after=retry_after)
+
+    def call(self, method: str, payload: dict, timeout: float | None = None, retries: int = 1) -> ApiResult:
+        """Вызвать метод Bot API; на короткий 429 — подождать и повторить до retries раз."""
+
+        result = self._post(method, payload, timeout)
+        for _ in range(max(0, retries)):
+            if result.retry_after is None or result.retry_after > self.max_inline_retry_after:
+                break
+            time.sleep(result.retry_after)
+            result = self._post(method, payload, timeout)
+        return result
+
+    def send_message(self, chat_id: int, text: str, **params) -> ApiResult:
+        return self.call("sendMessage", {"chat_id": chat_id, "text": text, **params})
+
+    def call_many(
+            self,
+            calls: list[tuple[str, dict]],
+            timeout: float | None = None,
+            retries: int = 1,
+            deadline: float | None = None,
+    ) -> list[ApiResult | None]:
+        """Параллельно выполнить вызовы [(method, payload)]. Результаты — в том же порядке.
+
+        deadline (time.monotonic()): после него новые вызовы не начинаются,
+        их результат — None (вызов не выполнялся).
+        """
+
+        # Сообщения в один чат отправляем последовательно, чтобы не перепутать порядок
+        by_chat: dict[Any, list[int]] = {}
+        for i, (_, payload) in enumerate(calls):
+            by_chat.setdefault(payload.get("chat_id", i), []).append(i)
+
+        results: list[ApiResult | None] = [None] * len(calls)
+
+        def run(indexes: list[int]) -> None:
+            for i in indexes:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                method, payload = calls[i]
+                results[i] = self.call(method, payload, timeout=timeout, retries=retries)
+
+        groups = list(by_chat.values())
+        if len(groups) == 1:
+            run(groups[0])
+        else:
+            list(self._get_executor().map(run, groups))
+        return results
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="tg-api")
+        return self._executor
+
+
+_client: TelegramAPI | None = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> TelegramAPI | None:
+    """Общий клиент процесса (после fork создаётся заново) или None без BOT_TOKEN."""
+
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    token = (os.getenv("BOT_TOKEN") or "").strip()
+    if not token:
+        return None
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            _client = TelegramAPI(token)
+            _client_pid = pid
+    return _client